@@ -0,0 +1,139 @@
+import itertools
+import numpy as np
+
+TOP_CARDS = 20
+
+class BlockingIndex(object):
+  # Index from each card to the invalid combinations it blocks, with how many
+  # copies short each one is, built from the deduplicated findings so valid
+  # combinations are only counted, never kept. Held as flat (combination,
+  # card, copies short) entries, sorted by card once the results are in.
+
+  def __init__(self):
+    self.combo_ids = {}
+    self.card_ids = {}
+    self.valid = 0
+    self.entry_combos = []
+    self.entry_cards = []
+    self.entry_short = []
+    self.frozen = False
+
+  def add(self, combo, missing_cards):
+    # Each combination is expected once, as the findings list it
+    if len(missing_cards) == 0:
+      self.valid += 1
+      return
+    combo_id = self.combo_ids[combo] = len(self.combo_ids)
+    for card, quantity in missing_cards.items():
+      self.entry_combos.append(combo_id)
+      self.entry_cards.append(self.card_ids.setdefault(card, len(self.card_ids)))
+      self.entry_short.append(quantity)
+    self.frozen = False
+
+  def freeze(self):
+    if self.frozen:
+      return
+    combos = np.array(self.entry_combos, dtype=np.int64)
+    cards = np.array(self.entry_cards, dtype=np.int64)
+    short = np.array(self.entry_short, dtype=np.int64)
+    order = np.lexsort((combos, cards))
+    self.combos = combos[order]
+    self.cards = cards[order]
+    self.short = short[order]
+    self.offsets = np.searchsorted(self.cards, np.arange(len(self.card_ids) + 1))
+    self.card_codes = sorted(self.card_ids, key=self.card_ids.get)
+    self.combo_keys = sorted(self.combo_ids, key=self.combo_ids.get)
+    # distinct cards and total copies missing per combination
+    self.distinct = np.bincount(combos, minlength=len(self.combo_ids))
+    self.total = np.bincount(combos, weights=short, minlength=len(self.combo_ids)).astype(np.int64)
+    self.frozen = True
+
+  def blocked_by(self, card):
+    # (combo, copies short) for every invalid combination missing the card
+    self.freeze()
+    card_id = self.card_ids.get(card)
+    if card_id is None:
+      return []
+    start, end = self.offsets[card_id], self.offsets[card_id + 1]
+    return [(self.combo_keys[combo], quantity) for combo, quantity
+            in zip(self.combos[start:end].tolist(), self.short[start:end].tolist())]
+
+  def single_unlocks(self):
+    # Per card: combinations missing that card alone, and the copies needed
+    # to unlock all of them
+    self.freeze()
+    alone = self.distinct[self.combos] == 1
+    counts = np.bincount(self.cards[alone], minlength=len(self.card_ids))
+    copies = np.zeros(len(self.card_ids), dtype=np.int64)
+    np.maximum.at(copies, self.cards[alone], self.short[alone])
+    return counts, copies
+
+  def top_cards(self, k=TOP_CARDS):
+    counts, copies = self.single_unlocks()
+    ranked = np.argsort(-counts, kind='stable')[:k]
+    return [{'card': self.card_codes[card], 'unlocks': int(counts[card]), 'copies': int(copies[card])}
+            for card in ranked.tolist() if counts[card] > 0]
+
+  def top_pairs(self, k=TOP_CARDS):
+    # A pair unlocks what each card unlocks alone and the combinations
+    # missing exactly those two; a pair is only listed if both cards count.
+    # Any of the k best pairs either shares such a combination or is two of
+    # the k + 1 best single cards, so only those are scored.
+    counts, copies = self.single_unlocks()
+    two = self.distinct[self.combos] == 2
+    pair_combos, pair_cards, pair_short = self.combos[two], self.cards[two], self.short[two]
+    order = np.argsort(pair_combos, kind='stable')
+    pair_cards = pair_cards[order].reshape(-1, 2)
+    pair_short = pair_short[order].reshape(-1, 2)
+    together = {}
+    for (a, b), (short_a, short_b) in zip(pair_cards.tolist(), pair_short.tolist()):
+      count, copies_a, copies_b = together.get((a, b), (0, 0, 0))
+      together[(a, b)] = (count + 1, max(copies_a, short_a), max(copies_b, short_b))
+    best_singles = np.argsort(-counts, kind='stable')[:k + 1]
+    candidates = set(together) | set(itertools.combinations(sorted(best_singles.tolist()), 2))
+
+    pairs = []
+    for a, b in candidates:
+      count, copies_a, copies_b = together.get((a, b), (0, 0, 0))
+      unlocks = int(counts[a] + counts[b]) + count
+      if count or (counts[a] and counts[b]):
+        pair = sorted([(self.card_codes[a], int(max(copies[a], copies_a))), (self.card_codes[b], int(max(copies[b], copies_b)))])
+        pairs.append({'cards': [code for code, copies_needed in pair], 'unlocks': unlocks,
+                      'copies': [copies_needed for code, copies_needed in pair]})
+    pairs.sort(key=lambda pair: (-pair['unlocks'], pair['cards']))
+    return pairs[:k]
+
+  def missing_at_most(self, quantity):
+    # Invalid combinations short of at most this many copies in all, fewest first
+    self.freeze()
+    near = np.flatnonzero(self.total <= quantity)
+    near = near[np.argsort(self.total[near], kind='stable')]
+    return [(self.combo_keys[combo], int(self.total[combo])) for combo in near.tolist()]
+
+  def summary(self, k=TOP_CARDS, near_misses=(1, 2, 3)):
+    self.freeze()
+    return {
+      'valid': self.valid,
+      'invalid': len(self.combo_ids),
+      'cards': self.top_cards(k),
+      'pairs': self.top_pairs(k),
+      'missing_at_most': {str(quantity): int((self.total <= quantity).sum()) for quantity in near_misses},
+    }
+
+  def save(self, filename):
+    self.freeze()
+    np.savez_compressed(filename, combos=self.combos, cards=self.cards, short=self.short, valid=self.valid,
+                        card_codes=np.array(self.card_codes, dtype=str), combo_keys=np.array(self.combo_keys, dtype=str))
+
+def load_blocking_index(filename):
+  # The saved index answers the same questions without the results file
+  index = BlockingIndex()
+  with np.load(filename) as data:
+    index.valid = int(data['valid'])
+    index.card_ids = {code: number for number, code in enumerate(data['card_codes'].tolist())}
+    index.combo_ids = {combo: number for number, combo in enumerate(data['combo_keys'].tolist())}
+    index.entry_combos = data['combos'].tolist()
+    index.entry_cards = data['cards'].tolist()
+    index.entry_short = data['short'].tolist()
+  index.freeze()
+  return index
@@ -0,0 +1,60 @@
+import json, os
+import numpy as np
+from analyser.canonical import file_hash
+from analyser.matrix import DemandMatrix
+from analyser.snapshot import SNAPSHOT_DIR, load_snapshot, write_array, write_json
+
+CACHE_DIR = 'matrix_cache'
+ARRAYS = ('deck_offsets', 'deck_columns', 'deck_quantities', 'available')
+
+def input_hashes(cards_filename, decks_filename, collection_filename):
+  return {
+    'cards': file_hash(cards_filename),
+    'decks': file_hash(decks_filename),
+    'collection': file_hash(collection_filename),
+  }
+
+def save_matrix(matrix, hashes, cache_dir=CACHE_DIR):
+  if not os.path.isdir(cache_dir):
+    os.makedirs(cache_dir)
+  # The old metadata goes first and the new last, so arrays from two
+  # different builds are never read together, even after a crash
+  meta_filename = os.path.join(cache_dir, 'meta.json')
+  if os.path.exists(meta_filename):
+    os.remove(meta_filename)
+  for name in ARRAYS:
+    write_array(getattr(matrix, name), os.path.join(cache_dir, name + '.npy'))
+  write_json({
+    'hashes': hashes,
+    'arrays': ARRAYS,
+    'deck_ids': matrix.deck_ids,
+    'card_codes': matrix.card_codes,
+    'decks': matrix.decks,
+  }, meta_filename)
+
+def read_matrix(hashes, cache_dir=CACHE_DIR):
+  meta_filename = os.path.join(cache_dir, 'meta.json')
+  if not os.path.exists(meta_filename):
+    return None
+  with open(meta_filename) as f:
+    meta = json.load(f)
+  # a cache written with other arrays is rebuilt like a stale one
+  if meta.get('hashes') != hashes or meta.get('arrays') != list(ARRAYS):
+    return None
+  arrays = [np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r') for name in ARRAYS]
+  return DemandMatrix.from_arrays(meta['deck_ids'], meta['card_codes'], *arrays, decks=meta['decks'])
+
+def load_matrix(cards_filename, decks_filename, collection_filename, cache_dir=CACHE_DIR, snapshot_dir=SNAPSHOT_DIR):
+  # Compiled deck demands are reused until cards, decks or collection change
+  hashes = input_hashes(cards_filename, decks_filename, collection_filename)
+  matrix = read_matrix(hashes, cache_dir)
+  if matrix is not None:
+    return matrix
+
+  print('Compiling deck demands...')
+  snapshot = load_snapshot(cards_filename, decks_filename, snapshot_dir)
+  with open(collection_filename) as f:
+    collection = json.load(f)
+  matrix = snapshot.demand_matrix(collection)
+  save_matrix(matrix, hashes, cache_dir)
+  return matrix
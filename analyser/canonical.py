@@ -0,0 +1,38 @@
+import hashlib, json, os
+
+def file_hash(filename):
+  sha = hashlib.sha1()
+  with open(filename, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 16), b''):
+      sha.update(chunk)
+  return sha.hexdigest()
+
+def canonical_code(cards, card):
+  # Alternate printings (e.g. core and revised core) share the lowest code
+  return min([cards[card]['code']] + cards[card]['maps_to'])
+
+def build_card_index(cards):
+  return {card: canonical_code(cards, card) for card in cards}
+
+def index_filename_for(cards_filename):
+  return os.path.splitext(cards_filename)[0] + '_index.json'
+
+def load_card_index(cards_filename, index_filename=None):
+  if index_filename is None:
+    index_filename = index_filename_for(cards_filename)
+  cards_hash = file_hash(cards_filename)
+
+  if os.path.exists(index_filename):
+    with open(index_filename) as f:
+      cached = json.load(f)
+    if cached.get('cards_hash') == cards_hash:
+      return cached['index']
+
+  with open(cards_filename) as f:
+    cards = json.load(f)
+  index = build_card_index(cards)
+
+  with open(index_filename, 'w') as f:
+    f.write(json.dumps({'cards_hash': cards_hash, 'index': index}))
+
+  return index
@@ -0,0 +1,73 @@
+from collections import OrderedDict
+import json, os
+
+IMAGE_URL = 'https://netrunnerdb.com/card_image/{}.png'
+
+def prepare_card(card):
+  card = OrderedDict(card)
+  if 'image_url' not in card:
+    card['image_url'] = IMAGE_URL.format(card['code'])
+  card['maps_to'] = []
+  return card
+
+def card_fields(card):
+  return {key: value for key, value in card.items() if key != 'maps_to'}
+
+def resolve_maps_to(cards, titles=None):
+  # Alternate printings share a title, so one pass grouping codes by title
+  # replaces comparing every card with every other card. With titles given
+  # only those groups are recomputed.
+  groups = OrderedDict()
+  for code in cards:
+    title = cards[code]['title']
+    if titles is None or title in titles:
+      groups.setdefault(title, []).append(code)
+  for codes in groups.values():
+    for code in codes:
+      cards[code]['maps_to'] = [other for other in codes if other != code]
+  return cards
+
+def read_cards(card_filename):
+  if not os.path.exists(card_filename):
+    return OrderedDict()
+  with open(card_filename) as f:
+    return json.load(f, object_pairs_hook=OrderedDict)
+
+def write_card_file(cards, card_filename):
+  with open(card_filename + '.tmp', 'w') as f:
+    f.write(json.dumps(cards, indent=2))
+  os.replace(card_filename + '.tmp', card_filename)
+
+def update_cards(card_filename, all_cards):
+  # Patch the existing cards file with the cards returned by the API; only the
+  # title groups touched by new, changed or removed cards are re-resolved
+  cards = read_cards(card_filename)
+  regenerate = len(cards) == 0
+  affected = set()
+  changed = []
+  seen = set()
+
+  for card in all_cards:
+    card = prepare_card(card)
+    code = card['code']
+    seen.add(code)
+    existing = cards.get(code)
+    if existing is not None and card_fields(existing) == card_fields(card):
+      continue
+    if existing is not None:
+      affected.add(existing['title'])
+      card['maps_to'] = existing['maps_to']
+    affected.add(card['title'])
+    cards[code] = card
+    changed.append(code)
+
+  for code in [code for code in cards if code not in seen]:
+    affected.add(cards[code]['title'])
+    del cards[code]
+    changed.append(code)
+
+  if changed:
+    resolve_maps_to(cards, None if regenerate else affected)
+    write_card_file(cards, card_filename)
+
+  return changed
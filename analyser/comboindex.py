@@ -0,0 +1,63 @@
+import numpy as np
+
+class ComboIndex(object):
+  # Inverted index from each deck to the combinations it is part of, held as
+  # a bitset (a Python int, bit i set for the i-th combination). Picking decks
+  # narrows the other factions by AND-ing bitsets, one test per deck, so no
+  # combination string is split again after the index is built.
+
+  def __init__(self, deck_factions, combos=()):
+    self.deck_factions = deck_factions
+    self.combos = []
+    self.factions = []
+    self.faction_of = {}
+    positions = {}
+    for combo in combos:
+      for deck_id in combo.split(','):
+        if deck_id not in positions:
+          faction = self.deck_factions[deck_id]['faction_code']
+          if faction not in self.factions:
+            self.factions.append(faction)
+          self.faction_of[deck_id] = faction
+          positions[deck_id] = []
+        positions[deck_id].append(len(self.combos))
+      self.combos.append(combo)
+    # OR-ing bits into growing ints one combination at a time is quadratic,
+    # so each bitset is packed from its positions in one go
+    self.bits = {}
+    for deck_id, indices in positions.items():
+      flags = np.zeros(len(self.combos), dtype=bool)
+      flags[indices] = True
+      self.bits[deck_id] = int.from_bytes(np.packbits(flags, bitorder='little').tobytes(), 'little')
+
+  def all(self):
+    return (1 << len(self.combos)) - 1
+
+  def mask(self, selected):
+    # Combinations holding every selected deck
+    mask = self.all()
+    for deck_id in selected:
+      mask &= self.bits.get(deck_id, 0)
+    return mask
+
+  def faction_decks(self, selected=()):
+    # Factions in the order they first appear, each with the decks that share
+    # at least one combination with every selected deck; a faction with a
+    # selected deck is narrowed by the other selections only
+    chosen = {self.faction_of.get(deck_id): deck_id for deck_id in selected}
+    masks = {faction: self.mask([deck_id for other, deck_id in chosen.items() if other != faction])
+             for faction in self.factions}
+    factions = {faction: set() for faction in self.factions}
+    for deck_id, bits in self.bits.items():
+      faction = self.faction_of[deck_id]
+      if bits & masks[faction]:
+        factions[faction].add(deck_id)
+    return factions
+
+  def matching(self, selected=()):
+    # bin() lists the bits most significant first, so it is read backwards
+    bits = bin(self.mask(selected))[:1:-1]
+    return [self.combos[i] for i, bit in enumerate(bits) if bit == '1']
+
+  def count(self, selected=()):
+    return bin(self.mask(selected)).count('1')
@@ -0,0 +1,67 @@
+import numpy as np
+
+COLUMNS = ('Decks', 'Factions', 'Missing cards')
+
+class ComboTable(object):
+  # Rows for a virtual list of combinations. Each combination is kept as a
+  # row of deck numbers with its missing card count, so sorting and filtering
+  # are array operations and cell text is only built for the rows on screen.
+
+  def __init__(self, decks, combos, missing):
+    self.decks = decks
+    self.deck_ids = sorted(set(deck_id for combo in combos for deck_id in combo.split(',')))
+    self.deck_numbers = {deck_id: number for number, deck_id in enumerate(self.deck_ids)}
+    self.names = [decks[deck_id]['name'] for deck_id in self.deck_ids]
+    self.factions = [decks[deck_id]['faction_code'] for deck_id in self.deck_ids]
+    width = max([combo.count(',') + 1 for combo in combos] or [0])
+    # combinations of fewer decks are padded with an extra empty deck
+    self.rows = np.full((len(combos), width), len(self.deck_ids), dtype=np.int32)
+    for row, combo in enumerate(combos):
+      numbers = [self.deck_numbers[deck_id] for deck_id in combo.split(',')]
+      self.rows[row, :len(numbers)] = numbers
+    self.missing = np.asarray(missing, dtype=np.int32)
+    self.order = np.arange(len(combos))
+    self.shown = np.ones(len(combos), dtype=bool)
+    self.view = self.order
+    self.sorted_by = None
+
+  def __len__(self):
+    return len(self.view)
+
+  def ranks(self, values):
+    # Position of each deck's value in sorted order, with the padding last
+    ranked = np.empty(len(values) + 1, dtype=np.int32)
+    ranked[np.argsort(np.array(values, dtype=object), kind='stable')] = np.arange(len(values))
+    ranked[-1] = len(values)
+    return ranked
+
+  def sort(self, column, descending=False):
+    if column == 2:
+      keys = [self.missing]
+    else:
+      ranked = self.ranks(self.names if column == 0 else self.factions)[self.rows]
+      # lexsort takes the primary key last
+      keys = [ranked[:, position] for position in reversed(range(self.rows.shape[1]))]
+    order = np.lexsort([np.arange(len(self.rows))] + keys)
+    self.order = order[::-1] if descending else order
+    self.sorted_by = (column, descending)
+    self.view = self.order[self.shown[self.order]]
+
+  def filter(self, selected=()):
+    # Only combinations holding every selected deck
+    shown = np.ones(len(self.rows), dtype=bool)
+    for deck_id in selected:
+      shown &= (self.rows == self.deck_numbers.get(deck_id, -1)).any(axis=1)
+    self.shown = shown
+    self.view = self.order[self.shown[self.order]]
+
+  def combo(self, row):
+    return ','.join(self.deck_ids[number] for number in self.rows[self.view[row]].tolist()
+                    if number < len(self.deck_ids))
+
+  def cell(self, row, column):
+    index = self.view[row]
+    if column == 2:
+      return str(int(self.missing[index]))
+    values = self.names if column == 0 else self.factions
+    return ' / '.join(values[number] for number in self.rows[index].tolist() if number < len(values))
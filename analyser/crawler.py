@@ -0,0 +1,102 @@
+from collections import OrderedDict
+from html.parser import HTMLParser
+import asyncio, queue, threading
+from analyser.download import RateLimiter, make_session, polite_get, REQUESTS_PER_SECOND
+
+SEARCH_URL = 'https://netrunnerdb.com/en/decklists/find'
+
+class MyDeckParser(HTMLParser):
+
+  def __init__(self):
+    super(MyDeckParser, self).__init__()
+    self.decks = set()
+    self.new_decks = []
+
+  def handle_starttag(self, tag, attrs):
+    if tag == 'a':
+      for attr in attrs:
+        if attr[0] == 'href' and attr[1].startswith('/en/decklist/'):
+          deck_id = attr[1].split('/')[3]
+          if deck_id not in self.decks:
+            self.decks.add(deck_id)
+            self.new_decks.append(deck_id)
+
+  def feed_page(self, text):
+    # Deck ids on this page that earlier pages did not list
+    self.new_decks = []
+    self.feed(text)
+    return self.new_decks
+
+class DecklistCrawler(object):
+
+  def __init__(self, session=None, url=SEARCH_URL, per_second=REQUESTS_PER_SECOND, headers=None, limiter=None):
+    self.session = session or make_session(headers)
+    self.url = url
+    self.limiter = limiter or RateLimiter(per_second)
+
+  def page_url(self, page):
+    if page == 1:
+      return self.url
+    return self.url + '/' + str(page)
+
+  def fetch_page(self, page, payload):
+    r = polite_get(self.session, self.limiter, self.page_url(page), payload)
+    r.raise_for_status()
+    return r.text
+
+  async def crawl_payload(self, number, payload, max_pages, found, ids, executor, stopped):
+    # Pages of one payload are read in turn so the crawl can stop at the first
+    # page with nothing new; each payload gets its own parser
+    loop = asyncio.get_running_loop()
+    parser = MyDeckParser()
+    for page in range(1, max_pages + 1):
+      if stopped is not None and stopped.is_set():
+        break
+      print('processing payload', number, 'page', page)
+      text = await loop.run_in_executor(executor, self.fetch_page, page, payload)
+      new_decks = parser.feed_page(text)
+      if not new_decks:
+        break
+      for deck_id in new_decks:
+        if deck_id not in found:
+          found[deck_id] = True
+          if ids is not None:
+            ids.put_nowait(deck_id)
+
+  async def crawl(self, payloads, max_pages, ids=None, executor=None, stopped=None):
+    found = OrderedDict()
+    await asyncio.gather(*[self.crawl_payload(number, payload, max_pages, found, ids, executor, stopped)
+                           for number, payload in enumerate(payloads, 1)])
+    return list(found)
+
+  def search(self, payloads, max_pages):
+    return asyncio.run(self.crawl(payloads, max_pages))
+
+  def iter_search(self, payloads, max_pages):
+    # Deck ids one at a time as the crawl finds them, for pipelines that fetch
+    # each deck while the search carries on. The crawl runs in its own event
+    # loop on a background thread; stopping early stops it at the next page.
+    ids = queue.Queue()
+    stopped = threading.Event()
+    finished = object()
+    errors = []
+
+    def run():
+      try:
+        asyncio.run(self.crawl(payloads, max_pages, ids, stopped=stopped))
+      except Exception as e:
+        errors.append(e)
+      finally:
+        ids.put(finished)
+
+    crawl = threading.Thread(target=run)
+    crawl.daemon = True
+    crawl.start()
+    try:
+      for deck_id in iter(ids.get, finished):
+        yield deck_id
+    finally:
+      stopped.set()
+    crawl.join()
+    if errors:
+      raise errors[0]
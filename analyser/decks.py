@@ -0,0 +1,87 @@
+from collections import OrderedDict
+import csv, json, os, random
+
+def select_decks(decks, included, ignored, max, shuffle = True, rng = random):
+  selected = []
+  deck_ids = list(decks)
+  if shuffle:
+    rng.shuffle(deck_ids)
+  for faction in included:
+    if included[faction]:
+      selected.append([d for d in deck_ids if (included[faction] and decks[d]['faction_code'] == faction)][:max])
+  return selected
+
+def classify_deck(deck, cards):
+  deck['side_code'] = ''
+  deck['faction_code'] = ''
+  for card in deck['cards']:
+    deck_card = cards[card]
+    if deck_card['type_code'] == 'identity':
+      deck['side_code'] = deck_card['side_code']
+      deck['faction_code'] = deck_card['faction_code']
+  return deck
+
+def read_decks(deck_filename):
+  if not os.path.exists(deck_filename):
+    return OrderedDict()
+  with open(deck_filename) as f:
+    return json.load(f, object_pairs_hook=OrderedDict)
+
+def write_deck_file(decks, deck_filename):
+  with open(deck_filename + '.tmp', 'w') as f:
+    f.write(json.dumps(decks, indent=2))
+  os.replace(deck_filename + '.tmp', deck_filename)
+
+def write_deck_csv(decks, csv_filename):
+  # One row per deck with no header, as the ingest pipeline exports them
+  with open(csv_filename + '.tmp', 'w', newline='') as f:
+    writer = None
+    for deck in decks.values():
+      if writer is None:
+        writer = csv.DictWriter(f, fieldnames=deck.keys())
+      writer.writerow(deck)
+  os.replace(csv_filename + '.tmp', csv_filename)
+
+def refresh_decks(deck_ids, deck_filename, cards, downloader, recheck=False, partial_filename=None, csv_filename=None):
+  # Fetch new ids and, when rechecking, refetch known decks as well (one
+  # request each, so only worth it when the HTTP cache answers with 304s);
+  # only decks whose date_update moved are reclassified, and the files are
+  # replaced only if something changed. deck_ids may be a lazy iterable such
+  # as a running search: each id is fetched as it arrives.
+  decks = read_decks(deck_filename)
+  found = []
+  seen = set()
+  added = []
+  updated = []
+
+  def fetch_ids():
+    for deck_id in deck_ids:
+      if deck_id in seen:
+        continue
+      seen.add(deck_id)
+      found.append(deck_id)
+      if recheck or deck_id not in decks:
+        yield deck_id
+
+  for deck_id, deck in downloader.iter_download(fetch_ids(), partial_filename):
+    existing = decks.get(deck_id)
+    if existing is not None and existing.get('date_update') == deck.get('date_update'):
+      continue
+    decks[deck_id] = classify_deck(deck, cards)
+    if existing is None:
+      added.append(deck_id)
+    else:
+      updated.append(deck_id)
+
+  removed = [deck_id for deck_id in decks if deck_id not in seen]
+  changed = added or updated or removed
+  kept = OrderedDict((deck_id, decks[deck_id]) for deck_id in found if deck_id in decks)
+  if changed or not os.path.exists(deck_filename):
+    write_deck_file(kept, deck_filename)
+  if csv_filename and (changed or not os.path.exists(csv_filename)):
+    write_deck_csv(kept, csv_filename)
+
+  if partial_filename and os.path.exists(partial_filename):
+    os.remove(partial_filename)
+
+  return added, updated, removed
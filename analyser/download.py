@@ -0,0 +1,133 @@
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import json, os, threading, time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from analyser.httpcache import CachedSession
+
+API_URL = 'https://netrunnerdb.com/api/2.0/public/'
+WORKERS = 8
+REQUESTS_PER_SECOND = 10
+RETRIES = 4
+BACKOFF = 0.5
+TIMEOUT = 30
+
+def make_session(headers=None, pool_size=WORKERS, retries=RETRIES, backoff=BACKOFF, cache_dir=None, offline=False, max_age=None):
+  # One pooled session for every request, retrying failed or throttled GETs
+  # with exponential backoff (honouring Retry-After), optionally through the
+  # on-disk response cache
+  if cache_dir:
+    session = CachedSession(cache_dir, offline, max_age)
+  else:
+    session = requests.Session()
+  retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=('GET',))
+  adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+  session.mount('https://', adapter)
+  session.mount('http://', adapter)
+  if headers:
+    session.headers.update(headers)
+  return session
+
+class RateLimiter(object):
+
+  def __init__(self, per_second):
+    self.interval = 1.0 / per_second if per_second else 0
+    self.lock = threading.Lock()
+    self.next_slot = 0
+
+  def wait(self):
+    if not self.interval:
+      return
+    with self.lock:
+      now = time.monotonic()
+      slot = max(now, self.next_slot)
+      self.next_slot = slot + self.interval
+    if slot > now:
+      time.sleep(slot - now)
+
+def polite_get(session, limiter, url, params=None):
+  # Responses answered from the cache do not wait for the rate limiter
+  if not (isinstance(session, CachedSession) and session.will_use_cache(url, params)):
+    limiter.wait()
+  return session.get(url, params=params, timeout=TIMEOUT)
+
+class DeckDownloader(object):
+
+  def __init__(self, session=None, base_url=API_URL, workers=WORKERS, per_second=REQUESTS_PER_SECOND, headers=None, limiter=None):
+    self.session = session or make_session(headers, workers)
+    self.base_url = base_url
+    self.workers = workers
+    self.limiter = limiter or RateLimiter(per_second)
+
+  def fetch(self, deck_id):
+    r = polite_get(self.session, self.limiter, self.base_url + 'decklist/' + deck_id)
+    r.raise_for_status()
+    return r.json()['data'][0]
+
+  def read_partial(self, partial_filename):
+    done = {}
+    if partial_filename and os.path.exists(partial_filename):
+      with open(partial_filename) as f:
+        for line in f:
+          # A line cut short by an interrupted run is fetched again
+          try:
+            record = json.loads(line)
+          except ValueError:
+            continue
+          done[record['id']] = record['deck']
+    return done
+
+  def iter_download(self, deck_ids, partial_filename=None):
+    # Yields (deck id, deck) as downloads finish. deck_ids may be a lazy
+    # iterable: ids are submitted as they arrive, with a bounded number in
+    # flight. Decks already in the partial file are not fetched again and
+    # every new one is appended to it.
+    done = self.read_partial(partial_filename)
+    partial = open(partial_filename, 'a') if partial_filename else None
+    seen = set()
+    failed = []
+    pending = {}
+
+    def finished(futures):
+      for future in futures:
+        deck_id = pending.pop(future)
+        try:
+          deck = future.result()
+        except (requests.RequestException, ValueError, LookupError) as e:
+          print('Failed', deck_id, e)
+          failed.append(deck_id)
+          continue
+        if partial:
+          partial.write(json.dumps({'id': deck_id, 'deck': deck}) + '\n')
+          partial.flush()
+        yield deck_id, deck
+
+    try:
+      with ThreadPoolExecutor(max_workers=self.workers) as pool:
+        for deck_id in deck_ids:
+          if deck_id in seen:
+            continue
+          seen.add(deck_id)
+          if deck_id in done:
+            yield deck_id, done[deck_id]
+            continue
+          pending[pool.submit(self.fetch, deck_id)] = deck_id
+          if len(pending) >= 2 * self.workers:
+            for result in finished(wait(pending, return_when=FIRST_COMPLETED).done):
+              yield result
+        while pending:
+          for result in finished(wait(pending, return_when=FIRST_COMPLETED).done):
+            yield result
+    finally:
+      for future in pending:
+        future.cancel()
+      if partial:
+        partial.close()
+    if failed:
+      raise RuntimeError('Could not download decks: ' + ', '.join(failed))
+
+  def download(self, deck_ids, partial_filename=None):
+    decks = dict(self.iter_download(deck_ids, partial_filename))
+    return OrderedDict((deck_id, decks[deck_id]) for deck_id in deck_ids if deck_id in decks)
@@ -0,0 +1,88 @@
+from statistics import NormalDist
+import math
+import numpy as np
+
+BATCH_SIZE = 4096
+PRECISION = 0.005    # Half-width of the confidence interval to stop at
+CONFIDENCE = 0.95
+MAX_SAMPLES = 1000000
+
+def wilson_interval(successes, samples, confidence=CONFIDENCE):
+  # Score interval for a proportion; unlike the normal approximation it
+  # stays inside [0, 1] and behaves when nearly nothing (or everything) passes
+  if samples == 0:
+    return 0.0, 1.0
+  z = NormalDist().inv_cdf(0.5 + confidence / 2)
+  p = successes / samples
+  centre = (p + z * z / (2 * samples)) / (1 + z * z / samples)
+  spread = z * math.sqrt(p * (1 - p) / samples + z * z / (4 * samples * samples)) / (1 + z * z / samples)
+  return max(0.0, centre - spread), min(1.0, centre + spread)
+
+class FeasibilityEstimator(object):
+  # Estimates the share of one-deck-per-faction line-ups the collection can
+  # build by checking random line-ups in batches. Decks are drawn uniformly,
+  # or in proportion to a per-deck weight such as deck_scores, in which case
+  # the share is of weighted line-ups.
+
+  def __init__(self, matrix, decks, weights=None, rng=None, batch_size=BATCH_SIZE):
+    self.matrix = matrix
+    self.decks = decks
+    self.selection = matrix.selection(decks)
+    self.levels = self.selection.levels
+    self.columns = self.selection.columns
+    self.probabilities = []
+    for faction in decks:
+      if weights is None:
+        self.probabilities.append(None)
+        continue
+      p = np.array([weights.get(deck_id, 0.0) for deck_id in faction], dtype=float)
+      self.probabilities.append(p / p.sum() if p.sum() > 0 else None)
+    self.weighted = weights is not None
+    self.total = int(np.prod([len(rows) for rows in self.levels], dtype=np.float64)) if self.levels else 0
+    self.rng = rng or np.random.default_rng()
+    self.batch_size = batch_size
+
+  def sample(self, size):
+    picks = [self.rng.choice(len(rows), size=size, p=p) for rows, p in zip(self.levels, self.probabilities)]
+    return np.stack([rows[pick] for rows, pick in zip(self.levels, picks)], axis=1)
+
+  def estimate(self, precision=PRECISION, confidence=CONFIDENCE, max_samples=MAX_SAMPLES, top_cards=20):
+    # Stops at the first batch whose interval is within precision either side
+    samples = 0
+    feasible = 0
+    blocked_by = np.zeros(len(self.columns), dtype=np.int64)
+    copies_short = np.zeros(len(self.columns), dtype=np.int64)
+    low, high = 0.0, 1.0
+    if self.total:
+      while samples < max_samples:
+        short = self.selection.shortfall(self.sample(min(self.batch_size, max_samples - samples)))
+        is_short = short > 0
+        samples += len(short)
+        feasible += int((~is_short.any(axis=1)).sum())
+        blocked_by += is_short.sum(axis=0)
+        copies_short += short.sum(axis=0)
+        low, high = wilson_interval(feasible, samples, confidence)
+        if (high - low) / 2 <= precision:
+          break
+
+    infeasible = samples - feasible
+    ranked = np.argsort(-blocked_by, kind='stable')[:top_cards]
+    missing_cards = [{
+      'card': self.matrix.card_codes[self.columns[column]],
+      'blocked_share': int(blocked_by[column]) / infeasible,
+      'mean_short': int(copies_short[column]) / int(blocked_by[column]),
+    } for column in ranked.tolist() if blocked_by[column] > 0]
+
+    fraction = feasible / samples if samples else 0.0
+    return {
+      'lineups': self.total,
+      'weighted': self.weighted,
+      'samples': samples,
+      'feasible': feasible,
+      'fraction': fraction,
+      'confidence': confidence,
+      'interval': [low, high],
+      'converged': (high - low) / 2 <= precision,
+      'estimated_buildable': None if self.weighted else fraction * self.total,
+      'missing_cards': missing_cards,
+    }
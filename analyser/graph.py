@@ -0,0 +1,71 @@
+import numpy as np
+
+class CompatibilityGraph(object):
+
+  def __init__(self, matrix, decks):
+    # decks holds one list of deck ids per faction; an edge joins two decks of
+    # different factions that the collection can build at the same time
+    self.matrix = matrix
+    self.decks = decks
+    self.levels = [matrix.rows(faction) for faction in decks]
+    all_rows = np.concatenate(self.levels) if self.levels else np.zeros(0, dtype=np.intp)
+    self.columns = matrix.columns(all_rows)
+    self.available = matrix.available[self.columns]
+    self.level_demand = [matrix.demand_block(rows, self.columns) for rows in self.levels]
+    self.buildable = [(demand <= self.available).all(axis=1) for demand in self.level_demand]
+
+    self.edges = {}
+    for a in range(len(self.levels)):
+      for b in range(a + 1, len(self.levels)):
+        self.edges[(a, b)] = self.pairs(a, b)
+        self.edges[(b, a)] = self.edges[(a, b)].T
+
+  def pairs(self, a, b):
+    compatible = np.zeros((len(self.levels[a]), len(self.levels[b])), dtype=bool)
+    demand_b = self.level_demand[b]
+    for i in np.flatnonzero(self.buildable[a]):
+      compatible[i] = ((demand_b + self.level_demand[a][i]) <= self.available).all(axis=1)
+    compatible &= self.buildable[b]
+    return compatible
+
+  def edge_count(self):
+    return sum(int(edges.sum()) for (a, b), edges in self.edges.items() if a < b)
+
+  def iter_lineups(self):
+    # Fill the most constrained faction first, narrow the other factions to the
+    # decks compatible with every pick so far, then check the summed demand
+    if not self.levels or 0 in [len(rows) for rows in self.levels]:
+      return
+    order = sorted(range(len(self.levels)), key=lambda level: int(self.buildable[level].sum()))
+    chosen = [None] * len(self.levels)
+
+    def expand(depth, candidates, running):
+      level = order[depth]
+      indices = np.flatnonzero(candidates[level])
+      if len(indices) == 0:
+        return
+      totals = self.level_demand[level][indices] + running
+      feasible = (totals <= self.available).all(axis=1)
+      for k, total in zip(indices[feasible].tolist(), totals[feasible]):
+        chosen[level] = k
+        if depth == len(order) - 1:
+          yield tuple(self.decks[l][chosen[l]] for l in range(len(self.levels)))
+          continue
+        narrowed = list(candidates)
+        for later in order[depth + 1:]:
+          narrowed[later] = candidates[later] & self.edges[(level, later)][k]
+        if all(narrowed[later].any() for later in order[depth + 1:]):
+          for lineup in expand(depth + 1, narrowed, total):
+            yield lineup
+
+    for lineup in expand(0, list(self.buildable), np.zeros(len(self.columns), dtype=self.available.dtype)):
+      yield lineup
+
+def enumerate_combinations(matrix, decks):
+  valid = {
+    'valid': {},
+    'invalid': {}
+  }
+  for combo in CompatibilityGraph(matrix, decks).iter_lineups():
+    valid['valid'][','.join(combo)] = {}
+  return valid
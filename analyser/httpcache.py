@@ -0,0 +1,109 @@
+import hashlib, json, os, tempfile, time
+import requests
+from requests.structures import CaseInsensitiveDict
+
+CACHE_DIR = 'http_cache'
+KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Date')
+
+class CachedSession(requests.Session):
+  # GET responses are kept on disk and revalidated with ETag/Last-Modified.
+  # Offline, only the cache is used; with max_age, recent entries are served
+  # without asking the server at all.
+
+  def __init__(self, cache_dir=CACHE_DIR, offline=False, max_age=None):
+    super(CachedSession, self).__init__()
+    self.cache_dir = cache_dir
+    self.offline = offline
+    self.max_age = max_age
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+
+  def cache_paths(self, url):
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    base = os.path.join(self.cache_dir, key[:2], key)
+    return base + '.json', base + '.body'
+
+  def read_cache(self, url):
+    meta_path, body_path = self.cache_paths(url)
+    if not os.path.exists(meta_path) or not os.path.exists(body_path):
+      return None
+    with open(meta_path) as f:
+      meta = json.load(f)
+    with open(body_path, 'rb') as f:
+      body = f.read()
+    return meta, body
+
+  def write_file(self, path, data, mode):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+      os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, mode) as f:
+      f.write(data)
+    os.replace(tmp_path, path)
+
+  def write_cache(self, url, response):
+    meta_path, body_path = self.cache_paths(url)
+    meta = {
+      'url': url,
+      'fetched': time.time(),
+      'encoding': response.encoding,
+      'headers': {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers},
+    }
+    self.write_file(body_path, response.content, 'wb')
+    self.write_file(meta_path, json.dumps(meta), 'w')
+
+  def touch_cache(self, url, meta):
+    meta['fetched'] = time.time()
+    self.write_file(self.cache_paths(url)[0], json.dumps(meta), 'w')
+
+  def cached_response(self, url, meta, body):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers = CaseInsensitiveDict(meta['headers'])
+    response.encoding = meta.get('encoding')
+    response._content = body
+    response.from_cache = True
+    return response
+
+  def use_cache(self, meta):
+    return self.offline or (self.max_age is not None and time.time() - meta['fetched'] < self.max_age)
+
+  def will_use_cache(self, url, params=None):
+    # True when a GET would be answered from disk without any network traffic
+    full_url = requests.Request('GET', url, params=params).prepare().url
+    meta_path, body_path = self.cache_paths(full_url)
+    if not os.path.exists(meta_path):
+      return False
+    with open(meta_path) as f:
+      return self.use_cache(json.load(f))
+
+  def request(self, method, url, params=None, headers=None, **kwargs):
+    if method.upper() != 'GET':
+      return super(CachedSession, self).request(method, url, params=params, headers=headers, **kwargs)
+
+    full_url = requests.Request('GET', url, params=params).prepare().url
+    cached = self.read_cache(full_url)
+    if cached is not None:
+      meta, body = cached
+      if self.use_cache(meta):
+        return self.cached_response(full_url, meta, body)
+    elif self.offline:
+      raise requests.ConnectionError('Not in the offline cache: ' + full_url)
+
+    headers = dict(headers or {})
+    if cached is not None:
+      if 'ETag' in meta['headers']:
+        headers['If-None-Match'] = meta['headers']['ETag']
+      if 'Last-Modified' in meta['headers']:
+        headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+
+    response = super(CachedSession, self).request(method, full_url, headers=headers, **kwargs)
+    if response.status_code == 304 and cached is not None:
+      self.touch_cache(full_url, meta)
+      return self.cached_response(full_url, meta, body)
+    if response.status_code == 200:
+      self.write_cache(full_url, response)
+    response.from_cache = False
+    return response
@@ -0,0 +1,175 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os, tempfile, threading
+from analyser.download import REQUESTS_PER_SECOND, RateLimiter, make_session, polite_get
+
+IMAGE_DIR = 'image_cache'
+MAX_BYTES = 200 * 1024 * 1024    # Disk space for card images before the least recently used go
+THUMBNAILS = 500    # Decoded thumbnails kept in memory
+WORKERS = 4
+IMAGE_URL = 'https://netrunnerdb.com/card_image/{code}.png'
+
+def deck_images(deck, cards):
+  # (code, image url) for every card of a deck, identity first
+  images = []
+  for code in sorted(deck['cards'], key=lambda code: cards.get(code, {}).get('type_code') != 'identity'):
+    card = cards.get(code, {})
+    images.append((code, card.get('image_url') or IMAGE_URL.format(code=code)))
+  return images
+
+class ImageCache(object):
+  # Card images on disk, one file per card code, capped at max_bytes with the
+  # least recently used removed first; use order is kept in memory and in the
+  # file times, so it survives a restart. Decoded thumbnails of recent cards
+  # are held in memory and answered without touching the disk. decode turns
+  # image bytes into whatever the caller draws with (a wx.Image in the
+  # viewer); without it the bytes themselves are kept.
+
+  def __init__(self, cache_dir=IMAGE_DIR, max_bytes=MAX_BYTES, session=None, workers=WORKERS,
+               per_second=REQUESTS_PER_SECOND, decode=None, thumbnails=THUMBNAILS):
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    self.session = session or make_session(pool_size=workers)
+    self.limiter = RateLimiter(per_second)
+    self.decode = decode
+    self.thumbnail_limit = thumbnails
+    self.executor = ThreadPoolExecutor(max_workers=workers)
+    # reentrant, as a future that is already done runs its callback at once
+    self.lock = threading.RLock()
+    self.pending = {}
+    self.thumbnails = OrderedDict()
+    self.fetched = 0
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+    # code -> size on disk, least recently used first
+    self.files = OrderedDict()
+    entries = []
+    for name in os.listdir(cache_dir):
+      if name.endswith('.img'):
+        stat = os.stat(os.path.join(cache_dir, name))
+        entries.append((stat.st_mtime, name[:-4], stat.st_size))
+    for mtime, code, size in sorted(entries):
+      self.files[code] = size
+    self.total = sum(self.files.values())
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def path(self, code):
+    return os.path.join(self.cache_dir, code + '.img')
+
+  def used(self, code):
+    # Marks a cached image as the most recently used, on disk as well
+    with self.lock:
+      if code not in self.files:
+        return False
+      self.files.move_to_end(code)
+    try:
+      os.utime(self.path(code))
+    except OSError:
+      pass
+    return True
+
+  def read(self, code):
+    # Image bytes from disk, or None when the card has not been fetched
+    if not self.used(code):
+      return None
+    try:
+      with open(self.path(code), 'rb') as f:
+        return f.read()
+    except OSError:
+      with self.lock:
+        self.total -= self.files.pop(code, 0)
+      return None
+
+  def store(self, code, data):
+    fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+    with os.fdopen(fd, 'wb') as f:
+      f.write(data)
+    os.replace(tmp_path, self.path(code))
+    with self.lock:
+      self.total += len(data) - self.files.pop(code, 0)
+      self.files[code] = len(data)
+      evicted = []
+      while self.total > self.max_bytes and len(self.files) > 1:
+        old_code, size = self.files.popitem(last=False)
+        self.total -= size
+        evicted.append(old_code)
+    for old_code in evicted:
+      try:
+        os.remove(self.path(old_code))
+      except OSError:
+        pass
+
+  def remember(self, code, data):
+    thumbnail = self.decode(data) if self.decode else data
+    with self.lock:
+      self.thumbnails[code] = thumbnail
+      self.thumbnails.move_to_end(code)
+      while len(self.thumbnails) > self.thumbnail_limit:
+        self.thumbnails.popitem(last=False)
+    return thumbnail
+
+  def thumbnail(self, code):
+    # Decoded image from memory, else from disk; None if not fetched yet
+    with self.lock:
+      if code in self.thumbnails:
+        self.thumbnails.move_to_end(code)
+        return self.thumbnails[code]
+    data = self.read(code)
+    if data is None:
+      return None
+    return self.remember(code, data)
+
+  def fetch(self, code, url):
+    data = self.read(code)
+    if data is None:
+      response = polite_get(self.session, self.limiter, url)
+      response.raise_for_status()
+      data = response.content
+      self.store(code, data)
+      with self.lock:
+        self.fetched += 1
+    return self.remember(code, data)
+
+  def get(self, code, url):
+    # Thumbnail of one card, fetching it now if needed
+    thumbnail = self.thumbnail(code)
+    if thumbnail is not None:
+      return thumbnail
+    return self.request(code, url).result()
+
+  def request(self, code, url):
+    # A future for the card's thumbnail; a card already being fetched is
+    # not asked for twice
+    with self.lock:
+      future = self.pending.get(code)
+      if future is None:
+        future = self.pending[code] = self.executor.submit(self.fetch, code, url)
+        future.add_done_callback(lambda done: self.done(code, done))
+    return future
+
+  def done(self, code, future):
+    with self.lock:
+      if self.pending.get(code) is future:
+        del self.pending[code]
+
+  def prefetch(self, images):
+    # Futures for the (code, url) images not already decoded in memory; the
+    # pool's workers bound how many are fetched at once
+    with self.lock:
+      wanted = [(code, url) for code, url in images if code not in self.thumbnails]
+    return {code: self.request(code, url) for code, url in wanted}
+
+  def close(self, wait=True):
+    # images queued but not started are dropped; wait=False returns without
+    # waiting for the downloads already running. Cancelled one by one, as
+    # shutdown(cancel_futures=True) needs Python 3.9.
+    with self.lock:
+      pending = list(self.pending.values())
+    for future in pending:
+      future.cancel()
+    self.executor.shutdown(wait=wait)
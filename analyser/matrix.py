@@ -0,0 +1,192 @@
+from collections import OrderedDict
+import numpy as np
+
+BATCH_SIZE = 4096
+
+# Card positions within a deck are packed into a single sort key per
+# combination slot so missing cards can be reported in first-seen order
+POSITION_BITS = 10
+UNSEEN = 1 << 20
+
+# Deck fields kept alongside the demand vectors
+DECK_FIELDS = ('name', 'side_code', 'faction_code')
+
+class DemandMatrix(object):
+  # Copies of each card every deck needs, kept sparse: each deck's cards in
+  # the order it lists them are one run of a flat list of columns and
+  # quantities (deck_columns, deck_quantities), starting at its entry in
+  # deck_offsets. Memory grows with the cards in the decks rather than with
+  # decks times cards, and the runs keep the order missing cards are
+  # reported in. Dense blocks are built only for the decks of a selection.
+
+  def __init__(self, card_index, decks, collection):
+    self.deck_ids = list(decks)
+    self.decks = {deck_id: {field: decks[deck_id].get(field) for field in DECK_FIELDS} for deck_id in self.deck_ids}
+
+    deck_demands = []
+    codes = set()
+    for deck_id in self.deck_ids:
+      demands = OrderedDict()
+      for card, quantity in decks[deck_id]['cards'].items():
+        code = card_index[card]
+        demands[code] = demands.get(code, 0) + quantity
+      deck_demands.append(demands)
+      codes.update(demands)
+
+    self.card_codes = sorted(codes)
+    card_columns = {code: col for col, code in enumerate(self.card_codes)}
+    self.deck_columns = np.array([card_columns[code] for demands in deck_demands for code in demands], dtype=np.int32)
+    self.deck_quantities = np.array([quantity for demands in deck_demands for quantity in demands.values()], dtype=np.int32)
+    self.deck_offsets = np.cumsum([0] + [len(demands) for demands in deck_demands]).astype(np.int64)
+
+    self.available = np.array([collection.get(code, 0) for code in self.card_codes], dtype=np.int32)
+    self.build_lookups()
+
+  @classmethod
+  def from_arrays(cls, deck_ids, card_codes, deck_offsets, deck_columns, deck_quantities, available, decks):
+    matrix = cls.__new__(cls)
+    matrix.deck_ids = deck_ids
+    matrix.card_codes = card_codes
+    matrix.deck_offsets = deck_offsets
+    matrix.deck_columns = deck_columns
+    matrix.deck_quantities = deck_quantities
+    matrix.available = available
+    matrix.decks = decks
+    matrix.build_lookups()
+    return matrix
+
+  def build_lookups(self):
+    self.deck_rows = {deck_id: row for row, deck_id in enumerate(self.deck_ids)}
+    self.card_columns = {code: col for col, code in enumerate(self.card_codes)}
+
+  def rows(self, deck_ids):
+    return np.array([self.deck_rows[d] for d in deck_ids], dtype=np.intp)
+
+  def entries(self, rows):
+    # (row number within rows, position in the deck, column, quantity) for
+    # every card of the decks
+    rows = np.asarray(rows, dtype=np.intp)
+    starts = self.deck_offsets[rows]
+    lengths = self.deck_offsets[rows + 1] - starts
+    local_rows = np.repeat(np.arange(len(rows)), lengths)
+    positions = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    index = np.repeat(starts, lengths) + positions
+    return local_rows, positions, self.deck_columns[index], self.deck_quantities[index]
+
+  def columns(self, rows):
+    # Only the cards used by at least one of the decks can ever be short
+    local_rows, positions, cols, quantities = self.entries(rows)
+    return np.unique(cols[quantities > 0]).astype(np.intp)
+
+  def locate(self, rows, columns):
+    # entries() of the decks narrowed to the (sorted) columns, with each
+    # card's place among them
+    local_rows, positions, cols, quantities = self.entries(rows)
+    local_cols = np.minimum(np.searchsorted(columns, cols), max(len(columns) - 1, 0))
+    present = (columns[local_cols] == cols) if len(columns) else np.zeros(len(cols), dtype=bool)
+    return local_rows[present], local_cols[present], positions[present], quantities[present]
+
+  def demand_block(self, rows, columns):
+    local_rows, local_cols, positions, quantities = self.locate(rows, columns)
+    demand = np.zeros((len(rows), len(columns)), dtype=np.int32)
+    demand[local_rows, local_cols] = quantities
+    return demand
+
+  def card_order(self, rows, columns):
+    # Position of each card in each deck's list, UNSEEN where it is not used
+    local_rows, local_cols, positions, quantities = self.locate(rows, columns)
+    order = np.full((len(rows), len(columns)), UNSEEN, dtype=np.int32)
+    order[local_rows, local_cols] = positions
+    return order
+
+  def selection(self, decks):
+    return Selection(self, decks)
+
+  def check_combination(self, deck_combination):
+    selection = self.selection([[deck_id] for deck_id in deck_combination])
+    combos = np.array([[level[0] for level in selection.levels]], dtype=np.intp)
+    return selection.missing_cards(combos, selection.shortfall(combos))[0]
+
+  def iter_results(self, decks, batch_size=BATCH_SIZE):
+    if not decks or 0 in [len(faction) for faction in decks]:
+      return
+    selection = self.selection(decks)
+    for combos in selection.iter_combos(batch_size):
+      missing = selection.missing_cards(combos, selection.shortfall(combos))
+      for combo, missing_cards in zip(selection.combo_ids(combos), missing):
+        yield combo, missing_cards
+
+  def find_combinations(self, decks, batch_size=BATCH_SIZE):
+    valid = {
+      'valid': {},
+      'invalid': {}
+    }
+    for combo, missing_cards in self.iter_results(decks, batch_size):
+      if len(missing_cards) == 0:
+        valid['valid'][','.join(combo)] = missing_cards
+      else:
+        valid['invalid'][','.join(combo)] = missing_cards
+    return valid
+
+class Selection(object):
+  # The decks of one search, one list of deck ids per faction, with their
+  # demand gathered once. Only cards that some pick of one deck per faction
+  # could run short of are kept, which is usually a small part of those the
+  # decks use. Combinations are rows of local deck numbers, levels holding
+  # each faction's.
+
+  def __init__(self, matrix, decks):
+    levels = [matrix.rows(faction) for faction in decks]
+    self.rows = np.unique(np.concatenate(levels)) if levels else np.zeros(0, dtype=np.intp)
+    self.levels = [np.searchsorted(self.rows, rows) for rows in levels]
+    columns = matrix.columns(self.rows)
+    demand = matrix.demand_block(self.rows, columns)
+    if levels and 0 not in [len(level) for level in self.levels]:
+      peak = sum(demand[level].max(axis=0) for level in self.levels)
+      can_short = peak > matrix.available[columns]
+    else:
+      can_short = np.zeros(len(columns), dtype=bool)
+    self.columns = columns[can_short]
+    self.demand = np.ascontiguousarray(demand[:, can_short])
+    self.available = matrix.available[self.columns]
+    self.order = matrix.card_order(self.rows, self.columns)
+    self.codes = np.array([matrix.card_codes[col] for col in self.columns.tolist()], dtype=object)
+    self.deck_ids = np.array([matrix.deck_ids[row] for row in self.rows.tolist()], dtype=object)
+
+  def iter_combos(self, batch_size=BATCH_SIZE):
+    # Batches of local deck numbers in the same order as itertools.product(*decks)
+    sizes = [len(level) for level in self.levels]
+    if not sizes or 0 in sizes:
+      return
+    total = int(np.prod(sizes))
+    for start in range(0, total, batch_size):
+      index = np.unravel_index(np.arange(start, min(start + batch_size, total)), sizes)
+      yield np.stack([self.levels[slot][index[slot]] for slot in range(len(sizes))], axis=1)
+
+  def shortfall(self, combos):
+    total = self.demand[combos[:, 0]]
+    for slot in range(1, combos.shape[1]):
+      total += self.demand[combos[:, slot]]
+    total -= self.available
+    np.maximum(total, 0, out=total)
+    return total
+
+  def missing_cards(self, combos, short):
+    # Mirror check_combination: cards appear in the order they are first met
+    # walking the decks of the combination in turn. The short entries are
+    # sorted by combination and then that order, and each combination's dict
+    # is built from its slice in one go.
+    rows, cols = np.nonzero(short)
+    if len(rows) == 0:
+      return [{} for _ in range(len(combos))]
+    offsets = np.arange(combos.shape[1], dtype=np.int32) << POSITION_BITS
+    keys = (self.order[combos[rows], cols[:, None]] + offsets).min(axis=1)
+    ordered = np.lexsort((keys, rows))
+    codes = self.codes[cols[ordered]].tolist()
+    quantities = short[rows, cols][ordered].tolist()
+    bounds = np.searchsorted(rows[ordered], np.arange(len(combos) + 1)).tolist()
+    return [dict(zip(codes[start:end], quantities[start:end])) if end > start else {}
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+  def combo_ids(self, combos):
+    return map(tuple, self.deck_ids[combos].tolist())
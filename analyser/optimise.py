@@ -0,0 +1,117 @@
+from datetime import datetime
+import heapq, time
+import numpy as np
+from analyser.graph import CompatibilityGraph
+
+WEIGHTS = {'recency': 1.0, 'tournament_badge': 0.5}
+RECENCY_HALF_LIFE = 365    # Days for the recency score to halve
+
+def parse_date(value):
+  try:
+    return datetime.fromisoformat(value)
+  except (TypeError, ValueError):
+    return None
+
+def deck_scores(details, weights=WEIGHTS, deck_weights=None, half_life=RECENCY_HALF_LIFE):
+  # details maps deck id to the deck's fields. Recency halves every half_life
+  # days before the newest update in the corpus; a deck with a tournament
+  # badge gets the badge weight; deck_weights adds a score per deck id.
+  deck_weights = deck_weights or {}
+  dates = {deck_id: parse_date(deck.get('date_update')) for deck_id, deck in details.items()}
+  newest = max([date for date in dates.values() if date is not None], default=None)
+  scores = {}
+  for deck_id, deck in details.items():
+    score = deck_weights.get(deck_id, 0.0)
+    if dates[deck_id] is not None:
+      age = (newest - dates[deck_id]).total_seconds() / 86400.0
+      score += weights.get('recency', 0.0) * 0.5 ** (age / half_life)
+    if deck.get('tournament_badge'):
+      score += weights.get('tournament_badge', 0.0)
+    scores[deck_id] = score
+  return scores
+
+class LineupOptimiser(object):
+  # Best-scoring line-ups of one deck per faction that the collection can
+  # build at the same time. A line-up scores the sum of its deck scores.
+  # Decks are tried best first and a partial line-up is dropped once the best
+  # score still reachable from it, counting only decks compatible with every
+  # pick so far, cannot beat the k-th best line-up found.
+
+  def __init__(self, matrix, decks, scores):
+    self.graph = CompatibilityGraph(matrix, decks)
+    self.decks = decks
+    self.level_scores = [np.array([scores.get(deck_id, 0.0) for deck_id in faction], dtype=float) for faction in decks]
+
+  def reachable(self, candidates, levels):
+    bound = 0.0
+    for level in levels:
+      if not candidates[level].any():
+        return None
+      bound += self.level_scores[level][candidates[level]].max()
+    return bound
+
+  def top(self, k=1, node_limit=None, time_limit=None):
+    graph = self.graph
+    best = []    # min-heap of (score, lineup)
+    result = {'lineups': [], 'optimal': True, 'upper_bound': None, 'gap': 0.0, 'nodes': 0}
+    if not graph.levels or 0 in [len(rows) for rows in graph.levels]:
+      return result
+
+    order = sorted(range(len(graph.levels)), key=lambda level: int(graph.buildable[level].sum()))
+    root = list(graph.buildable)
+    bound = self.reachable(root, order)
+    if bound is None:
+      return result
+    start = time.perf_counter()
+    running = np.zeros(len(graph.columns), dtype=graph.available.dtype)
+    stack = [(bound, 0, (), 0.0, root, running)]
+    nodes = 0
+
+    def threshold():
+      return best[0][0] if len(best) == k else -np.inf
+
+    while stack:
+      if (node_limit is not None and nodes >= node_limit) or \
+         (time_limit is not None and time.perf_counter() - start >= time_limit):
+        break
+      bound, depth, chosen, score, candidates, running = stack.pop()
+      if bound <= threshold():
+        continue
+      nodes += 1
+      level = order[depth]
+      indices = np.flatnonzero(candidates[level])
+      indices = indices[np.argsort(-self.level_scores[level][indices], kind='stable')]
+      totals = graph.level_demand[level][indices] + running
+      feasible = (totals <= graph.available).all(axis=1)
+      children = []
+      for index, total in zip(indices[feasible].tolist(), totals[feasible]):
+        child_score = score + self.level_scores[level][index]
+        child_chosen = chosen + ((level, index),)
+        if depth == len(order) - 1:
+          if child_score > threshold():
+            lineup = [None] * len(order)
+            for l, i in child_chosen:
+              lineup[l] = self.decks[l][i]
+            heapq.heappush(best, (child_score, tuple(lineup)))
+            if len(best) > k:
+              heapq.heappop(best)
+          continue
+        narrowed = list(candidates)
+        for later in order[depth + 1:]:
+          narrowed[later] = candidates[later] & graph.edges[(level, later)][index]
+        remaining = self.reachable(narrowed, order[depth + 1:])
+        if remaining is None or child_score + remaining <= threshold():
+          continue
+        children.append((child_score + remaining, depth + 1, child_chosen, child_score, narrowed, total))
+      # Best child on top of the stack so good line-ups are found early
+      stack.extend(reversed(children))
+
+    open_bounds = [entry[0] for entry in stack if entry[0] > threshold()]
+    result['nodes'] = nodes
+    result['lineups'] = [{'decks': list(lineup), 'score': float(lineup_score)} for lineup_score, lineup in sorted(best, reverse=True)]
+    if open_bounds:
+      # Stopped early: no line-up left unexplored can score above this
+      result['optimal'] = False
+      result['upper_bound'] = float(max(open_bounds))
+      result['gap'] = result['upper_bound'] - float(threshold()) if len(best) == k else None
+    return result
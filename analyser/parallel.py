@@ -0,0 +1,103 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing, random, sys
+from analyser.decks import select_decks
+from analyser.search import search_combinations
+
+# Smallest number of combinations worth sending to a worker on its own
+MIN_SHARD_COMBOS = 4096
+
+_matrix = None
+
+def _init_worker(matrix):
+  global _matrix
+  _matrix = matrix
+
+def _search_shard(decks, prune, record_prefixes):
+  if prune:
+    return search_combinations(_matrix, decks, record_prefixes)
+  return _matrix.find_combinations(decks)
+
+def _pool_context():
+  # Forked workers inherit the compiled matrix without pickling it, but only
+  # Linux forks safely once numpy or system frameworks have started threads;
+  # elsewhere (macOS included) workers are spawned and the sparse matrix is
+  # pickled to each one through the pool initializer
+  if sys.platform.startswith('linux'):
+    return multiprocessing.get_context('fork')
+  return multiprocessing.get_context('spawn')
+
+def merge_results(results):
+  merged = {
+    'valid': {},
+    'invalid': {}
+  }
+  for result in results:
+    merged['valid'].update(result['valid'])
+    merged['invalid'].update(result['invalid'])
+  return merged
+
+class ParallelAnalyser(object):
+
+  def __init__(self, matrix, workers=None, prune=False, record_prefixes=False):
+    self.prune = prune
+    self.record_prefixes = record_prefixes
+    self.workers = workers or multiprocessing.cpu_count()
+    self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_pool_context(),
+                                    initializer=_init_worker, initargs=(matrix,))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    self.pool.shutdown()
+
+  def shards(self, decks):
+    # Split the product space on the first faction's decks
+    if not decks:
+      return [decks]
+    total = 1
+    for faction in decks:
+      total *= len(faction)
+    first = decks[0]
+    count = max(1, min(len(first), total // MIN_SHARD_COMBOS))
+    size = -(-len(first) // count)
+    return [[first[start:start + size]] + decks[1:] for start in range(0, len(first), size)]
+
+  def submit(self, decks):
+    return [self.pool.submit(_search_shard, shard, self.prune, self.record_prefixes) for shard in self.shards(decks)]
+
+  def find_combinations(self, decks):
+    return merge_results(future.result() for future in self.submit(decks))
+
+  def iter_iterations(self, side, decks, included, ignored, max_decks, iterations, shuffle=True, seed=None):
+    # Each iteration draws from its own generator so the combinations found do
+    # not depend on the order in which workers finish; results are yielded
+    # as iterations complete, so only the merged dicts' order can vary
+    rngs = [random.Random(None if seed is None else '%s-%s' % (seed, i)) for i in range(iterations)]
+    running = {}
+
+    def start(i):
+      print('Determining valid combinations for', side, 'iteration', i)
+      selected = select_decks(decks, included, ignored, max_decks, shuffle, rngs[i])
+      running[i] = self.submit(selected)
+
+    for i in range(iterations):
+      start(i)
+
+    while running:
+      outstanding = [future for futures in running.values() for future in futures]
+      wait(outstanding, return_when=FIRST_COMPLETED)
+      for i in sorted(running):
+        if not all(future.done() for future in running[i]):
+          continue
+        result = merge_results(future.result() for future in running.pop(i))
+        yield result
+        # Draw again if we do not have a valid combination
+        if len(result['valid']) == 0:
+          start(i)
+
+  def run_iterations(self, side, decks, included, ignored, max_decks, iterations, shuffle=True, seed=None):
+    return merge_results(self.iter_iterations(side, decks, included, ignored, max_decks, iterations, shuffle, seed))
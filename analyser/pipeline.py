@@ -0,0 +1,126 @@
+import csv, json, os
+from analyser.decks import classify_deck
+
+# One decklist at a time flows from the search through download, faction
+# identification and export. The only intermediate is an append-only stream
+# of finished decks, which is also what an interrupted run resumes from.
+
+def stream_offsets(stream_filename):
+  # Byte offset of every complete record; a line cut short by an interrupted
+  # run is truncated away so new records can be appended after it
+  offsets = {}
+  if not os.path.exists(stream_filename):
+    return offsets
+  with open(stream_filename, 'rb+') as f:
+    good = 0
+    for line in iter(f.readline, b''):
+      try:
+        record = json.loads(line.decode('utf-8'))
+      except ValueError:
+        break
+      if not line.endswith(b'\n'):
+        break
+      offsets[record['id']] = good
+      good += len(line)
+    f.truncate(good)
+  return offsets
+
+def iter_stream(stream_filename):
+  if not os.path.exists(stream_filename):
+    return
+  with open(stream_filename) as f:
+    for line in f:
+      record = json.loads(line)
+      yield record['id'], record['deck']
+
+def iter_ids(deck_ids, id_filename):
+  # Pass deck ids through, appending each to the id file as it is found
+  with open(id_filename, 'w') as f:
+    for deck_id in deck_ids:
+      f.write(deck_id + '\n')
+      f.flush()
+      yield deck_id
+
+def iter_classified(records, cards):
+  for deck_id, deck in records:
+    yield deck_id, classify_deck(deck, cards)
+
+class DeckExport(object):
+  # Writes each deck to the stream and, optionally, a CSV row
+
+  def __init__(self, stream_filename, csv_filename=None):
+    self.stream_filename = stream_filename
+    self.offsets = stream_offsets(stream_filename)
+    self.csv_file = open(csv_filename, 'w', newline='') if csv_filename else None
+    self.writer = None
+    if self.csv_file:
+      # Decks kept from an interrupted run are exported again
+      for deck_id, deck in iter_stream(stream_filename):
+        self.write_row(deck)
+    self.stream = open(stream_filename, 'a')
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    self.stream.close()
+    if self.csv_file:
+      self.csv_file.close()
+
+  def write_row(self, deck):
+    if self.writer is None:
+      self.writer = csv.DictWriter(self.csv_file, fieldnames=deck.keys())
+    self.writer.writerow(deck)
+
+  def write(self, deck_id, deck):
+    self.offsets[deck_id] = self.stream.tell()
+    self.stream.write(json.dumps({'id': deck_id, 'deck': deck}) + '\n')
+    self.stream.flush()
+    if self.csv_file:
+      self.write_row(deck)
+
+def write_deck_json(stream_filename, offsets, deck_ids, deck_filename):
+  # Same layout as json.dumps(decks, indent=2) in search order, reading one
+  # deck at a time from the stream
+  with open(stream_filename) as stream, open(deck_filename + '.tmp', 'w') as out:
+    out.write('{')
+    first = True
+    for deck_id in deck_ids:
+      if deck_id not in offsets:
+        continue
+      stream.seek(offsets[deck_id])
+      deck = json.loads(stream.readline())['deck']
+      out.write('\n' if first else ',\n')
+      out.write('  ' + json.dumps(deck_id) + ': ' + json.dumps(deck, indent=2).replace('\n', '\n  '))
+      first = False
+    out.write('}' if first else '\n}')
+  os.replace(deck_filename + '.tmp', deck_filename)
+
+def ingest(deck_ids, downloader, cards, deck_filename, csv_filename=None, stream_filename=None):
+  # Returns the ids in the order they were found. The stream holds classified
+  # decks, so it is kept apart from the downloader's partial file of raw ones
+  # that an incremental refresh resumes from
+  if stream_filename is None:
+    stream_filename = deck_filename + '.stream.partial'
+  found = []
+  seen = set()
+
+  def discovered():
+    for deck_id in deck_ids:
+      if deck_id in seen:
+        continue
+      seen.add(deck_id)
+      found.append(deck_id)
+      if deck_id not in export.offsets:
+        yield deck_id
+
+  with DeckExport(stream_filename, csv_filename) as export:
+    for deck_id, deck in iter_classified(downloader.iter_download(discovered()), cards):
+      export.write(deck_id, deck)
+
+  write_deck_json(stream_filename, export.offsets, found, deck_filename)
+  os.remove(stream_filename)
+  return found
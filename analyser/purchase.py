@@ -0,0 +1,102 @@
+import itertools
+import numpy as np
+
+SAMPLE_SIZE = 100000    # Line-ups scored per side; every line-up when there are fewer
+POOL_SIZE = 20    # Packs considered for sets, by how many blocked line-ups they touch
+
+def pack_supply(snapshot, matrix):
+  # Cards one copy of each pack adds, as a vector over the matrix columns;
+  # alternate printings count towards their canonical code
+  packs = snapshot.categories['card_pack_code']
+  canonical = snapshot.card_codes[snapshot.card_canonical].tolist()
+  supply = {}
+  for code, pack, quantity in zip(canonical, snapshot.card_pack_code.tolist(), snapshot.card_quantity.tolist()):
+    column = matrix.card_columns.get(code)
+    if column is None:
+      continue
+    vector = supply.setdefault(packs[pack], np.zeros(len(matrix.card_codes), dtype=np.int32))
+    vector[column] += quantity
+  return supply
+
+class PurchaseOptimiser(object):
+  # Scores packs by how many line-ups they would make buildable. The
+  # shortfall of every blocked line-up is computed once and kept as sparse
+  # (line-up, card, copies short) entries; a candidate only has to compare
+  # those entries with the copies it adds, with no rerun of the analysis.
+
+  def __init__(self, matrix, decks, supply, sample_size=SAMPLE_SIZE, rng=None):
+    self.matrix = matrix
+    self.supply = supply
+    selection = matrix.selection(decks)
+    levels = selection.levels
+    self.total = int(np.prod([len(rows) for rows in levels], dtype=np.float64)) if levels else 0
+    if self.total <= sample_size:
+      picks = np.unravel_index(np.arange(self.total), [len(rows) for rows in levels])
+    else:
+      rng = rng or np.random.default_rng()
+      picks = [rng.integers(len(rows), size=sample_size) for rows in levels]
+    combos = np.stack([rows[pick] for rows, pick in zip(levels, picks)], axis=1) if levels else np.zeros((0, 0), dtype=np.intp)
+    self.sampled = len(combos)
+
+    columns = selection.columns
+    entry_combos, entry_columns, entry_quantities = [], [], []
+    self.baseline = 0
+    blocked = 0
+    for start in range(0, len(combos), 4096):
+      short = selection.shortfall(combos[start:start + 4096])
+      is_short = short.any(axis=1)
+      self.baseline += int((~is_short).sum())
+      short = short[is_short]
+      combo, column = np.nonzero(short)
+      entry_combos.append(combo + blocked)
+      entry_columns.append(columns[column])
+      entry_quantities.append(short[combo, column])
+      blocked += len(short)
+    self.blocked = blocked
+    self.entry_combos = np.concatenate(entry_combos) if entry_combos else np.zeros(0, dtype=np.intp)
+    self.entry_columns = np.concatenate(entry_columns) if entry_columns else np.zeros(0, dtype=np.intp)
+    self.entry_quantities = np.concatenate(entry_quantities) if entry_quantities else np.zeros(0, dtype=np.int32)
+
+  def added(self, packs):
+    extra = np.zeros(len(self.matrix.card_codes), dtype=np.int32)
+    for pack in packs:
+      extra += self.supply[pack]
+    return extra
+
+  def gain(self, packs):
+    # Blocked line-ups with no card left short once the packs are added
+    unmet = self.entry_quantities > self.added(packs)[self.entry_columns]
+    still_blocked = np.bincount(self.entry_combos[unmet], minlength=self.blocked) > 0
+    return self.blocked - int(still_blocked.sum())
+
+  def touched(self, pack):
+    # Blocked line-ups missing at least one card the pack contains
+    helps = self.supply[pack][self.entry_columns] > 0
+    return len(np.unique(self.entry_combos[helps]))
+
+  def estimate(self, gain):
+    return gain * self.total / self.sampled if self.sampled else 0.0
+
+  def ranking(self, candidates, costs=None):
+    costs = costs or {}
+    ranked = []
+    for packs in candidates:
+      gain = self.gain(packs)
+      cost = sum(costs.get(pack, 1.0) for pack in packs)
+      ranked.append({'packs': list(packs), 'gain': gain, 'estimate': self.estimate(gain), 'cost': cost,
+                     'gain_per_cost': gain / cost if cost else None})
+    ranked.sort(key=lambda entry: (-(entry['gain_per_cost'] or 0), -entry['gain'], entry['packs']))
+    return ranked
+
+  def rank_packs(self, candidates=None, costs=None):
+    candidates = sorted(self.supply) if candidates is None else candidates
+    return self.ranking([(pack,) for pack in candidates], costs)
+
+  def rank_sets(self, k, candidates=None, costs=None, pool=POOL_SIZE, top=None):
+    # Every set of k packs from the pool; a pack can pay off only with another
+    # so the pool is chosen by the blocked line-ups a pack touches, not gain
+    candidates = sorted(self.supply) if candidates is None else candidates
+    touched = {pack: self.touched(pack) for pack in candidates}
+    pool_packs = sorted([pack for pack in candidates if touched[pack]], key=lambda pack: (-touched[pack], pack))[:pool]
+    ranked = self.ranking(itertools.combinations(sorted(pool_packs), k), costs)
+    return ranked[:top] if top else ranked
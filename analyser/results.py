@@ -0,0 +1,95 @@
+import heapq, itertools, json, os, tempfile
+
+# Records sorted in memory at once when building the sorted view
+CHUNK_SIZE = 100000
+
+class ResultWriter(object):
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.f = open(filename, 'w')
+    self.valid = 0
+    self.invalid = 0
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def write(self, combo, missing_cards):
+    if len(missing_cards) == 0:
+      self.valid += 1
+    else:
+      self.invalid += 1
+    self.f.write(json.dumps({'combo': combo, 'missing': missing_cards}) + '\n')
+
+  def close(self):
+    self.f.close()
+
+def iter_results(filename):
+  with open(filename) as f:
+    for line in f:
+      if line.strip():
+        record = json.loads(line)
+        yield record['combo'], record['missing']
+
+def record_key(line):
+  return json.loads(line)['combo']
+
+def sort_results(filename, sorted_filename, chunk_size=CHUNK_SIZE):
+  # External merge sort: sorted runs go to temporary files and are merged, so
+  # memory is bounded by chunk_size records. Repeated combinations keep the
+  # last record written, as the dicts of the in-memory mode do.
+  chunks = []
+  try:
+    with open(filename) as f:
+      while True:
+        lines = list(itertools.islice(f, chunk_size))
+        if not lines:
+          break
+        lines.sort(key=record_key)
+        chunk = tempfile.TemporaryFile('w+')
+        chunk.writelines(lines)
+        chunk.seek(0)
+        chunks.append(chunk)
+
+    tmp_filename = sorted_filename + '.tmp'
+    with open(tmp_filename, 'w') as out:
+      pending = None
+      pending_key = None
+      for line in heapq.merge(*chunks, key=record_key):
+        key = record_key(line)
+        if pending is not None and key != pending_key:
+          out.write(pending)
+        pending = line
+        pending_key = key
+      if pending is not None:
+        out.write(pending)
+    os.replace(tmp_filename, sorted_filename)
+
+  finally:
+    for chunk in chunks:
+      chunk.close()
+
+  return sorted_filename
+
+def write_findings(sorted_filename, findings_filename):
+  # Same layout as json.dumps({'valid': ..., 'invalid': ...}, indent=2),
+  # written one record at a time from the sorted stream
+  with open(findings_filename, 'w') as out:
+    out.write('{\n')
+    for group in ('valid', 'invalid'):
+      out.write('  ' + json.dumps(group) + ': {')
+      first = True
+      for combo, missing_cards in iter_results(sorted_filename):
+        if (len(missing_cards) == 0) != (group == 'valid'):
+          continue
+        out.write('\n' if first else ',\n')
+        out.write('    ' + json.dumps(combo) + ': ' + json.dumps(missing_cards, indent=2).replace('\n', '\n    '))
+        first = False
+      out.write('}' if first else '\n  }')
+      out.write(',\n' if group == 'valid' else '\n')
+    out.write('}')
+
+  return findings_filename
@@ -0,0 +1,58 @@
+import numpy as np
+
+def iter_search(matrix, decks, record_prefixes=False):
+  # Depth-first walk over one deck per faction, keeping the running demand of
+  # the partial combination so overdrawn prefixes are dropped with their subtree
+  if not decks or 0 in [len(faction) for faction in decks]:
+    return
+  selection = matrix.selection(decks)
+  levels = selection.levels
+  available = selection.available
+  level_demand = [selection.demand[rows] for rows in levels]
+  last_level = len(levels) - 1
+
+  def deck_ids(combo):
+    return tuple(selection.deck_ids[list(combo)].tolist())
+
+  def expand(prefix, running):
+    level = len(prefix)
+    totals = level_demand[level] + running
+    overdrawn = (totals > available).any(axis=1)
+    combos = [prefix + (row,) for row in levels[level].tolist()]
+
+    missing = {}
+    if record_prefixes or level == last_level:
+      short_rows = np.flatnonzero(overdrawn)
+      if len(short_rows) > 0:
+        short = np.maximum(totals[short_rows] - available, 0)
+        short_combos = np.array([combos[i] for i in short_rows], dtype=np.intp)
+        missing = dict(zip(short_rows.tolist(), selection.missing_cards(short_combos, short)))
+
+    for i, combo in enumerate(combos):
+      if i in missing:
+        yield deck_ids(combo), missing[i]
+      elif overdrawn[i]:
+        # Every leaf below an overdrawn prefix is invalid
+        subtree = [[deck_id] for deck_id in deck_ids(combo)] + decks[level + 1:]
+        for result in matrix.iter_results(subtree):
+          yield result
+      elif level == last_level:
+        yield deck_ids(combo), {}
+      else:
+        for result in expand(combo, totals[i]):
+          yield result
+
+  for result in expand((), np.zeros(len(selection.columns), dtype=selection.demand.dtype)):
+    yield result
+
+def search_combinations(matrix, decks, record_prefixes=False):
+  valid = {
+    'valid': {},
+    'invalid': {}
+  }
+  for combo, missing_cards in iter_search(matrix, decks, record_prefixes):
+    if len(missing_cards) == 0:
+      valid['valid'][','.join(combo)] = missing_cards
+    else:
+      valid['invalid'][','.join(combo)] = missing_cards
+  return valid
@@ -0,0 +1,179 @@
+from collections import OrderedDict
+import json, os
+import numpy as np
+from analyser.canonical import canonical_code, file_hash
+from analyser.matrix import DemandMatrix
+
+SNAPSHOT_DIR = 'snapshot'
+
+# Columns kept for the analysis; every other field goes to the text files
+CARD_CATEGORIES = ('type_code', 'side_code', 'faction_code', 'pack_code')
+DECK_CATEGORIES = ('side_code', 'faction_code')
+ARRAYS = ('card_codes', 'card_canonical', 'card_quantity', 'deck_ids', 'deck_names',
+          'deck_offsets', 'deck_cards', 'deck_quantities') + \
+         tuple('card_' + name for name in CARD_CATEGORIES) + tuple('deck_' + name for name in DECK_CATEGORIES)
+CARD_TEXT = 'cards_text.json'
+DECK_TEXT = 'decks_text.json'
+
+def snapshot_hashes(cards_filename, decks_filename):
+  return {'cards': file_hash(cards_filename), 'decks': file_hash(decks_filename)}
+
+def encode(values):
+  # Small string columns become integer codes into a list of categories,
+  # in the narrowest type that holds them
+  categories = sorted(set(values))
+  lookup = {value: number for number, value in enumerate(categories)}
+  return np.array([lookup[value] for value in values], dtype=np.min_scalar_type(len(categories))), categories
+
+def write_json(data, filename):
+  with open(filename + '.tmp', 'w') as f:
+    f.write(json.dumps(data))
+  os.replace(filename + '.tmp', filename)
+
+def write_array(array, filename):
+  # Swapped in whole, so a process that has the old file memory-mapped keeps
+  # reading the old arrays
+  with open(filename + '.tmp', 'wb') as f:
+    np.save(f, array)
+  os.replace(filename + '.tmp', filename)
+
+def build_snapshot(cards, decks, hashes, snapshot_dir=SNAPSHOT_DIR):
+  if not os.path.isdir(snapshot_dir):
+    os.makedirs(snapshot_dir)
+  codes = sorted(cards)
+  rows = {code: row for row, code in enumerate(codes)}
+  deck_ids = list(decks)
+  arrays = {
+    'card_codes': np.array(codes),
+    'card_canonical': np.array([rows[canonical_code(cards, code)] for code in codes], dtype=np.int32),
+    'card_quantity': np.array([cards[code]['quantity'] for code in codes], dtype=np.int16),
+    'deck_ids': np.array(deck_ids),
+    'deck_names': np.array([decks[deck_id].get('name') or '' for deck_id in deck_ids]),
+    'deck_offsets': np.cumsum([0] + [len(decks[deck_id]['cards']) for deck_id in deck_ids]).astype(np.int32),
+    'deck_cards': np.array([rows[card] for deck_id in deck_ids for card in decks[deck_id]['cards']], dtype=np.int32),
+    'deck_quantities': np.array([quantity for deck_id in deck_ids for quantity in decks[deck_id]['cards'].values()],
+                                dtype=np.int16),
+  }
+  categories = {}
+  for name in CARD_CATEGORIES:
+    arrays['card_' + name], categories['card_' + name] = encode([cards[code].get(name) or '' for code in codes])
+  for name in DECK_CATEGORIES:
+    arrays['deck_' + name], categories['deck_' + name] = encode([decks[deck_id].get(name) or '' for deck_id in deck_ids])
+  # The old metadata goes first and the new last, so files from two
+  # different builds are never read together, even after a crash
+  meta_filename = os.path.join(snapshot_dir, 'meta.json')
+  if os.path.exists(meta_filename):
+    os.remove(meta_filename)
+  for name in ARRAYS:
+    write_array(arrays[name], os.path.join(snapshot_dir, name + '.npy'))
+
+  # Flavor text, illustrators, descriptions and the like are only read on demand
+  card_columns = {'code', 'maps_to', 'quantity'} | set(CARD_CATEGORIES)
+  deck_columns = {'cards', 'name'} | set(DECK_CATEGORIES)
+  write_json({code: {key: value for key, value in cards[code].items() if key not in card_columns} for code in codes},
+             os.path.join(snapshot_dir, CARD_TEXT))
+  write_json({deck_id: {key: value for key, value in decks[deck_id].items() if key not in deck_columns}
+              for deck_id in deck_ids}, os.path.join(snapshot_dir, DECK_TEXT))
+
+  write_json({'hashes': hashes, 'categories': categories}, meta_filename)
+
+class Snapshot(object):
+  # Array-backed cards and decks. Deck cards are stored as one flat list of
+  # card rows with per-deck offsets, in the order of the decks file.
+
+  def __init__(self, snapshot_dir, arrays, categories):
+    self.snapshot_dir = snapshot_dir
+    self.categories = categories
+    for name in ARRAYS:
+      setattr(self, name, arrays[name])
+    self.card_rows = {code: row for row, code in enumerate(self.card_codes.tolist())}
+    self.deck_rows = {deck_id: row for row, deck_id in enumerate(self.deck_ids.tolist())}
+    self.card_text = None
+    self.deck_text = None
+
+  def category(self, name, row):
+    return self.categories[name][getattr(self, name)[row]]
+
+  def card_index(self):
+    codes = self.card_codes.tolist()
+    return dict(zip(codes, self.card_codes[self.card_canonical].tolist()))
+
+  def deck_cards_for(self, deck_id):
+    row = self.deck_rows[deck_id]
+    start, end = self.deck_offsets[row], self.deck_offsets[row + 1]
+    return OrderedDict(zip(self.card_codes[self.deck_cards[start:end]].tolist(),
+                           self.deck_quantities[start:end].tolist()))
+
+  def decks(self):
+    # Name, side and faction per deck, as kept by the demand matrix
+    sides = np.array(self.categories['deck_side_code'])[self.deck_side_code].tolist()
+    factions = np.array(self.categories['deck_faction_code'])[self.deck_faction_code].tolist()
+    return OrderedDict((deck_id, {'name': name, 'side_code': side, 'faction_code': faction})
+                       for deck_id, name, side, faction
+                       in zip(self.deck_ids.tolist(), self.deck_names.tolist(), sides, factions))
+
+  def card_details(self, code):
+    if self.card_text is None:
+      with open(os.path.join(self.snapshot_dir, CARD_TEXT)) as f:
+        self.card_text = json.load(f)
+    row = self.card_rows[code]
+    card = dict(self.card_text[code], code=code, quantity=int(self.card_quantity[row]))
+    for name in CARD_CATEGORIES:
+      card[name] = self.category('card_' + name, row)
+    return card
+
+  def deck_details(self, deck_id):
+    if self.deck_text is None:
+      with open(os.path.join(self.snapshot_dir, DECK_TEXT)) as f:
+        self.deck_text = json.load(f)
+    deck = dict(self.deck_text[deck_id], name=str(self.deck_names[self.deck_rows[deck_id]]), cards=self.deck_cards_for(deck_id))
+    for name in DECK_CATEGORIES:
+      deck[name] = self.category('deck_' + name, self.deck_rows[deck_id])
+    return deck
+
+  def demand_matrix(self, collection):
+    # Same matrix as DemandMatrix(card_index, decks, collection), built from
+    # the flat card list: alternate printings collapse onto one column and a
+    # deck's card list keeps each canonical code where it first appears
+    canonical = self.card_canonical[self.deck_cards]
+    used = np.unique(canonical)
+    columns = np.searchsorted(used, canonical)
+    rows = np.repeat(np.arange(len(self.deck_ids)), np.diff(self.deck_offsets))
+
+    pairs, first, inverse = np.unique(rows * len(used) + columns, return_index=True, return_inverse=True)
+    quantities = np.bincount(inverse.ravel(), weights=self.deck_quantities, minlength=len(pairs)).astype(np.int32)
+    order = np.argsort(first, kind='stable')
+    pairs, quantities = pairs[order], quantities[order]
+    pair_rows, pair_columns = pairs // len(used), pairs % len(used)
+    deck_offsets = np.searchsorted(pair_rows, np.arange(len(self.deck_ids) + 1)).astype(np.int64)
+
+    card_codes = self.card_codes[used].tolist()
+    available = np.array([collection.get(code, 0) for code in card_codes], dtype=np.int32)
+    return DemandMatrix.from_arrays(self.deck_ids.tolist(), card_codes, deck_offsets, pair_columns.astype(np.int32),
+                                    quantities, available, self.decks())
+
+def read_snapshot(hashes, snapshot_dir=SNAPSHOT_DIR):
+  meta_filename = os.path.join(snapshot_dir, 'meta.json')
+  if not os.path.exists(meta_filename):
+    return None
+  with open(meta_filename) as f:
+    meta = json.load(f)
+  if meta.get('hashes') != hashes:
+    return None
+  arrays = {name: np.load(os.path.join(snapshot_dir, name + '.npy')) for name in ARRAYS}
+  return Snapshot(snapshot_dir, arrays, meta['categories'])
+
+def load_snapshot(cards_filename, decks_filename, snapshot_dir=SNAPSHOT_DIR):
+  # Rebuilt from the JSON files whenever either of them changes
+  hashes = snapshot_hashes(cards_filename, decks_filename)
+  snapshot = read_snapshot(hashes, snapshot_dir)
+  if snapshot is not None:
+    return snapshot
+
+  print('Compiling card and deck snapshot...')
+  with open(cards_filename) as f:
+    cards = json.load(f)
+  with open(decks_filename) as f:
+    decks = json.load(f)
+  build_snapshot(cards, decks, hashes, snapshot_dir)
+  return read_snapshot(hashes, snapshot_dir)
@@ -0,0 +1,118 @@
+from collections import OrderedDict
+import hashlib, json, os, time
+from analyser.canonical import file_hash
+
+STATE_FILE = '.stage_state.json'
+
+class Stage(object):
+  # A named step producing output files from input files. Settings are
+  # hashed along with the inputs so a changed setting also reruns the stage.
+  # Source stages read from the network rather than files, so they only run
+  # when their outputs are missing or they are asked for by name.
+
+  def __init__(self, name, action, inputs=(), outputs=(), settings=None, source=False):
+    self.name = name
+    self.action = action
+    self.inputs = tuple(inputs)
+    self.outputs = tuple(outputs)
+    self.settings = settings
+    self.source = source
+
+  def settings_hash(self):
+    return hashlib.sha1(json.dumps(self.settings, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def hashes(filenames):
+  return {filename: file_hash(filename) if os.path.exists(filename) else None for filename in filenames}
+
+class StageRunner(object):
+
+  def __init__(self, stages, state_filename=STATE_FILE):
+    self.stages = OrderedDict((stage.name, stage) for stage in stages)
+    self.producers = {output: stage.name for stage in stages for output in stage.outputs}
+    self.state_filename = state_filename
+    self.state = {}
+    if os.path.exists(state_filename):
+      with open(state_filename) as f:
+        self.state = json.load(f)
+    self.timings = OrderedDict()
+
+  def save_state(self):
+    with open(self.state_filename + '.tmp', 'w') as f:
+      f.write(json.dumps(self.state, indent=2))
+    os.replace(self.state_filename + '.tmp', self.state_filename)
+
+  def plan(self, targets):
+    # The targets and every stage producing one of their inputs, upstream first
+    order = []
+    visiting = set()
+
+    def visit(name):
+      if name in order:
+        return
+      if name in visiting:
+        raise ValueError('Stage dependency cycle through ' + name)
+      visiting.add(name)
+      for filename in self.stages[name].inputs:
+        if filename in self.producers:
+          visit(self.producers[filename])
+      visiting.discard(name)
+      order.append(name)
+
+    for target in targets:
+      if target not in self.stages:
+        raise KeyError('Unknown stage: ' + target)
+      visit(target)
+    return order
+
+  def record(self, stage):
+    self.state[stage.name] = {
+      'inputs': hashes(stage.inputs),
+      'outputs': hashes(stage.outputs),
+      'settings': stage.settings_hash(),
+    }
+
+  def stale_reason(self, stage):
+    if any(not os.path.exists(filename) for filename in stage.outputs):
+      return 'missing output'
+    if stage.source:
+      # run() still runs a source stage that is named or forced
+      return None
+    recorded = self.state.get(stage.name)
+    if recorded is None:
+      # Outputs made before the runner kept state are taken as they are
+      self.record(stage)
+      return None
+    if recorded['settings'] != stage.settings_hash():
+      return 'settings changed'
+    if recorded['inputs'] != hashes(stage.inputs):
+      return 'inputs changed'
+    if recorded['outputs'] != hashes(stage.outputs):
+      return 'outputs changed'
+    return None
+
+  def run(self, targets, force=False):
+    # Runs whatever is stale; named targets always run when forced, and
+    # named source stages always run
+    for name in self.plan(targets):
+      stage = self.stages[name]
+      reason = self.stale_reason(stage)
+      if name in targets and (force or stage.source):
+        reason = reason or 'requested'
+      if reason is None:
+        print('[%s] up to date' % name)
+        continue
+      print('[%s] running (%s)' % (name, reason))
+      start = time.perf_counter()
+      stage.action()
+      self.timings[name] = time.perf_counter() - start
+      print('[%s] done in %.2fs' % (name, self.timings[name]))
+      self.record(stage)
+      self.save_state()
+    self.save_state()
+    return self.timings
+
+  def report(self):
+    total = sum(self.timings.values())
+    for name, seconds in self.timings.items():
+      print('%-14s %8.2fs %5.1f%%' % (name, seconds, 100 * seconds / total if total else 0))
+    print('%-14s %8.2fs' % ('total', total))
@@ -0,0 +1,151 @@
+import sqlite3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS decks (
+  id TEXT PRIMARY KEY,
+  name TEXT,
+  side TEXT,
+  faction TEXT
+);
+CREATE TABLE IF NOT EXISTS combos (
+  id INTEGER PRIMARY KEY,
+  side TEXT NOT NULL,
+  combo TEXT NOT NULL,
+  valid INTEGER NOT NULL,
+  missing_count INTEGER NOT NULL,
+  UNIQUE (side, combo)
+);
+CREATE TABLE IF NOT EXISTS combo_decks (
+  combo_id INTEGER NOT NULL REFERENCES combos(id) ON DELETE CASCADE,
+  deck_id TEXT NOT NULL,
+  faction TEXT,
+  position INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS missing_cards (
+  combo_id INTEGER NOT NULL REFERENCES combos(id) ON DELETE CASCADE,
+  card_code TEXT NOT NULL,
+  quantity INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deck_summary (
+  side TEXT NOT NULL,
+  deck_id TEXT NOT NULL,
+  valid INTEGER NOT NULL,
+  invalid INTEGER NOT NULL,
+  PRIMARY KEY (side, deck_id)
+);
+CREATE INDEX IF NOT EXISTS ix_combos_side_valid ON combos (side, valid, missing_count);
+CREATE INDEX IF NOT EXISTS ix_combo_decks_deck ON combo_decks (deck_id, combo_id);
+CREATE INDEX IF NOT EXISTS ix_combo_decks_faction ON combo_decks (faction, deck_id);
+CREATE INDEX IF NOT EXISTS ix_combo_decks_combo ON combo_decks (combo_id);
+CREATE INDEX IF NOT EXISTS ix_missing_cards_card ON missing_cards (card_code, combo_id);
+CREATE INDEX IF NOT EXISTS ix_missing_cards_combo ON missing_cards (combo_id);
+'''
+
+class CombinationStore(object):
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.db = sqlite3.connect(filename)
+    self.db.execute('PRAGMA foreign_keys = ON')
+    self.db.executescript(SCHEMA)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    self.db.close()
+
+  def add_decks(self, decks):
+    with self.db:
+      self.db.executemany(
+        'INSERT OR REPLACE INTO decks (id, name, side, faction) VALUES (?, ?, ?, ?)',
+        [(str(d), decks[d].get('name'), decks[d].get('side_code'), decks[d].get('faction_code')) for d in decks])
+
+  def clear(self, side):
+    with self.db:
+      self.db.execute('DELETE FROM combos WHERE side = ?', (side,))
+      self.db.execute('DELETE FROM deck_summary WHERE side = ?', (side,))
+
+  def add(self, side, combo, missing_cards, factions=None):
+    # A combination met again in a later iteration has the same result
+    cursor = self.db.execute(
+      'INSERT OR IGNORE INTO combos (side, combo, valid, missing_count) VALUES (?, ?, ?, ?)',
+      (side, combo, int(len(missing_cards) == 0), sum(missing_cards.values())))
+    if cursor.rowcount == 0:
+      return None
+    if factions is None:
+      factions = self.deck_factions()
+    combo_id = cursor.lastrowid
+    self.db.executemany(
+      'INSERT INTO combo_decks (combo_id, deck_id, faction, position) VALUES (?, ?, ?, ?)',
+      [(combo_id, deck_id, factions.get(deck_id), position) for position, deck_id in enumerate(combo.split(','))])
+    self.db.executemany(
+      'INSERT INTO missing_cards (combo_id, card_code, quantity) VALUES (?, ?, ?)',
+      [(combo_id, card, missing_cards[card]) for card in missing_cards])
+    return combo_id
+
+  def recorded(self, side, results):
+    # Pass (combo key, missing cards) results through, storing each on the way
+    with self.db:
+      factions = self.deck_factions()
+      for combo, missing_cards in results:
+        self.add(side, combo, missing_cards, factions)
+        yield combo, missing_cards
+      self.summarise(side)
+
+  def add_results(self, side, results):
+    for result in self.recorded(side, results):
+      pass
+
+  def summarise(self, side):
+    # Per-deck counts so the viewer can list decks without scanning combos
+    self.db.execute('DELETE FROM deck_summary WHERE side = ?', (side,))
+    self.db.execute(
+      'INSERT INTO deck_summary (side, deck_id, valid, invalid) '
+      'SELECT c.side, cd.deck_id, SUM(c.valid), SUM(1 - c.valid) FROM combo_decks cd '
+      'JOIN combos c ON c.id = cd.combo_id WHERE c.side = ? GROUP BY cd.deck_id', (side,))
+
+  def deck_factions(self):
+    return dict(self.db.execute('SELECT id, faction FROM decks'))
+
+  def missing_cards(self, combo_id):
+    return dict(self.db.execute(
+      'SELECT card_code, quantity FROM missing_cards WHERE combo_id = ? ORDER BY rowid', (combo_id,)))
+
+  def combos(self, side, valid=True):
+    return [row[0] for row in self.db.execute(
+      'SELECT combo FROM combos WHERE side = ? AND valid = ? ORDER BY combo', (side, int(valid)))]
+
+  def missing_counts(self, side):
+    # Every combination of the side with its count of missing copies
+    return self.db.execute('SELECT combo, missing_count FROM combos WHERE side = ? ORDER BY combo', (side,)).fetchall()
+
+  def combos_with_deck(self, deck_id, valid=True):
+    return [row[0] for row in self.db.execute(
+      'SELECT c.combo FROM combo_decks cd JOIN combos c ON c.id = cd.combo_id '
+      'WHERE cd.deck_id = ? AND c.valid = ? ORDER BY c.combo', (str(deck_id), int(valid)))]
+
+  def combos_missing_at_most(self, side, quantity):
+    return [row[0] for row in self.db.execute(
+      'SELECT combo FROM combos WHERE side = ? AND missing_count <= ? ORDER BY missing_count, combo',
+      (side, quantity))]
+
+  def faction_decks(self, side, valid=True):
+    # Factions in the order they appear in combinations, each with every deck
+    # that is part of at least one matching combination
+    factions = {}
+    first = self.db.execute(
+      'SELECT cd.faction FROM combo_decks cd WHERE cd.combo_id = '
+      '(SELECT id FROM combos WHERE side = ? AND valid = ? ORDER BY combo LIMIT 1) ORDER BY cd.position',
+      (side, int(valid)))
+    for row in first:
+      factions[row[0]] = set()
+    count_column = 'valid' if valid else 'invalid'
+    for faction, deck_id in self.db.execute(
+        'SELECT d.faction, s.deck_id FROM deck_summary s LEFT JOIN decks d ON d.id = s.deck_id '
+        'WHERE s.side = ? AND s.' + count_column + ' > 0', (side,)):
+      factions.setdefault(faction, set()).add(deck_id)
+    return factions
@@ -0,0 +1,112 @@
+from collections import OrderedDict
+import random
+from analyser.cards import resolve_maps_to
+
+# Sizes of the shipped data, scaled by the generator
+CARDS = 1552
+DECKS = 600
+PACK_SIZE = 60
+ALTERNATE_SHARE = 0.1    # Cards reprinted under an existing title
+DECK_CARDS = (30, 50)    # Distinct cards per deck
+FACTIONS = {
+  'corp': ['haas-bioroid', 'jinteki', 'nbn', 'weyland-consortium', 'neutral-corp'],
+  'runner': ['anarch', 'criminal', 'shaper', 'neutral-runner'],
+}
+TYPES = {
+  'corp': ['agenda', 'asset', 'ice', 'operation', 'upgrade'],
+  'runner': ['event', 'hardware', 'program', 'resource'],
+}
+FILLER = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. '
+
+def make_card(code, title, side, faction, type_code, pack, rng):
+  # Same fields as a NetrunnerDB card, with text of a similar length
+  return OrderedDict([
+    ('code', code),
+    ('deck_limit', 1 if type_code == 'identity' else 3),
+    ('faction_code', faction),
+    ('flavor', FILLER * rng.randint(0, 2)),
+    ('illustrator', 'Artist %d' % rng.randint(1, 200)),
+    ('influence_limit', 15 if type_code == 'identity' else None),
+    ('keywords', ''),
+    ('minimum_deck_size', 45 if type_code == 'identity' else None),
+    ('pack_code', pack),
+    ('position', int(code[-3:])),
+    ('quantity', 1 if type_code == 'identity' else rng.choice((1, 2, 3, 3, 3))),
+    ('side_code', side),
+    ('text', FILLER * rng.randint(1, 4)),
+    ('title', title),
+    ('type_code', type_code),
+    ('uniqueness', False),
+    ('image_url', 'https://netrunnerdb.com/card_image/%s.png' % code),
+    ('maps_to', []),
+  ])
+
+def generate_cards(scale=1, seed=0):
+  rng = random.Random('cards-%s-%s' % (scale, seed))
+  cards = OrderedDict()
+  titles = []
+  for number in range(int(CARDS * scale)):
+    pack_number, position = divmod(number, PACK_SIZE)
+    code = '%03d%03d' % (pack_number + 1, position + 1)
+    pack = 'p%03d' % (pack_number + 1)
+    if titles and rng.random() < ALTERNATE_SHARE:
+      title, side, faction, type_code = rng.choice(titles)
+    else:
+      side = rng.choice(list(FACTIONS))
+      faction = rng.choice(FACTIONS[side])
+      # Every faction gets identities early so decks can be built at any scale
+      type_code = 'identity' if position < 2 * len(FACTIONS[side]) or rng.random() < 0.03 else rng.choice(TYPES[side])
+      title = 'Card %d' % number
+      titles.append((title, side, faction, type_code))
+    cards[code] = make_card(code, title, side, faction, type_code, pack, rng)
+  return resolve_maps_to(cards)
+
+def generate_decks(cards, scale=1, seed=0):
+  rng = random.Random('decks-%s-%s' % (scale, seed))
+  pools = {}
+  identities = {}
+  for code, card in cards.items():
+    key = (card['side_code'], card['faction_code'])
+    if card['type_code'] == 'identity':
+      if not card['faction_code'].startswith('neutral'):
+        identities.setdefault(key, []).append(code)
+    else:
+      pools.setdefault(key, []).append(code)
+
+  decks = OrderedDict()
+  keys = sorted(identities)
+  for number in range(int(DECKS * scale)):
+    side, faction = rng.choice(keys)
+    pool = pools.get((side, faction), []) + pools.get((side, 'neutral-' + side), [])
+    deck_cards = OrderedDict([(rng.choice(identities[(side, faction)]), 1)])
+    for code in rng.sample(pool, min(len(pool), rng.randint(*DECK_CARDS))):
+      deck_cards[code] = rng.choice((1, 2, 3, 3))
+    deck_id = str(1000 + number)
+    decks[deck_id] = OrderedDict([
+      ('id', int(deck_id)),
+      ('date_creation', '%04d-%02d-%02dT00:00:00+00:00' % (rng.randint(2014, 2019), rng.randint(1, 12), rng.randint(1, 28))),
+      ('date_update', '%04d-%02d-%02dT00:00:00+00:00' % (rng.randint(2014, 2019), rng.randint(1, 12), rng.randint(1, 28))),
+      ('name', 'Deck %d' % number),
+      ('description', '<p>' + FILLER * rng.randint(0, 20) + '</p>'),
+      ('user_id', rng.randint(1, 5000)),
+      ('user_name', 'user%d' % rng.randint(1, 5000)),
+      ('tournament_badge', rng.random() < 0.1),
+      ('cards', deck_cards),
+      ('mwl_code', 'napd'),
+      ('side_code', side),
+      ('faction_code', faction),
+    ])
+  return decks
+
+def generate_packs(cards, seed=0):
+  # Pack ownership in the form of deck_analyser.packs: pack_code -> (id, copies)
+  rng = random.Random('packs-%s' % seed)
+  packs = OrderedDict()
+  for number, pack in enumerate(sorted(set(card['pack_code'] for card in cards.values())), 1):
+    packs[pack] = (str(number), rng.choice((0, 1, 1, 2)))
+  return packs
+
+def generate_corpus(scale=1, seed=0):
+  cards = generate_cards(scale, seed)
+  decks = generate_decks(cards, scale, seed)
+  return cards, decks, generate_packs(cards, seed)
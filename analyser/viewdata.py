@@ -0,0 +1,111 @@
+from collections import OrderedDict
+import itertools, json, os
+from analyser.comboindex import ComboIndex
+from analyser.combotable import ComboTable
+from analyser.images import deck_images
+from analyser.snapshot import SNAPSHOT_DIR, load_snapshot
+from analyser.store import CombinationStore
+
+CHUNK_SIZE = 5000    # Records read between progress reports
+
+# Viewer side name: (side code, findings file written by the analyser)
+SIDES = OrderedDict([
+  ('Corporations', ('corp', 'valid_corp_combinations.txt')),
+  ('Runners', ('runner', 'valid_runner_combinations.txt')),
+])
+
+class ViewerData(object):
+  # Everything the viewer shows, kept apart from the wx frame so it can be
+  # loaded on a background thread. Each side's combinations are read, in
+  # chunks from the JSONL stream or from the indexed store, into a ComboTable
+  # for the result list and a ComboIndex of the valid ones for the deck
+  # choosers; the side becomes available as soon as both are built.
+
+  def __init__(self, cards_file='cards.json', decks_file='decks.json', store_file='combinations.db', sides=SIDES,
+               chunk_size=CHUNK_SIZE, snapshot_dir=SNAPSHOT_DIR):
+    self.cards_file = cards_file
+    self.decks_file = decks_file
+    self.snapshot_dir = snapshot_dir
+    self.sides = sides
+    self.chunk_size = chunk_size
+    self.decks = None
+    self.snapshot = None
+    self.indexes = {side: None for side in sides}
+    self.tables = {side: None for side in sides}
+    self.store_file = store_file
+
+  def load_decks(self):
+    # the compact snapshot holds what the viewer needs; deck descriptions and
+    # card text are read from it only when asked for
+    self.snapshot = load_snapshot(self.cards_file, self.decks_file, self.snapshot_dir)
+    self.decks = self.snapshot.decks()
+
+  def iter_combos(self, filename, progress=None):
+    # (combo, missing copies) for every combination, preferring the sorted
+    # JSONL stream from the analyser, read a record at a time; the indented
+    # findings file can only be read whole
+    stream_filename = os.path.splitext(filename)[0] + '.jsonl'
+    if not os.path.exists(stream_filename):
+      with open(filename) as f:
+        findings = json.load(f)
+      for combo, missing_cards in itertools.chain(findings['valid'].items(), findings['invalid'].items()):
+        yield combo, sum(missing_cards.values())
+      if progress:
+        progress(1.0)
+      return
+    size = os.path.getsize(stream_filename) or 1
+    with open(stream_filename, 'rb') as f:
+      for number, line in enumerate(iter(f.readline, b''), 1):
+        record = json.loads(line)
+        yield record['combo'], sum(record['missing'].values())
+        if progress and number % self.chunk_size == 0:
+          progress(f.tell() / size)
+    if progress:
+      progress(1.0)
+
+  def load_side(self, side, progress=None, store=None):
+    if store:
+      results = store.missing_counts(self.sides[side][0])
+    else:
+      side_progress = (lambda fraction: progress(side, fraction)) if progress else None
+      results = list(self.iter_combos(self.sides[side][1], side_progress))
+    combos = [combo for combo, missing in results]
+    self.tables[side] = ComboTable(self.decks, combos, [missing for combo, missing in results])
+    self.indexes[side] = ComboIndex(self.decks, (combo for combo, missing in results if missing == 0))
+
+  def load(self, progress=None, side_ready=None):
+    # progress(side or None, fraction) while reading; side_ready(side) once a
+    # side can be shown. sqlite connections stay on the thread that opened
+    # them, so the store is opened here, on the loading thread, and closed
+    # once both sides are read into the tables and indexes.
+    self.load_decks()
+    if progress:
+      progress(None, 1.0)
+    store = CombinationStore(self.store_file) if self.store_file and os.path.exists(self.store_file) else None
+    try:
+      for side in self.sides:
+        self.load_side(side, progress, store)
+        if side_ready:
+          side_ready(side)
+    finally:
+      if store:
+        store.close()
+
+  def ready(self, side):
+    return self.tables[side] is not None
+
+  def faction_decks(self, side, selected=()):
+    # Decks per faction still in a valid combination with every selected deck
+    return self.indexes[side].faction_decks(selected)
+
+  def matching(self, side, selected=()):
+    return self.indexes[side].matching(selected)
+
+  def count(self, side, selected=()):
+    # Valid combinations holding every selected deck
+    return self.indexes[side].count(selected)
+
+  def deck_images(self, deck_id):
+    # (code, image url) for a deck's cards, for ImageCache.prefetch
+    deck = self.snapshot.deck_details(deck_id)
+    return deck_images(deck, {code: self.snapshot.card_details(code) for code in deck['cards']})
@@ -1,9 +1,12 @@
+import atexit, threading
 from datetime import datetime
 from flask import render_template, flash, redirect, url_for, request, g, \
-  jsonify, current_app
+  jsonify, current_app, abort, Response
 from flask_login import current_user, login_required
 from flask_babel import _, get_locale
 from guess_language import guess_language
+from requests import RequestException
+from analyser.images import IMAGE_URL, ImageCache
 from app import db
 from app.main.forms import EditProfileForm, PostForm, SearchForm, MessageForm
 from app.models import User, Post, Message, Notification
@@ -196,3 +199,26 @@ def notifications():
     'data': n.get_data(),
     'timestamp': n.timestamp
   } for n in notifications])
+
+card_images_lock = threading.Lock()
+
+def card_images():
+  # The cache makes its directory and starts its download threads, so it is
+  # only made once a card image is asked for, and shut down at exit
+  with card_images_lock:
+    cache = current_app.extensions.get('card_images')
+    if cache is None:
+      cache = current_app.extensions['card_images'] = ImageCache(current_app.config['CARD_IMAGE_DIR'])
+      atexit.register(cache.close)
+  return cache
+
+@bp.route('/card_image/<code>')
+def card_image(code):
+  # Served from the shared card image cache, fetched from NetrunnerDB once
+  if not code.isdigit():
+    abort(404)
+  try:
+    data = card_images().get(code, IMAGE_URL.format(code=code))
+  except RequestException:
+    abort(404)
+  return Response(data, mimetype='image/png')
@@ -0,0 +1,151 @@
+#!/usr/local/bin/python3
+import argparse, json, os, random, resource, shutil, subprocess, sys, tempfile, time
+from analyser.cache import load_matrix
+from analyser.canonical import load_card_index
+from analyser.cards import card_fields, update_cards
+from analyser.decks import select_decks
+from analyser.search import iter_search
+from analyser.snapshot import load_snapshot
+from analyser.synthetic import FACTIONS, generate_corpus
+
+HISTORY_FILE = 'benchmark_history.jsonl'
+# Multiples of the shipped cards.json/decks.json sizes; 100x takes about a
+# minute and a half and 1.7 GB, most of it generating and writing the corpus
+SCALES = [1, 10, 100]
+DECKS_PER_FACTION = 8    # Decks per faction in the combinations measured
+CHECKED_COMBOS = 2000    # Combinations run through the reference check_combination
+
+def peak_rss():
+  # Kilobytes on Linux; the high-water mark of the whole process so far
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class Timer(object):
+
+  def __init__(self):
+    self.stages = {}
+
+  def stage(self, name, action, combos=None):
+    start = time.perf_counter()
+    result = action()
+    seconds = time.perf_counter() - start
+    # ru_maxrss never goes down, so this is the peak up to the end of the
+    # stage, not of the stage alone
+    self.stages[name] = {'seconds': seconds, 'cumulative_peak_rss_kb': peak_rss()}
+    count = combos(result) if combos else None
+    if count is not None:
+      self.stages[name]['combos'] = count
+      self.stages[name]['combos_per_sec'] = count / seconds if seconds else None
+    return result
+
+def write_json(data, filename):
+  with open(filename, 'w') as f:
+    f.write(json.dumps(data, indent=2))
+
+def read_json(filename):
+  with open(filename) as f:
+    return json.load(f)
+
+def run_scale(scale, seed):
+  # Runs in its own process so peak RSS belongs to this scale alone
+  import deck_analyser
+  timer = Timer()
+  workdir = tempfile.mkdtemp()
+  try:
+    cards_file = os.path.join(workdir, 'cards.json')
+    decks_file = os.path.join(workdir, 'decks.json')
+    collection_file = os.path.join(workdir, 'collection.json')
+    cards, decks, packs = timer.stage('generate', lambda: generate_corpus(scale, seed))
+
+    timer.stage('json_dump', lambda: (write_json(cards, cards_file), write_json(decks, decks_file)))
+    timer.stage('json_load', lambda: (read_json(cards_file), read_json(decks_file)))
+    api_cards = [card_fields(card) for card in cards.values()]
+    os.remove(cards_file)
+    timer.stage('maps_to', lambda: update_cards(cards_file, api_cards))
+    timer.stage('collection', lambda: deck_analyser.construct_collection(cards_file, collection_file, packs, {}))
+    timer.stage('card_index', lambda: load_card_index(cards_file))
+    snapshot_dir = os.path.join(workdir, 'snapshot')
+    timer.stage('snapshot_build', lambda: load_snapshot(cards_file, decks_file, snapshot_dir))
+    timer.stage('snapshot_load', lambda: load_snapshot(cards_file, decks_file, snapshot_dir))
+    cache_dir = os.path.join(workdir, 'matrix_cache')
+    matrix = timer.stage('matrix_build', lambda: load_matrix(cards_file, decks_file, collection_file, cache_dir, snapshot_dir))
+    timer.stage('matrix_load', lambda: load_matrix(cards_file, decks_file, collection_file, cache_dir, snapshot_dir))
+
+    included = {faction: True for faction in FACTIONS['corp'] if not faction.startswith('neutral')}
+    selected = select_decks(matrix.decks, included, [], DECKS_PER_FACTION, True, random.Random(seed))
+    timer.stage('find_combinations', lambda: matrix.find_combinations(selected),
+                lambda result: len(result['valid']) + len(result['invalid']))
+    timer.stage('search', lambda: sum(1 for result in iter_search(matrix, selected)), lambda count: count)
+
+    card_index = load_card_index(cards_file)
+    collection = read_json(collection_file)
+    rng = random.Random(seed)
+    combos = [[rng.choice(faction) for faction in selected] for i in range(CHECKED_COMBOS)]
+    timer.stage('check_combination', lambda: [deck_analyser.check_combination(card_index, decks, combo, collection) for combo in combos],
+                len)
+  finally:
+    shutil.rmtree(workdir)
+
+  return {'scale': scale, 'seed': seed, 'cards': len(cards), 'decks': len(decks), 'peak_rss_kb': peak_rss(), 'stages': timer.stages}
+
+def git_commit():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def measure(scale, seed):
+  output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', str(scale), '--seed', str(seed)])
+  return json.loads(output.decode().strip().splitlines()[-1])
+
+def read_history(history_file):
+  if not os.path.exists(history_file):
+    return []
+  with open(history_file) as f:
+    return [json.loads(line) for line in f if line.strip()]
+
+def print_run(run, previous=None):
+  print('scale %sx: %d cards, %d decks, peak RSS %.1f MB, commit %s' % (
+    run['scale'], run['cards'], run['decks'], run['peak_rss_kb'] / 1024.0, run.get('commit')))
+  for name, stage in run['stages'].items():
+    line = '  %-18s %9.3fs' % (name, stage['seconds'])
+    if 'cumulative_peak_rss_kb' in stage:
+      line += ' %9.1f MB peak so far' % (stage['cumulative_peak_rss_kb'] / 1024.0)
+    if stage.get('combos_per_sec'):
+      line += ' %12.0f combos/s' % stage['combos_per_sec']
+    if previous and name in previous['stages'] and stage['seconds']:
+      line += '   x%.2f vs %s' % (previous['stages'][name]['seconds'] / stage['seconds'], previous.get('commit'))
+    print(line)
+
+def main(argv = None):
+  parser = argparse.ArgumentParser(description='Time the analyser hot paths on synthetic corpora.')
+  parser.add_argument('scales', nargs='*', type=float, default=SCALES, help='corpus sizes relative to the shipped data')
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--history', default=HISTORY_FILE, help='JSONL file each run is appended to')
+  parser.add_argument('--compare', action='store_true', help='show the last recorded run per scale against the one before')
+  parser.add_argument('--child', type=float, help=argparse.SUPPRESS)
+  args = parser.parse_args(argv)
+
+  if args.child is not None:
+    print(json.dumps(run_scale(args.child, args.seed)))
+    return
+
+  history = read_history(args.history)
+  if args.compare:
+    for scale in sorted(set(run['scale'] for run in history)):
+      runs = [run for run in history if run['scale'] == scale]
+      print_run(runs[-1], runs[-2] if len(runs) > 1 else None)
+    return
+
+  for scale in args.scales:
+    run = measure(scale, args.seed)
+    run['commit'] = git_commit()
+    run['timestamp'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    run['python'] = sys.version.split()[0]
+    previous = [old for old in history if old['scale'] == run['scale']]
+    print_run(run, previous[-1] if previous else None)
+    with open(args.history, 'a') as f:
+      f.write(json.dumps(run) + '\n')
+    history.append(run)
+
+if __name__ == '__main__':
+  main()
@@ -18,6 +18,7 @@ class Config(object):
   MS_TRANSLATOR_KEY = os.environ.get('MS_TRANSLATOR_KEY')
   ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL')
   POSTS_PER_PAGE = int(os.environ.get('POSTS_PER_PAGE'))
+  CARD_IMAGE_DIR = os.environ.get('CARD_IMAGE_DIR') or 'image_cache'
 
 class TestConfig(Config):
   TESTING = True
@@ -1,22 +1,67 @@
 #!/usr/local/bin/python3
-from html.parser import HTMLParser
 from collections import OrderedDict
-import requests, json, itertools, random, csv, os
+import argparse, itertools, json, os
+import numpy as np
+from analyser.blocking import BlockingIndex
+from analyser.cache import load_matrix
+from analyser.canonical import load_card_index
+from analyser.cards import update_cards
+from analyser.crawler import DecklistCrawler
+from analyser.decks import refresh_decks, select_decks
+from analyser.estimate import FeasibilityEstimator
+from analyser.download import DeckDownloader, make_session
+from analyser.graph import CompatibilityGraph
+from analyser.optimise import LineupOptimiser, deck_scores
+from analyser.parallel import ParallelAnalyser
+from analyser.purchase import PurchaseOptimiser, pack_supply
+from analyser.pipeline import ingest, iter_ids
+from analyser.results import ResultWriter, iter_results, sort_results, write_findings
+from analyser.search import iter_search
+from analyser.snapshot import load_snapshot
+from analyser.stages import Stage, StageRunner
+from analyser.store import CombinationStore
+
+# Stages are chosen on the command line (see --help); these are their settings
 
-SEARCH = False
 MAX_SEARCH_PAGES = 20
 
-GET_DECKS = False
+INCREMENTAL_DECKS = True    # Only fetch and classify decks that are new or whose date_update moved
+RECHECK_DECKS = False    # Also refetch known decks to catch edits; each costs a request unless the HTTP cache gets a 304
+DOWNLOAD_WORKERS = 8    # Decklists fetched at the same time
+REQUESTS_PER_SECOND = 10    # Politeness limit for NetrunnerDB
+HTTP_CACHE_DIR = 'http_cache'    # Raw NetrunnerDB responses, revalidated with ETag/Last-Modified; None to disable
+HTTP_CACHE_MAX_AGE = None    # Seconds a cached response is used without revalidating
+OFFLINE = False    # Replay NetrunnerDB responses from the cache only
 
 IGNORED_DECK_IDS = [
   '',
 ]
-EXPORT_DECKS = False
 
-UPDATE_COLLECTION = False
-
-FIND_COMBINATIONS = True
 SHUFFLE_DECKS = True    # Should only be set to False if known
+ENUMERATE_COMBINATIONS = False    # Find every valid combination across all decks instead of sampling
+PRUNE_COMBINATIONS = False    # Depth-first search, dropping partial combinations that overdraw the collection
+RECORD_PREFIXES = False    # When pruning, record only the overdrawn prefix instead of every invalid combination
+WORKERS = 1    # Processes used for the iterations, 0 for one per core
+SEED = None    # Seed for parallel deck shuffles, None for a fresh shuffle each run
+STREAM_RESULTS = False    # Write each result to a JSONL stream as it is found and sort it on disk
+STORE_RESULTS = False    # Also record results in an indexed SQLite store for the viewer
+BLOCKING_INDEX = True    # Index the cards blocking each invalid combination; holds every invalid combination in memory
+BLOCKING_CARDS = 20    # Cards and card pairs listed as unlocking the most invalid combinations
+
+TOP_LINEUPS = 10    # Best-scoring buildable line-ups kept by the lineups stage
+SCORE_WEIGHTS = {'recency': 1.0, 'tournament_badge': 0.5}    # Deck score: recency from date_update, tournament badge
+RECENCY_HALF_LIFE = 365    # Days for a deck's recency score to halve
+DECK_WEIGHTS = {}    # Extra score per deck id, e.g. {'6400': 2.0}
+LINEUP_TIME_LIMIT = None    # Seconds before the lineup search stops and reports its gap to the optimum
+
+ESTIMATE_PRECISION = 0.005    # Stop sampling once the feasible share is known to within this, either side
+ESTIMATE_CONFIDENCE = 0.95
+ESTIMATE_MAX_SAMPLES = 1000000
+ESTIMATE_WEIGHTED = False    # Draw decks in proportion to their score (SCORE_WEIGHTS) instead of uniformly
+
+PURCHASE_SET_SIZE = 2    # Also rank sets of this many packs (1 for single packs only)
+PURCHASE_SAMPLE_SIZE = 100000    # Line-ups per side scored for each candidate purchase
+PACK_COSTS = {}    # Relative price per pack code, 1 when not given
 
 CORP = True
 MAX_DECKS_PER_CORP = 6
@@ -97,7 +142,7 @@ packs = {
   'cotc'  : ('58', 1),  # council of the crest
   'tdatd' : ('59', 1),  # the devil and the dragon
   'win'   : ('60', 0),  # whispers in nalubaale
-  'ka'    : ('61', 1)   # kampala ascendant
+  'ka'    : ('61', 1),  # kampala ascendant
   'rar'   : ('62', 1),  # reign and reverie
   'mo'    : ('63', 0),  # magnum opus
   'napd'  : ('64', 0),  # NAPD multiplayer
@@ -112,189 +157,201 @@ extra_cards = {
   '06095' : 1,
 }
 
+HEADERS = {
+  'User-Agent' : 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_13_6) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/11.1.2 Safari/605.1.15',
+  'Accept' : 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'
+}
+
+# Search data
+PAYLOADS = [
+  {
+    'faction' : '',
+    'sort' : 'popularity',
+    'rotation_id' : '',
+    'author' : '',
+    'title' : '',
+    'is_legal' : '',
+    'mwl_code' : '',
+    'packs[]' : [packs[p][0] for p in packs],
+  }
+]
+
+# old payload for big boxes only
+#  {
+#    'faction' : '',
+#    'sort' : 'popularity',
+#    'rotation_id' : '',
+#    'author' : 'filk',
+#    'title' : '',
+#    'is_legal' : '',
+#    'mwl_code' : '',
+#    'packs[]' : ['1', '8', '21', '28', '35', '51, '55', '62'],
+#  }
+
 # other purchases made - not included in search parameters
 # 2015 world championships HB engineering the future
 # 2015 world championships valencia (anarch)
 
 
-class MyDeckParser(HTMLParser):
-
-  decks = set()
-
-  def handle_starttag(self, tag, attrs):
-    if tag == 'a':
-      for attr in attrs:
-        if attr[0] == 'href' and attr[1].startswith('/en/decklist/'):
-          self.decks.add(attr[1].split('/')[3])
+def http_session(headers = None):
+  return make_session(headers, DOWNLOAD_WORKERS, cache_dir=HTTP_CACHE_DIR, offline=OFFLINE, max_age=HTTP_CACHE_MAX_AGE)
 
 def write_cards(card_filename, headers = None):
   print('Downloading Cards...')
-  cards = OrderedDict()
   url = 'https://netrunnerdb.com/api/2.0/public/cards'
-  r = requests.get(url, headers=headers)
+  r = http_session(headers).get(url)
+  r.raise_for_status()
 
+  # Patch the existing file, re-resolving alternate printings (maps_to) only
+  # for the titles of new or changed cards
   all_cards = r.json()['data']
-  for card in all_cards:
-    cards[card['code']] = card
-    if 'image_url' not in cards[card['code']]:
-      cards[card['code']]['image_url'] = 'https://netrunnerdb.com/card_image/'+card['code']+'.png'
-    cards[card['code']]['maps_to'] = set()
-
-  # Need to perform check of card names to map core to revised core
-  for card_counter in cards:
-    for comparison_card in cards:
-      if cards[card_counter]['title'] == cards[comparison_card]['title'] and card_counter != comparison_card:
-        cards[card_counter]['maps_to'].add(comparison_card)
-        cards[comparison_card]['maps_to'].add(card_counter)
-
-  for card in all_cards:
-    cards[card['code']]['maps_to'] = list(cards[card['code']]['maps_to'])
-
-  # Write to file
-  with open(card_filename, 'w') as f:
-    f.write(json.dumps(cards, indent=2))
+  changed = update_cards(card_filename, all_cards)
+  print('Updated', len(changed), 'cards')
 
   return card_filename
 
-def search_results(payloads, headers = None, max_pages = 40):
-  print('Searching NetRunnerDB...')
-  parser = MyDeckParser()
-  try:
-    payload_counter = 0
-    for payload in payloads:
-      payload_counter += 1
-      for page in range(1,max_pages+1):
-        print('processing payload',payload_counter,'page',page)
-        url = 'https://netrunnerdb.com/en/decklists/find'
-        if page != 1:
-          url += '/' + str(page)
-
-        r = requests.get(url, headers=headers, params=payload)
-        parser.feed(r.text)
-
-    return parser.decks
-
-  except Exception as e:
-      print(e.code)
-      print(e.read())
-
-def write_id_file(parser_result,filename):
-  print('Writing Deck IDs to File...')
-  with open(filename,'w') as f:
-    for deck_id in parser_result:
-      f.write(deck_id+"\n")
-  return filename
-
-def write_decks(id_filename, deck_filename, headers = None):
+def ingest_decks(deck_ids, deck_filename, cards_filename, csv_filename = None, session = None, limiter = None):
+  # Each deck is downloaded, classified and exported as its id arrives
   print('Downloading Decks...')
-  decks = OrderedDict()
-  with open(id_filename) as f:
-    for id in f:
-      id = id.strip()
-      print('Processing',id)
-
-      # Use NetrunnerDB API
-      url = 'https://netrunnerdb.com/api/2.0/public/decklist/'+id
-      r = requests.get(url, headers=headers)
-
-      decks[id] = r.json()['data'][0]
-
-    # Write to file
-    with open(deck_filename, 'w') as f:
-      f.write(json.dumps(decks, indent=2))
-
+  with open(cards_filename) as f:
+    cards = json.load(f)
+  downloader = DeckDownloader(session or http_session(), workers=DOWNLOAD_WORKERS, per_second=REQUESTS_PER_SECOND, limiter=limiter)
+  ingest(deck_ids, downloader, cards, deck_filename, csv_filename)
   return deck_filename
 
-def identify_deck_factions(deck_filename, cards_filename):
-  print('Identifying Deck Factions...')
-  with open(deck_filename) as f:
-    decks = json.load(f)
+def refresh_deck_file(deck_ids, deck_filename, cards_filename, csv_filename = None, session = None, limiter = None):
+  # Patch deck json with new and updated decks only, fetching each as its id arrives
+  print('Refreshing Decks...')
   with open(cards_filename) as f:
     cards = json.load(f)
-  for deck in decks:
-    decks[deck]['side_code'] = ''
-    decks[deck]['faction_code'] = ''
-    deck_cards = decks[deck]['cards']
-    for card in deck_cards:
-      deck_card = cards[card]
-      if deck_card['type_code'] == 'identity':
-        decks[deck]['side_code'] = deck_card['side_code']
-        decks[deck]['faction_code'] = deck_card['faction_code']
-
-  with open(deck_filename, 'w') as f:
-    f.write(json.dumps(decks, indent=2))
+
+  downloader = DeckDownloader(session or http_session(), workers=DOWNLOAD_WORKERS, per_second=REQUESTS_PER_SECOND, limiter=limiter)
+  added, updated, removed = refresh_decks(deck_ids, deck_filename, cards, downloader, RECHECK_DECKS, deck_filename + '.partial', csv_filename)
+  print('Decks added:', len(added), 'updated:', len(updated), 'removed:', len(removed))
 
   return deck_filename
 
+def search_and_ingest_decks(payloads, id_filename, deck_filename, cards_filename, csv_filename = None, headers = None, max_pages = 40):
+  print('Searching NetRunnerDB and Downloading Decks...')
+  session = http_session(headers)
+  crawler = DecklistCrawler(session, per_second=REQUESTS_PER_SECOND)
+
+  # Ids are written as they are found and their decks fetched while the search
+  # carries on, sharing the crawler's politeness limit
+  deck_ids = iter_ids(crawler.iter_search(payloads, max_pages), id_filename)
+  if INCREMENTAL_DECKS:
+    refresh_deck_file(deck_ids, deck_filename, cards_filename, csv_filename, session, crawler.limiter)
+  else:
+    ingest_decks(deck_ids, deck_filename, cards_filename, csv_filename, session, crawler.limiter)
+
+  return id_filename, deck_filename
+
 def construct_collection(cards_filename, collection_filename, packs, extra_cards):
   print('Constructing Collection...')
   collection = OrderedDict()
+  card_index = load_card_index(cards_filename)
   with open(cards_filename) as f:
     cards = json.load(f)
     for card in cards:
       pack_code = cards[card]['pack_code']
-      collection_ids = cards[card]['maps_to']
       if pack_code in packs or card in extra_cards:
-        if len(cards[card]['maps_to']) > 0:
-          collection_ids.append(cards[card]['code'])
-          collection_ids = tuple(sorted(collection_ids))
-        else:
-          collection_ids = (cards[card]['code'],)
+        collection_id = card_index[card]
         if pack_code in packs:
-          collection[collection_ids] = collection.get(collection_ids, 0) + (cards[card]['quantity'] * packs[pack_code][1])
+          collection[collection_id] = collection.get(collection_id, 0) + (cards[card]['quantity'] * packs[pack_code][1])
         else:
-          collection[collection_ids] = collection.get(collection_ids, 0) + extra_cards[card]
-
-  collection2 = OrderedDict()
-  for key in collection:
-    collection2[key[0]] = collection[key]
+          collection[collection_id] = collection.get(collection_id, 0) + extra_cards[card]
 
   # Write to file
   with open(collection_filename, 'w') as f:
-    f.write(json.dumps(collection2, indent=2))
+    f.write(json.dumps(collection, indent=2))
 
   return collection_filename
 
-def select_decks(decks, included, ignored, max, shuffle = True):
-  selected = []
-  deck_ids = list(decks)
-  if shuffle:
-    random.shuffle(deck_ids)
-  for faction in included:
-    if included[faction]:
-      selected.append([d for d in deck_ids if (included[faction] and decks[d]['faction_code'] == faction)][:max])
-  return selected
-
-def find_combinations(side, iteration, cards, collection, decks):
+def iter_combinations(side, iteration, matrix, decks):
   print('Determining valid combinations for', side, 'iteration', iteration)
-  valid = {
-    'valid': {},
-    'invalid': {}
-  }
-  for combo in itertools.product(*decks):
-    combo_result = check_combination(cards, combo, collection)
-    if len(combo_result) == 0:
-      valid['valid'][','.join(combo)] = combo_result
+  if PRUNE_COMBINATIONS:
+    return iter_search(matrix, decks, RECORD_PREFIXES)
+  return matrix.iter_results(decks)
+
+def side_results(side, included, max_decks, iterations, matrix, decks, parallel_analyser = None):
+  if ENUMERATE_COMBINATIONS:
+    print('Enumerating valid combinations for', side)
+    side_decks = select_decks(decks, included, IGNORED_DECK_IDS, None, False)
+    for lineup in CompatibilityGraph(matrix, side_decks).iter_lineups():
+      yield ','.join(lineup), {}
+
+  elif parallel_analyser:
+    for deck_analysis in parallel_analyser.iter_iterations(side, decks, included, IGNORED_DECK_IDS, max_decks, iterations, SHUFFLE_DECKS, SEED):
+      for group in ('invalid', 'valid'):
+        for combo in deck_analysis[group]:
+          yield combo, deck_analysis[group][combo]
+
+  else:
+    for i in range(iterations):
+      while True:
+        side_decks = select_decks(decks, included, IGNORED_DECK_IDS, max_decks, SHUFFLE_DECKS)
+        found_valid = False
+        for combo, missing_cards in iter_combinations(side, i, matrix, side_decks):
+          found_valid = found_valid or len(missing_cards) == 0
+          yield ','.join(combo), missing_cards
+        # Break the loop if we have a valid combination, otherwise try again
+        if found_valid:
+          break
+
+def write_combinations(findings_filename, results, blocking=None):
+  valid_combos = {}
+  invalid_combos = {}
+  for combo, missing_cards in results:
+    if len(missing_cards) == 0:
+      valid_combos[combo] = missing_cards
     else:
-      valid['invalid'][','.join(combo)] = combo_result
+      invalid_combos[combo] = missing_cards
+
+  valid_combos2 = OrderedDict()
+  for key in sorted(valid_combos):
+    valid_combos2[key] = valid_combos[key]
 
-  return valid
+  invalid_combos2 = OrderedDict()
+  for key in sorted(invalid_combos):
+    invalid_combos2[key] = invalid_combos[key]
 
-def check_combination(cards, deck_combination, collection):
+  if blocking:
+    for combo, missing_cards in itertools.chain(valid_combos2.items(), invalid_combos2.items()):
+      blocking.add(combo, missing_cards)
+
+  with open(findings_filename, 'w') as f:
+    findings = {
+      'valid' : valid_combos2,
+      'invalid' : invalid_combos2,
+    }
+    f.write(json.dumps(findings, indent=2))
+
+  return findings_filename
+
+def stream_combinations(findings_filename, results, blocking=None):
+  # Results go to disk as they are found; the sorted views are built from the
+  # stream without holding it in memory
+  base_filename = os.path.splitext(findings_filename)[0]
+  with ResultWriter(base_filename + '.stream.jsonl') as writer:
+    for combo, missing_cards in results:
+      writer.write(combo, missing_cards)
+  print('Sorting', writer.valid, 'valid and', writer.invalid, 'invalid results...')
+  sorted_filename = sort_results(writer.filename, base_filename + '.jsonl')
+  # the sorted stream holds everything the unsorted one did
+  os.remove(writer.filename)
+  if blocking:
+    # the sorted stream holds each combination once
+    for combo, missing_cards in iter_results(sorted_filename):
+      blocking.add(combo, missing_cards)
+  return write_findings(sorted_filename, findings_filename)
+
+def check_combination(card_index, decks, deck_combination, collection):
   all_cards = {}
   missing_cards = {}
   for deck in deck_combination:
     for card in decks[deck]['cards']:
       quantity = decks[deck]['cards'][card]
-
-      # Check for alternate card codes
-      card_ids = cards[card]['maps_to']
-      if len(card_ids) > 0:
-        card_ids.append(cards[card]['code'])
-        card_ids = tuple(sorted(card_ids))
-      else:
-        card_ids = (cards[card]['code'],)
-      card_code = card_ids[0]
+      card_code = card_index[card]
       all_cards[card_code] = all_cards.get(card_code,0) + quantity
   for card in all_cards:
     if card not in collection:
@@ -305,156 +362,172 @@ def check_combination(cards, deck_combination, collection):
       missing_cards[card] = missing_qty
   return missing_cards
 
-if SEARCH:
-
-  headers = {
-    'User-Agent' : 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_13_6) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/11.1.2 Safari/605.1.15',
-    'Accept' : 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'
-  }
-
-  # Search data
-  payloads = [
-    {
-      'faction' : '',
-      'sort' : 'popularity',
-      'rotation_id' : '',
-      'author' : '',
-      'title' : '',
-      'is_legal' : '',
-      'mwl_code' : '',
-      'packs[]' : [packs[p][0] for p in packs],
-    }
-  ]
-
-# old payload for big boxes only
-#    {
-#      'faction' : '',
-#      'sort' : 'popularity',
-#      'rotation_id' : '',
-#      'author' : 'filk',
-#      'title' : '',
-#      'is_legal' : '',
-#      'mwl_code' : '',
-#      'packs[]' : ['1', '8', '21', '28', '35', '51, '55', '62'],
-#    }
-
-  # Grab all card info json
-  cards_file = write_cards('cards.json', headers)
-
-  # Perform search on NetrunnerDB
-  results = search_results(payloads, headers, MAX_SEARCH_PAGES)
-
-  # Store deck ids in a file (so we don't need to request every time)
-  id_file = write_id_file(results,'deck_ids.txt')
-
-if GET_DECKS:
-  # Generate deck json from IDs
-  decks_file = write_decks(id_file,'decks.json', headers)
-
-  # Identify deck factions
-  decks_file = identify_deck_factions('decks.json','cards.json')
-
-if EXPORT_DECKS:
-  decks_file = 'decks.json'
-  with open(decks_file) as f:
-    decks = json.load(f)
-  with open('all_deck_info.csv', 'w') as f:
-    writer = csv.DictWriter(f, fieldnames=decks[[d for d in decks][0]].keys())
-    for deck in decks:
-      writer.writerow(decks[deck])
-
-if UPDATE_COLLECTION:
-  # Construct collection (available cards)
-  collection_file = construct_collection('cards.json', 'collection.json', packs, extra_cards)
-
-if FIND_COMBINATIONS:
-
-  collection_file = 'collection.json'
-  cards_file = 'cards.json'
-  decks_file = 'decks.json'
-  valid_corp_file = 'valid_corp_combinations.json'
-  valid_runner_file = 'valid_runner_combinations.json'
-
-  # reload collection
-  with open(collection_file) as f:
-    collection = json.load(f)
-
-  # reload cards
-  with open(cards_file) as f:
-    cards = json.load(f)
-
-  # reload decks
-  with open(decks_file) as f:
-    decks = json.load(f)
-
+def find_combinations(cards_file, decks_file, collection_file):
+  # compiled deck demands, reused until an input file changes
+  matrix = load_matrix(cards_file, decks_file, collection_file)
+  decks = matrix.decks
+
+  parallel_analyser = None
+  if WORKERS != 1:
+    parallel_analyser = ParallelAnalyser(matrix, WORKERS, PRUNE_COMBINATIONS, RECORD_PREFIXES)
+
+  store = None
+  if STORE_RESULTS:
+    store = CombinationStore('combinations.db')
+    store.add_decks(decks)
+
+  for side, included, max_decks, iterations, findings_file in side_settings():
+    results = side_results(side, included, max_decks, iterations, matrix, decks, parallel_analyser)
+    if store:
+      store.clear(side)
+      results = store.recorded(side, results)
+    blocking = BlockingIndex() if BLOCKING_INDEX else None
+    if STREAM_RESULTS:
+      stream_combinations(findings_file, results, blocking)
+    else:
+      write_combinations(findings_file, results, blocking)
+    if blocking:
+      write_blocking(side, blocking)
+
+  if parallel_analyser:
+    parallel_analyser.close()
+
+  if store:
+    store.close()
+
+def write_blocking(side, blocking):
+  # The index itself, to query later, and what it says about the best cards to get
+  index_filename, summary_filename = blocking_filenames(side)
+  summary = blocking.summary(BLOCKING_CARDS)
+  if summary['cards']:
+    print('Getting', summary['cards'][0]['card'], 'would unlock', summary['cards'][0]['unlocks'], side, 'combinations')
+  blocking.save(index_filename)
+  with open(summary_filename, 'w') as f:
+    f.write(json.dumps(summary, indent=2))
+
+def find_lineups(cards_file, decks_file, collection_file):
+  # Exact search for the best-scoring line-ups over every deck, not a sample
+  matrix = load_matrix(cards_file, decks_file, collection_file)
+  snapshot = load_snapshot(cards_file, decks_file)
+  scores = deck_scores({deck_id: snapshot.deck_details(deck_id) for deck_id in matrix.deck_ids},
+                       SCORE_WEIGHTS, DECK_WEIGHTS, RECENCY_HALF_LIFE)
+
+  for side, included, max_decks, iterations, findings_file in side_settings():
+    print('Finding best line-ups for', side)
+    side_decks = select_decks(matrix.decks, included, IGNORED_DECK_IDS, None, False)
+    result = LineupOptimiser(matrix, side_decks, scores).top(TOP_LINEUPS, time_limit=LINEUP_TIME_LIMIT)
+    if not result['optimal']:
+      print('Stopped early, best line-up within', result['gap'], 'of the optimum')
+    with open(lineups_filename(side), 'w') as f:
+      f.write(json.dumps(result, indent=2))
+
+def estimate_feasibility(cards_file, decks_file, collection_file, estimate_file):
+  # Share of all line-ups over every deck that the collection can build, from random samples
+  matrix = load_matrix(cards_file, decks_file, collection_file)
+  snapshot = load_snapshot(cards_file, decks_file)
+  weights = None
+  if ESTIMATE_WEIGHTED:
+    weights = deck_scores({deck_id: snapshot.deck_details(deck_id) for deck_id in matrix.deck_ids},
+                          SCORE_WEIGHTS, DECK_WEIGHTS, RECENCY_HALF_LIFE)
+  estimates = OrderedDict()
+  for side, included, max_decks, iterations, findings_file in side_settings():
+    side_decks = select_decks(matrix.decks, included, IGNORED_DECK_IDS, None, False)
+    estimator = FeasibilityEstimator(matrix, side_decks, weights, np.random.default_rng(SEED))
+    estimate = estimator.estimate(ESTIMATE_PRECISION, ESTIMATE_CONFIDENCE, ESTIMATE_MAX_SAMPLES)
+    for missing in estimate['missing_cards']:
+      missing['title'] = snapshot.card_details(missing['card'])['title']
+    print('%s: %.2f%% buildable (%.2f%%-%.2f%%) from %d samples' % (
+      side, 100 * estimate['fraction'], 100 * estimate['interval'][0], 100 * estimate['interval'][1], estimate['samples']))
+    estimates[side] = estimate
+  with open(estimate_file, 'w') as f:
+    f.write(json.dumps(estimates, indent=2))
+  return estimate_file
+
+def rank_purchases(cards_file, decks_file, collection_file, purchases_file):
+  # Packs ranked by how many more line-ups the collection could build with them
+  matrix = load_matrix(cards_file, decks_file, collection_file)
+  supply = pack_supply(load_snapshot(cards_file, decks_file), matrix)
+  purchases = OrderedDict()
+  for side, included, max_decks, iterations, findings_file in side_settings():
+    print('Ranking pack purchases for', side)
+    side_decks = select_decks(matrix.decks, included, IGNORED_DECK_IDS, None, False)
+    optimiser = PurchaseOptimiser(matrix, side_decks, supply, PURCHASE_SAMPLE_SIZE, np.random.default_rng(SEED))
+    purchases[side] = OrderedDict([
+      ('lineups', optimiser.total),
+      ('sampled', optimiser.sampled),
+      ('buildable', optimiser.baseline),
+      ('packs', optimiser.rank_packs(costs=PACK_COSTS)),
+    ])
+    if PURCHASE_SET_SIZE > 1:
+      purchases[side]['sets'] = optimiser.rank_sets(PURCHASE_SET_SIZE, costs=PACK_COSTS, top=50)
+  with open(purchases_file, 'w') as f:
+    f.write(json.dumps(purchases, indent=2))
+  return purchases_file
+
+def lineups_filename(side):
+  return 'best_%s_lineups.json' % side
+
+def blocking_filenames(side):
+  return 'blocking_%s_index.npz' % side, 'blocking_%s_cards.json' % side
+
+def side_settings():
+  sides = []
   if CORP:
-
-    valid_corp_combos = {}
-    invalid_corp_combos = {}
-
-    for i in range(NUM_CORP_ITERATIONS):
-
-      iteration_file = valid_corp_file.split('.')[0]+str(i)+'.txt'
-
-      while True:
-        corp_decks = select_decks(decks, CORP_INCLUDED, IGNORED_DECK_IDS, MAX_DECKS_PER_CORP, SHUFFLE_DECKS)
-        deck_analysis = find_combinations('corp', i, cards, collection, corp_decks)
-
-        for v in deck_analysis['invalid']:
-          invalid_corp_combos[v] = deck_analysis['invalid'][v]
-        for v in deck_analysis['valid']:
-          valid_corp_combos[v] = deck_analysis['valid'][v]
-        # Break the loop if we have a valid combination, otherwise try again
-        if len(deck_analysis['valid']) > 0:
-          break
-
-    valid_corp_combos2 = OrderedDict()
-    for key in sorted(valid_corp_combos):
-      valid_corp_combos2[key] = valid_corp_combos[key]
-
-    invalid_corp_combos2 = OrderedDict()
-    for key in sorted(invalid_corp_combos):
-      invalid_corp_combos2[key] = invalid_corp_combos[key]
-
-    with open('valid_corp_combinations.txt', 'w') as f:
-      findings = {
-        'valid' : valid_corp_combos2,
-        'invalid' : invalid_corp_combos2,
-      }
-      f.write(json.dumps(findings, indent=2))
-
+    sides.append(('corp', CORP_INCLUDED, MAX_DECKS_PER_CORP, NUM_CORP_ITERATIONS, 'valid_corp_combinations.txt'))
   if RUNNER:
+    sides.append(('runner', RUNNER_INCLUDED, MAX_DECKS_PER_RUNNER, NUM_RUNNER_ITERATIONS, 'valid_runner_combinations.txt'))
+  return sides
+
+def analyser_stages():
+  # Network stages are sources: they rerun when asked for by name, the others
+  # whenever an input file or a setting changes
+  return [
+    Stage('cards', lambda: write_cards('cards.json', HEADERS), outputs=['cards.json'], source=True),
+    # one pass: search, download, classify and export each deck as it is found
+    Stage('decks', lambda: search_and_ingest_decks(PAYLOADS, 'deck_ids.txt', 'decks.json', 'cards.json', 'all_deck_info.csv',
+                                                   HEADERS, MAX_SEARCH_PAGES),
+          inputs=['cards.json'], outputs=['deck_ids.txt', 'decks.json', 'all_deck_info.csv'],
+          settings=[PAYLOADS, MAX_SEARCH_PAGES, INCREMENTAL_DECKS, RECHECK_DECKS], source=True),
+    Stage('collection', lambda: construct_collection('cards.json', 'collection.json', packs, extra_cards),
+          inputs=['cards.json'], outputs=['collection.json'], settings=[packs, extra_cards]),
+    Stage('combinations', lambda: find_combinations('cards.json', 'decks.json', 'collection.json'),
+          inputs=['cards.json', 'decks.json', 'collection.json'],
+          outputs=[side[4] for side in side_settings()] + [name for side in side_settings() if BLOCKING_INDEX for name in blocking_filenames(side[0])],
+          settings=[side_settings(), IGNORED_DECK_IDS, SHUFFLE_DECKS, ENUMERATE_COMBINATIONS, PRUNE_COMBINATIONS,
+                    RECORD_PREFIXES, SEED, STREAM_RESULTS, STORE_RESULTS, BLOCKING_INDEX, BLOCKING_CARDS]),
+    Stage('lineups', lambda: find_lineups('cards.json', 'decks.json', 'collection.json'),
+          inputs=['cards.json', 'decks.json', 'collection.json'], outputs=[lineups_filename(side[0]) for side in side_settings()],
+          settings=[side_settings(), IGNORED_DECK_IDS, TOP_LINEUPS, SCORE_WEIGHTS, RECENCY_HALF_LIFE, DECK_WEIGHTS, LINEUP_TIME_LIMIT]),
+    Stage('estimate', lambda: estimate_feasibility('cards.json', 'decks.json', 'collection.json', 'feasibility_estimate.json'),
+          inputs=['cards.json', 'decks.json', 'collection.json'], outputs=['feasibility_estimate.json'],
+          settings=[side_settings(), IGNORED_DECK_IDS, ESTIMATE_PRECISION, ESTIMATE_CONFIDENCE, ESTIMATE_MAX_SAMPLES,
+                    ESTIMATE_WEIGHTED, SCORE_WEIGHTS, RECENCY_HALF_LIFE, DECK_WEIGHTS, SEED]),
+    Stage('purchases', lambda: rank_purchases('cards.json', 'decks.json', 'collection.json', 'pack_purchases.json'),
+          inputs=['cards.json', 'decks.json', 'collection.json'], outputs=['pack_purchases.json'],
+          settings=[side_settings(), IGNORED_DECK_IDS, PURCHASE_SET_SIZE, PURCHASE_SAMPLE_SIZE, PACK_COSTS, SEED]),
+  ]
 
-    valid_runner_combos = {}
-    invalid_runner_combos = {}
-
-    for i in range(NUM_RUNNER_ITERATIONS):
-
-      iteration_file = valid_runner_file.split('.')[0]+str(i)+'.txt'
-
-      while True:
-        runner_decks = select_decks(decks, RUNNER_INCLUDED, IGNORED_DECK_IDS, MAX_DECKS_PER_RUNNER, SHUFFLE_DECKS)
-        deck_analysis = find_combinations('runner', i, cards, collection, runner_decks)
-
-        for v in deck_analysis['invalid']:
-          invalid_runner_combos[v] = deck_analysis['invalid'][v]
-        for v in deck_analysis['valid']:
-          valid_runner_combos[v] = deck_analysis['valid'][v]
-        # Break the loop if we have a valid combination, otherwise try again
-        if len(deck_analysis['valid']) > 0:
-          break
-
-    valid_runner_combos2 = OrderedDict()
-    for key in sorted(valid_runner_combos):
-      valid_runner_combos2[key] = valid_runner_combos[key]
-
-    invalid_runner_combos2 = OrderedDict()
-    for key in sorted(invalid_runner_combos):
-      invalid_runner_combos2[key] = invalid_runner_combos[key]
-
-    with open('valid_runner_combinations.txt', 'w') as f:
-      findings = {
-        'valid' : valid_runner_combos2,
-        'invalid' : invalid_runner_combos2,
-      }
-      f.write(json.dumps(findings, indent=2))
+def main(argv = None):
+  stages = analyser_stages()
+  parser = argparse.ArgumentParser(description='Download NetrunnerDB decks and find the combinations a collection can build.')
+  parser.add_argument('stages', nargs='*', default=['combinations'], metavar='stage',
+                      help='stages to bring up to date, with anything they depend on: ' + ', '.join(stage.name for stage in stages))
+  parser.add_argument('-f', '--force', action='store_true', help='rerun the named stages even if they are up to date')
+  parser.add_argument('-l', '--list', action='store_true', help='list the stages with their inputs and outputs')
+  args = parser.parse_args(argv)
+
+  if args.list:
+    for stage in stages:
+      print('%-14s %s -> %s' % (stage.name, ', '.join(stage.inputs) or '(network)', ', '.join(stage.outputs)))
+    return
+
+  unknown = [name for name in args.stages if name not in [stage.name for stage in stages]]
+  if unknown:
+    parser.error('unknown stage: ' + ', '.join(unknown))
+
+  runner = StageRunner(stages)
+  runner.run(args.stages, args.force)
+  runner.report()
+
+if __name__ == '__main__':
+  main()
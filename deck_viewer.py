@@ -1,6 +1,49 @@
 #!/usr/local/bin/python3
 import wx, wx.html
-import os, json
+import io, os, threading
+from analyser.combotable import COLUMNS
+from analyser.images import ImageCache
+from analyser.viewdata import ViewerData
+
+class ComboList(wx.ListCtrl):
+  # Virtual list: wx asks for the text of the rows on screen only, so any
+  # number of combinations scrolls as fast as a screenful
+
+  def __init__(self, *args, **kwargs):
+    super(ComboList, self).__init__(*args, style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_SINGLE_SEL, **kwargs)
+    for column, (label, width) in enumerate(zip(COLUMNS, (400, 260, 100))):
+      self.InsertColumn(column, label, width=width)
+    self.table = None
+    self.Bind(wx.EVT_LIST_COL_CLICK, self.on_column_click)
+
+  def show(self, table):
+    self.table = table
+    self.refresh()
+
+  def refresh(self):
+    self.SetItemCount(len(self.table) if self.table else 0)
+    self.Refresh()
+
+  def OnGetItemText(self, item, column):
+    return self.table.cell(item, column)
+
+  def on_column_click(self, e):
+    # a second click on the same column reverses the order
+    if not self.table:
+      return
+    column = e.GetColumn()
+    descending = self.table.sorted_by == (column, False)
+    self.table.sort(column, descending)
+    self.refresh()
+
+THUMBNAIL_WIDTH = 150
+
+def decode_thumbnail(data):
+  # Runs on the image cache's workers; wx.Image, unlike wx.Bitmap, may be
+  # made off the main thread
+  image = wx.Image(io.BytesIO(data))
+  height = image.GetHeight() * THUMBNAIL_WIDTH // max(image.GetWidth(), 1)
+  return image.Scale(THUMBNAIL_WIDTH, height, wx.IMAGE_QUALITY_HIGH)
 
 class MainFrame(wx.Frame):
 
@@ -14,34 +57,69 @@ class MainFrame(wx.Frame):
       'Runners': ['anarch','criminal','shaper','apex','adam','sunny-lebeau'],
     }
 
-    self.combinations = {
-      'Corporations': None,
-      'Runners': None,
-    }
-
-    # load data from files
-    cards_file = 'cards.json'
-    decks_file = 'decks.json'
-    valid_corp_file = 'valid_corp_combinations.json'
-    valid_runner_file = 'valid_runner_combinations.json'
-
-    with open(decks_file) as f:
-      self.decks = json.load(f)
-
-    with open(cards_file) as f:
-      self.cards = json.load(f)
-
-    with open(valid_corp_file) as f:
-      self.combinations['Corporations'] = json.load(f)
-
-    with open(valid_runner_file) as f:
-      self.combinations['Runners'] = json.load(f)
+    # data is read on a background thread once the window is up; each side
+    # is offered in the side selector as soon as its combinations are loaded
+    self.data = ViewerData('cards.json', 'decks.json', 'combinations.db')
+    # card art for the decks picked, fetched in the background
+    self.images = ImageCache(decode=decode_thumbnail)
 
     # state tracking
     self.current_side = None
+    self.faction_choosers = {}
+    self.images_pending = 0
 
     # build UI
     self.InitUI()
+    self.Bind(wx.EVT_CLOSE, self.on_close)
+    self.loader = threading.Thread(target=self.load_data)
+    self.loader.daemon = True
+    self.loader.start()
+
+  def load_data(self):
+    # Runs on the loader thread, where an exception would only reach stderr,
+    # so a failure is handed to the main thread to show
+    try:
+      self.data.load(lambda side, fraction: wx.CallAfter(self.on_load_progress, side, fraction),
+                     lambda side: wx.CallAfter(self.on_side_ready, side))
+    except Exception as e:
+      wx.CallAfter(self.on_load_failed, e)
+
+  def prefetch_images(self, deck_ids):
+    images = [image for deck_id in deck_ids for image in self.data.deck_images(deck_id)]
+    futures = self.images.prefetch(images)
+    self.images_pending += len(futures)
+    for future in futures.values():
+      future.add_done_callback(lambda future: wx.CallAfter(self.on_image_fetched))
+
+  def on_image_fetched(self):
+    # a fetch cancelled on close reports in after the frame is gone
+    if not self:
+      return
+    self.images_pending -= 1
+    self.status_bar.SetStatusText('Card images ready' if self.images_pending == 0 else
+                                  'Fetching card images... %d left' % self.images_pending)
+
+  def on_load_progress(self, side, fraction):
+    if side is None:
+      self.status_bar.SetStatusText('Loaded decks')
+    else:
+      self.status_bar.SetStatusText('Loading %s... %d%%' % (side, 100 * fraction))
+
+  def on_side_ready(self, side):
+    self.side_selector.Append(side)
+    ready = [s for s in self.sides if self.data.ready(s)]
+    self.status_bar.SetStatusText('Ready' if len(ready) == len(self.sides) else side + ' ready')
+
+  def on_close(self, e):
+    # stop fetching card art rather than hold the window open for it
+    self.images.close(wait=False)
+    e.Skip()
+
+  def on_load_failed(self, error):
+    self.status_bar.SetStatusText('Loading failed: %s' % error)
+    dlg = wx.MessageDialog(self, 'Could not load the deck data:\n\n%s' % error, 'NRDeckViewer', wx.OK | wx.ICON_ERROR)
+    dlg.ShowModal()
+    dlg.Destroy()
 
   def InitUI(self):
 
@@ -59,8 +137,9 @@ class MainFrame(wx.Frame):
     self.Bind(wx.EVT_MENU, self.on_help_request, id=wx.ID_HELP)
 
     # status bar
-    status_bar = wx.StatusBar(self)
-    self.SetStatusBar(status_bar)
+    self.status_bar = wx.StatusBar(self)
+    self.SetStatusBar(self.status_bar)
+    self.status_bar.SetStatusText('Loading decks...')
 
     # window contents
     # main panel
@@ -70,9 +149,9 @@ class MainFrame(wx.Frame):
     # top panel
     top_panel = wx.Panel(main_panel)
     top_sizer = wx.BoxSizer(wx.HORIZONTAL)
-    side_selector = wx.Choice(top_panel, choices=self.default_blank_choices + self.sides)
-    self.Bind(wx.EVT_CHOICE, self.select_side, id=side_selector.GetId())
-    top_sizer.Add(side_selector, 0, wx.EXPAND | wx.ALL, 0)
+    self.side_selector = wx.Choice(top_panel, choices=self.default_blank_choices)
+    self.Bind(wx.EVT_CHOICE, self.select_side, id=self.side_selector.GetId())
+    top_sizer.Add(self.side_selector, 0, wx.EXPAND | wx.ALL, 0)
     top_panel.SetSizer(top_sizer)
 
     # bottom panel
@@ -80,8 +159,12 @@ class MainFrame(wx.Frame):
     bottom_sizer = wx.BoxSizer(wx.HORIZONTAL)
     bottom_panel.SetSizer(bottom_sizer)
 
+    # combination list
+    self.combo_list = ComboList(main_panel, size=(780, 400))
+
     main_sizer.Add(top_panel, 0, wx.EXPAND | wx.ALL, 0)
     main_sizer.Add(bottom_panel, 0, wx.EXPAND | wx.ALL, 0)
+    main_sizer.Add(self.combo_list, 1, wx.EXPAND | wx.ALL, 0)
 
     main_panel.SetSizerAndFit(main_sizer)
 
@@ -91,19 +174,30 @@ class MainFrame(wx.Frame):
     self.Centre()
     self.Layout()
 
-  def split_combos_by_faction(self,combos):
-    factions = {}
-    for deck in combos[0].split(','):
-      factions[self.decks[deck]['faction_code']] = set()
-    for combo in combos:
-      for deck in combo.split(','):
-        factions[self.decks[deck]['faction_code']].add(deck)
-    return factions
+  def selected_decks(self):
+    selected = []
+    for chooser in self.faction_choosers.values():
+      choice = chooser.GetStringSelection()
+      if choice and choice not in self.default_blank_choices:
+        selected.append(choice)
+    return selected
 
   def show_faction_deck(self, e):
-    print(e.GetString())
-    for sizer in self.bottom_sizer:
-      print(sizer)
+    # narrow every faction chooser to the decks that still form a valid
+    # combination with the decks picked so far
+    selected = self.selected_decks()
+    factions = self.data.faction_decks(self.current_side, selected)
+    for faction, chooser in self.faction_choosers.items():
+      choice = chooser.GetStringSelection()
+      chooser.SetItems(self.default_blank_choices+sorted(factions[faction]))
+      if not chooser.SetStringSelection(choice):
+        chooser.SetSelection(0)
+    table = self.data.tables[self.current_side]
+    table.filter(selected)
+    self.combo_list.refresh()
+    # the list also shows the invalid combinations with what they are missing
+    self.status_bar.SetStatusText('%d valid combinations, %d shown' % (self.data.count(self.current_side, selected), len(table)))
+    self.prefetch_images(selected)
 
   def select_side(self,e):
     chosen_side = e.GetString()
@@ -113,26 +207,23 @@ class MainFrame(wx.Frame):
       self.current_side = chosen_side
       for child in bottom_panel.GetChildren():
         child.Destroy()
-      combos = sorted([key for key in self.combinations[chosen_side]['valid']])
-      factions = self.split_combos_by_faction(combos)
+      self.faction_choosers = {}
+      self.data.tables[chosen_side].filter()
+      self.combo_list.show(self.data.tables[chosen_side])
+      factions = self.data.faction_decks(chosen_side)
       for faction in factions:
         faction_panel = wx.Panel(bottom_panel)
         faction_sizer = wx.BoxSizer(wx.VERTICAL)
         faction_name = wx.StaticText(faction_panel, label=faction)
-        faction_choices = self.default_blank_choices+list(factions[faction])
+        faction_choices = self.default_blank_choices+sorted(factions[faction])
         faction_chooser = wx.Choice(faction_panel, choices=faction_choices)
+        self.faction_choosers[faction] = faction_chooser
         self.Bind(wx.EVT_CHOICE, self.show_faction_deck, id=faction_chooser.GetId())
         faction_panel.SetSizer(faction_sizer)
         bottom_sizer.Add(faction_panel, 0, wx.EXPAND | wx.ALL, 0)
-      print(bottom_panel.GetChildren())
-      print(bottom_sizer.GetChildren())
       self.Fit()
       self.Layout()
 
-
-  def select_deck(self,e):
-    print(e.GetSelection())
-
   def on_open_request(self,e):
     cwd = os.getcwd()
     dlg = wx.FileDialog(self, "Choose a file", cwd, "", "*.*", wx.FLP_OPEN)
@@ -0,0 +1,1110 @@
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import csv, itertools, json, os, random, shutil, struct, tempfile, threading, zlib
+import unittest
+from unittest import mock
+import numpy as np
+import requests
+import deck_analyser
+from analyser.blocking import BlockingIndex, load_blocking_index
+from analyser.cache import input_hashes, load_matrix, read_matrix, save_matrix
+from analyser.canonical import build_card_index, load_card_index
+from analyser.cards import resolve_maps_to, update_cards
+from analyser.comboindex import ComboIndex
+from analyser.combotable import ComboTable
+from analyser.crawler import DecklistCrawler, MyDeckParser
+from analyser.decks import classify_deck, read_decks, refresh_decks
+from analyser.download import DeckDownloader, make_session
+from analyser.estimate import FeasibilityEstimator, wilson_interval
+from analyser.graph import CompatibilityGraph, enumerate_combinations
+from analyser.httpcache import CachedSession
+from analyser.images import ImageCache, deck_images
+from analyser.matrix import DemandMatrix
+from analyser.optimise import LineupOptimiser, deck_scores
+from analyser.parallel import ParallelAnalyser, _pool_context
+from analyser.purchase import PurchaseOptimiser
+from analyser.pipeline import ingest, iter_ids
+from analyser.results import ResultWriter, iter_results, sort_results, write_findings
+from analyser.search import search_combinations
+from analyser.snapshot import load_snapshot
+from analyser.stages import Stage, StageRunner
+from analyser.store import CombinationStore
+from analyser.synthetic import generate_corpus
+from analyser.viewdata import SIDES, ViewerData
+
+def make_card(code, title, side='corp', faction='jinteki', type_code='ice', pack='core', quantity=3):
+  return {
+    'code': code,
+    'title': title,
+    'side_code': side,
+    'faction_code': faction,
+    'type_code': type_code,
+    'pack_code': pack,
+    'quantity': quantity,
+    'maps_to': [],
+  }
+
+def make_cards():
+  cards = {
+    '01001': make_card('01001', 'Wall', pack='core'),
+    '20001': make_card('20001', 'Wall', pack='core2'),
+    '01002': make_card('01002', 'Gate', faction='nbn'),
+    '01003': make_card('01003', 'Sentry', faction='haas-bioroid'),
+    '01004': make_card('01004', 'Agenda', faction='neutral-corp', type_code='agenda'),
+    '01005': make_card('01005', 'Jinteki ID', type_code='identity', quantity=1),
+    '01006': make_card('01006', 'NBN ID', faction='nbn', type_code='identity', quantity=1),
+    '01007': make_card('01007', 'HB ID', faction='haas-bioroid', type_code='identity', quantity=1),
+  }
+  cards['01001']['maps_to'] = ['20001']
+  cards['20001']['maps_to'] = ['01001']
+  return cards
+
+def make_deck(faction, cards, side='corp'):
+  return {'cards': cards, 'side_code': side, 'faction_code': faction}
+
+def make_decks():
+  return {
+    '1': make_deck('jinteki', {'01005': 1, '01001': 2, '01004': 3}),
+    '2': make_deck('jinteki', {'01005': 1, '20001': 3}),
+    '3': make_deck('nbn', {'01006': 1, '01002': 2, '01001': 1}),
+    '4': make_deck('nbn', {'01006': 1, '01004': 2}),
+    '5': make_deck('haas-bioroid', {'01007': 1, '01003': 3, '20001': 1}),
+    '6': make_deck('haas-bioroid', {'01007': 1, '01004': 1}),
+  }
+
+def make_collection():
+  return {'01001': 3, '01002': 2, '01003': 3, '01004': 4, '01005': 1, '01006': 1, '01007': 1}
+
+def reference_check(cards, decks, combo, collection):
+  all_cards = {}
+  missing_cards = {}
+  for deck in combo:
+    for card, quantity in decks[deck]['cards'].items():
+      card_code = min([card] + cards[card]['maps_to'])
+      all_cards[card_code] = all_cards.get(card_code, 0) + quantity
+  for card in all_cards:
+    missing_qty = all_cards[card] - collection.get(card, 0)
+    if missing_qty > 0:
+      missing_cards[card] = missing_qty
+  return missing_cards
+
+def api_cards():
+  return [{key: value for key, value in card.items() if key != 'maps_to'} for card in make_cards().values()]
+
+def placeholder_png(shade, size=8):
+  # A plain grey square, as a real PNG file; uncompressed so every shade is
+  # the same size
+  def chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+  rows = b''.join(b'\x00' + bytes([shade]) * size for i in range(size))
+  return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 0, 0, 0, 0)) +
+          chunk(b'IDAT', zlib.compress(rows, 0)) + chunk(b'IEND', b''))
+
+class StandInServer(object):
+  # Local stand-in for NetrunnerDB: serves canned responses by path, failing
+  # a path with 503 as many times as listed in failures
+  def __init__(self, routes):
+    self.routes = routes
+    self.failures = {}
+    self.etags = {}
+    self.requests = []
+    server = self
+
+    class Handler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        path = self.path.split('?')[0]
+        server.requests.append(path)
+        if server.failures.get(path, 0) > 0:
+          server.failures[path] -= 1
+          self.send_response(503)
+          self.end_headers()
+          return
+        if path not in server.routes:
+          self.send_response(404)
+          self.end_headers()
+          return
+        etag = server.etags.get(path)
+        if etag and self.headers.get('If-None-Match') == etag:
+          self.send_response(304)
+          self.end_headers()
+          return
+        body = server.routes[path]
+        if not isinstance(body, bytes):
+          body = json.dumps(body).encode()
+        self.send_response(200)
+        if etag:
+          self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, *args):
+        pass
+
+    self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    self.url = 'http://127.0.0.1:%d/' % self.httpd.server_address[1]
+    self.thread = threading.Thread(target=self.httpd.serve_forever, kwargs={'poll_interval': 0.05})
+    self.thread.daemon = True
+    self.thread.start()
+
+  def close(self):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+
+class DeckDownloaderCase(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.decks = make_decks()
+    self.server = StandInServer(dict(('/decklist/' + deck_id, {'data': [deck]}) for deck_id, deck in self.decks.items()))
+    self.downloader = DeckDownloader(make_session(retries=2, backoff=0), base_url=self.server.url, workers=3, per_second=0)
+
+  def tearDown(self):
+    self.server.close()
+    shutil.rmtree(self.tmp)
+
+  def test_download_with_retry(self):
+    self.server.failures['/decklist/2'] = 1
+    decks = self.downloader.download(['3', '1', '2'])
+    self.assertEqual(list(decks), ['3', '1', '2'])
+    self.assertEqual(decks['2'], self.decks['2'])
+    self.assertEqual(self.server.requests.count('/decklist/2'), 2)
+
+  def test_resume_from_partial(self):
+    partial_file = os.path.join(self.tmp, 'decks.json.partial')
+    with open(partial_file, 'w') as f:
+      f.write(json.dumps({'id': '1', 'deck': self.decks['1']}) + '\n')
+      f.write('{"id": "2", "de')
+    decks = self.downloader.download(['1', '2'], partial_file)
+    self.assertEqual(list(decks), ['1', '2'])
+    self.assertEqual(self.server.requests, ['/decklist/2'])
+
+  def test_failed_download_is_reported(self):
+    with self.assertRaises(RuntimeError):
+      self.downloader.download(['1', '9'])
+
+  def test_refresh_only_new_and_updated(self):
+    deck_file = os.path.join(self.tmp, 'decks.json')
+    for deck_id, deck in self.decks.items():
+      deck['date_update'] = '2019-01-01'
+      deck['side_code'] = deck['faction_code'] = ''
+    cards = make_cards()
+    added, updated, removed = refresh_decks(['1', '2', '3'], deck_file, cards, self.downloader, recheck=False)
+    self.assertEqual((sorted(added), updated, removed), (['1', '2', '3'], [], []))
+    self.assertEqual(read_decks(deck_file)['3']['faction_code'], 'nbn')
+
+    self.server.requests = []
+    self.decks['2']['date_update'] = '2019-02-01'
+    added, updated, removed = refresh_decks(['2', '4', '1'], deck_file, cards, self.downloader, recheck=False)
+    self.assertEqual((added, updated, removed), (['4'], [], ['3']))
+    self.assertEqual(self.server.requests, ['/decklist/4'])
+
+    added, updated, removed = refresh_decks(['2', '4', '1'], deck_file, cards, self.downloader, recheck=True)
+    self.assertEqual((added, updated, removed), ([], ['2'], []))
+    decks = read_decks(deck_file)
+    self.assertEqual(list(decks), ['2', '4', '1'])
+    self.assertEqual(decks['2']['date_update'], '2019-02-01')
+    self.assertEqual(decks['2']['side_code'], 'corp')
+
+def search_page(deck_ids):
+  links = ''.join('<a href="/en/decklist/%s/deck-%s">Deck</a>' % (deck_id, deck_id) for deck_id in deck_ids)
+  return ('<html><body>' + links + '</body></html>').encode()
+
+class DecklistCrawlerCase(unittest.TestCase):
+  def setUp(self):
+    self.decks = make_decks()
+    routes = {
+      '/find': search_page(['1', '2']),
+      '/find/2': search_page(['3', '1']),
+      '/find/3': search_page(['2']),
+      '/find/4': search_page(['4']),
+    }
+    for deck_id, deck in self.decks.items():
+      routes['/decklist/' + deck_id] = {'data': [deck]}
+    self.server = StandInServer(routes)
+    session = make_session(retries=0)
+    self.crawler = DecklistCrawler(session, url=self.server.url + 'find', per_second=0)
+    self.downloader = DeckDownloader(session, base_url=self.server.url, workers=2, per_second=0)
+
+  def tearDown(self):
+    self.server.close()
+
+  def test_parser_state_is_per_instance(self):
+    first = MyDeckParser()
+    first.feed_page(search_page(['1']).decode())
+    self.assertEqual(MyDeckParser().decks, set())
+
+  def test_stops_when_pages_run_out(self):
+    self.assertEqual(self.crawler.search([{'sort': 'popularity'}], 10), ['1', '2', '3'])
+    self.assertNotIn('/find/4', self.server.requests)
+
+  def test_iter_search_streams_the_crawl(self):
+    deck_ids = list(self.crawler.iter_search([{'sort': 'popularity'}, {'sort': 'date'}], 10))
+    self.assertEqual(sorted(deck_ids), ['1', '2', '3'])
+    self.assertNotIn('/find/4', self.server.requests)
+    missing = DecklistCrawler(make_session(retries=0), url=self.server.url + 'missing', per_second=0)
+    with self.assertRaises(requests.HTTPError):
+      list(missing.iter_search([{'sort': 'popularity'}], 10))
+
+class IngestPipelineCase(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.decks = make_decks()
+    for deck_id, deck in self.decks.items():
+      deck['name'] = 'Deck ' + deck_id
+      deck['side_code'] = deck['faction_code'] = ''
+    routes = {'/find': search_page(['3', '1']), '/find/2': search_page(['2', '3']), '/find/3': search_page([])}
+    for deck_id, deck in self.decks.items():
+      routes['/decklist/' + deck_id] = {'data': [deck]}
+    self.server = StandInServer(routes)
+    session = make_session(retries=0)
+    self.crawler = DecklistCrawler(session, url=self.server.url + 'find', per_second=0)
+    self.downloader = DeckDownloader(session, base_url=self.server.url, workers=2, per_second=0)
+    self.deck_file = os.path.join(self.tmp, 'decks.json')
+    self.csv_file = os.path.join(self.tmp, 'decks.csv')
+    self.id_file = os.path.join(self.tmp, 'deck_ids.txt')
+
+  def tearDown(self):
+    self.server.close()
+    shutil.rmtree(self.tmp)
+
+  def expected(self, deck_ids):
+    decks = OrderedDict()
+    for deck_id in deck_ids:
+      decks[deck_id] = dict(self.decks[deck_id])
+      classify_deck(decks[deck_id], make_cards())
+    return json.dumps(decks, indent=2)
+
+  def test_search_to_export_in_one_pass(self):
+    deck_ids = iter_ids(self.crawler.iter_search([{'sort': 'popularity'}], 10), self.id_file)
+    self.assertEqual(ingest(deck_ids, self.downloader, make_cards(), self.deck_file, self.csv_file), ['3', '1', '2'])
+    with open(self.deck_file) as f:
+      self.assertEqual(f.read(), self.expected(['3', '1', '2']))
+    with open(self.id_file) as f:
+      self.assertEqual(f.read().split(), ['3', '1', '2'])
+    with open(self.csv_file) as f:
+      rows = [dict(zip(self.decks['3'], row)) for row in csv.reader(f)]
+    self.assertEqual(sorted((row['name'], row['faction_code']) for row in rows),
+                     [('Deck 1', 'jinteki'), ('Deck 2', 'jinteki'), ('Deck 3', 'nbn')])
+    self.assertFalse(os.path.exists(self.deck_file + '.stream.partial'))
+
+  def test_search_into_incremental_refresh(self):
+    with open(self.deck_file, 'w') as f:
+      f.write(self.expected(['3']))
+    deck_ids = iter_ids(self.crawler.iter_search([{'sort': 'popularity'}], 10), self.id_file)
+    added, updated, removed = refresh_decks(deck_ids, self.deck_file, make_cards(), self.downloader, recheck=False,
+                                            csv_filename=self.csv_file)
+    self.assertEqual((sorted(added), updated, removed), (['1', '2'], [], []))
+    self.assertNotIn('/decklist/3', self.server.requests)
+    with open(self.deck_file) as f:
+      self.assertEqual(f.read(), self.expected(['3', '1', '2']))
+    with open(self.id_file) as f:
+      self.assertEqual(f.read().split(), ['3', '1', '2'])
+    with open(self.csv_file) as f:
+      self.assertEqual([row[list(self.decks['3']).index('name')] for row in csv.reader(f)], ['Deck 3', 'Deck 1', 'Deck 2'])
+
+  def test_resume_from_stream(self):
+    with open(self.deck_file + '.stream.partial', 'w') as f:
+      f.write(json.dumps({'id': '2', 'deck': classify_deck(dict(self.decks['2']), make_cards())}) + '\n')
+      f.write('{"id": "1", "de')
+    self.assertEqual(ingest(['1', '2', '1'], self.downloader, make_cards(), self.deck_file, self.csv_file), ['1', '2'])
+    self.assertEqual(self.server.requests, ['/decklist/1'])
+    with open(self.deck_file) as f:
+      self.assertEqual(f.read(), self.expected(['1', '2']))
+    with open(self.csv_file) as f:
+      self.assertEqual(len(list(csv.reader(f))), 2)
+
+  def test_downloader_partial_is_not_resumed(self):
+    # unclassified decks left by an interrupted incremental refresh
+    with open(self.deck_file + '.partial', 'w') as f:
+      f.write(json.dumps({'id': '2', 'deck': self.decks['2']}) + '\n')
+    self.assertEqual(ingest(['1', '2'], self.downloader, make_cards(), self.deck_file), ['1', '2'])
+    with open(self.deck_file) as f:
+      self.assertEqual(f.read(), self.expected(['1', '2']))
+
+class HttpCacheCase(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.server = StandInServer({'/cards': {'data': [1, 2]}, '/decklist/1': {'data': [make_decks()['1']]}})
+    self.server.etags['/cards'] = '"v1"'
+
+  def tearDown(self):
+    self.server.close()
+    shutil.rmtree(self.tmp)
+
+  def test_revalidates_with_etag(self):
+    session = CachedSession(self.tmp)
+    self.assertFalse(session.get(self.server.url + 'cards').from_cache)
+    response = session.get(self.server.url + 'cards')
+    self.assertTrue(response.from_cache)
+    self.assertEqual(response.json(), {'data': [1, 2]})
+    self.assertEqual(len(self.server.requests), 2)
+
+    self.server.routes['/cards'] = {'data': [3]}
+    self.server.etags['/cards'] = '"v2"'
+    self.assertEqual(session.get(self.server.url + 'cards').json(), {'data': [3]})
+
+  def test_offline_replay(self):
+    session = make_session(retries=0, cache_dir=self.tmp)
+    downloader = DeckDownloader(session, base_url=self.server.url, workers=1, per_second=0)
+    downloader.download(['1'])
+    self.server.close()
+
+    offline = make_session(retries=0, cache_dir=self.tmp, offline=True)
+    downloader = DeckDownloader(offline, base_url=self.server.url, workers=1, per_second=1)
+    self.assertEqual(downloader.download(['1'])['1'], make_decks()['1'])
+    self.assertTrue(offline.will_use_cache(self.server.url + 'decklist/1'))
+    with self.assertRaises(RuntimeError):
+      downloader.download(['2'])
+
+class CardUpdateCase(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.cards_file = os.path.join(self.tmp, 'cards.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def read_cards(self):
+    with open(self.cards_file) as f:
+      return json.load(f)
+
+  def test_resolve_maps_to(self):
+    cards = make_cards()
+    for card in cards.values():
+      card['maps_to'] = []
+    resolve_maps_to(cards)
+    self.assertEqual(cards['01001']['maps_to'], ['20001'])
+    self.assertEqual(cards['20001']['maps_to'], ['01001'])
+    self.assertEqual(cards['01002']['maps_to'], [])
+
+  def test_incremental_update(self):
+    self.assertEqual(len(update_cards(self.cards_file, api_cards())), len(make_cards()))
+    cards = self.read_cards()
+    self.assertEqual(cards['20001']['maps_to'], ['01001'])
+    self.assertEqual(cards['01002']['image_url'], 'https://netrunnerdb.com/card_image/01002.png')
+
+    self.assertEqual(update_cards(self.cards_file, api_cards()), [])
+
+    reprint = make_card('30001', 'Gate', faction='nbn', pack='sc19')
+    del reprint['maps_to']
+    self.assertEqual(update_cards(self.cards_file, api_cards() + [reprint]), ['30001'])
+    cards = self.read_cards()
+    self.assertEqual(cards['01002']['maps_to'], ['30001'])
+    self.assertEqual(cards['30001']['maps_to'], ['01002'])
+    self.assertEqual(cards['01001']['maps_to'], ['20001'])
+
+class MatrixTestCase(unittest.TestCase):
+  # The sample cards, decks and collection compiled, with one pair of decks
+  # per faction selected
+  def setUp(self):
+    self.cards = make_cards()
+    self.decks = make_decks()
+    self.collection = make_collection()
+    self.matrix = DemandMatrix(build_card_index(self.cards), self.decks, self.collection)
+    self.selected = [['1', '2'], ['3', '4'], ['5', '6']]
+
+class DemandMatrixCase(MatrixTestCase):
+  def test_alternate_printings_share_a_column(self):
+    self.assertNotIn('20001', self.matrix.card_codes)
+    self.assertEqual(self.matrix.check_combination(['2', '3']), {'01001': 1})
+
+  def test_matches_reference_check(self):
+    result = self.matrix.find_combinations(self.selected)
+    for combo in itertools.product(*self.selected):
+      expected = reference_check(self.cards, self.decks, combo, self.collection)
+      key = ','.join(combo)
+      group = 'invalid' if expected else 'valid'
+      self.assertEqual(list(result[group][key].items()), list(expected.items()))
+
+  def test_small_batches(self):
+    self.assertEqual(self.matrix.find_combinations(self.selected, batch_size=3),
+                     self.matrix.find_combinations(self.selected))
+
+class SearchCase(MatrixTestCase):
+  def test_same_results_as_exhaustive(self):
+    self.assertEqual(search_combinations(self.matrix, self.selected),
+                     self.matrix.find_combinations(self.selected))
+
+  def test_record_prefixes(self):
+    result = search_combinations(self.matrix, self.selected, record_prefixes=True)
+    self.assertEqual(result['valid'], self.matrix.find_combinations(self.selected)['valid'])
+    # decks 2 and 3 already need four copies of Wall
+    self.assertEqual(result['invalid']['2,3'], {'01001': 1})
+    self.assertNotIn('2,3,5', result['invalid'])
+
+class CompatibilityGraphCase(MatrixTestCase):
+  def test_pairwise_edges(self):
+    graph = CompatibilityGraph(self.matrix, self.selected)
+    # decks 2 and 3 need four copies of Wall between them
+    self.assertFalse(graph.edges[(0, 1)][1, 0])
+    self.assertTrue(graph.edges[(1, 0)][0, 0])
+
+  def test_enumerates_every_valid_combination(self):
+    result = enumerate_combinations(self.matrix, self.selected)
+    self.assertEqual(result['valid'], self.matrix.find_combinations(self.selected)['valid'])
+
+class LineupOptimiserCase(MatrixTestCase):
+  def setUp(self):
+    super(LineupOptimiserCase, self).setUp()
+    self.scores = {'1': 3.0, '2': 1.0, '3': 2.0, '4': 0.5, '5': 1.0, '6': 0.25}
+
+  def brute_force(self, k):
+    lineups = [combo for combo in itertools.product(*self.selected) if self.matrix.check_combination(combo) == {}]
+    return sorted(lineups, key=lambda combo: -sum(self.scores[d] for d in combo))[:k]
+
+  def test_matches_exhaustive_ranking(self):
+    result = LineupOptimiser(self.matrix, self.selected, self.scores).top(3)
+    self.assertTrue(result['optimal'])
+    self.assertEqual([tuple(lineup['decks']) for lineup in result['lineups']], self.brute_force(3))
+
+  def test_reports_gap_when_stopped(self):
+    result = LineupOptimiser(self.matrix, self.selected, self.scores).top(1, node_limit=1)
+    self.assertFalse(result['optimal'])
+    self.assertGreaterEqual(result['upper_bound'], sum(self.scores[d] for d in self.brute_force(1)[0]))
+
+  def test_deck_scores(self):
+    scores = deck_scores({
+      'new': {'date_update': '2020-01-01T00:00:00+00:00', 'tournament_badge': False},
+      'old': {'date_update': '2019-01-01T00:00:00+00:00', 'tournament_badge': True},
+    }, deck_weights={'old': 1.0}, half_life=365)
+    self.assertAlmostEqual(scores['new'], 1.0)
+    self.assertAlmostEqual(scores['old'], 0.5 + 0.5 + 1.0)
+
+class FeasibilityEstimatorCase(MatrixTestCase):
+  def setUp(self):
+    super(FeasibilityEstimatorCase, self).setUp()
+    self.valid = len(self.matrix.find_combinations(self.selected)['valid'])
+
+  def test_interval_covers_exact_share(self):
+    estimator = FeasibilityEstimator(self.matrix, self.selected, rng=np.random.default_rng(1), batch_size=512)
+    estimate = estimator.estimate(precision=0.02)
+    self.assertTrue(estimate['converged'])
+    self.assertLessEqual(estimate['interval'][1] - estimate['interval'][0], 0.04)
+    self.assertTrue(estimate['interval'][0] <= self.valid / 8.0 <= estimate['interval'][1])
+    self.assertEqual(estimate['missing_cards'][0]['card'], '01001')
+
+  def test_weights_and_sample_cap(self):
+    weights = {'1': 1.0, '2': 0.0, '3': 1.0, '4': 0.0, '5': 1.0, '6': 0.0}
+    estimate = FeasibilityEstimator(self.matrix, self.selected, weights, np.random.default_rng(1)).estimate(max_samples=100)
+    self.assertEqual(estimate['samples'], 100)
+    self.assertEqual(estimate['fraction'], float(self.matrix.check_combination(['1', '3', '5']) == {}))
+    self.assertIsNone(estimate['estimated_buildable'])
+
+  def test_wilson_interval(self):
+    low, high = wilson_interval(0, 100)
+    self.assertEqual(low, 0.0)
+    self.assertLess(high, 0.05)
+
+class PurchaseOptimiserCase(MatrixTestCase):
+  def setUp(self):
+    super(PurchaseOptimiserCase, self).setUp()
+    columns = self.matrix.card_columns
+    self.supply = {}
+    for pack, cards in (('core', {'01001': 3, '01002': 1}), ('extra', {'01004': 2}), ('wall', {'01001': 1})):
+      self.supply[pack] = np.zeros(len(self.matrix.card_codes), dtype=np.int32)
+      for code, quantity in cards.items():
+        self.supply[pack][columns[code]] += quantity
+
+  def buildable(self, packs):
+    available = self.matrix.available.copy()
+    for pack in packs:
+      available += self.supply[pack]
+    matrix = DemandMatrix.from_arrays(self.matrix.deck_ids, self.matrix.card_codes, self.matrix.deck_offsets,
+                                      self.matrix.deck_columns, self.matrix.deck_quantities, available, self.matrix.decks)
+    return len(matrix.find_combinations(self.selected)['valid'])
+
+  def test_gain_matches_rerun(self):
+    optimiser = PurchaseOptimiser(self.matrix, self.selected, self.supply)
+    self.assertEqual(optimiser.total, optimiser.sampled)
+    self.assertEqual(optimiser.baseline, self.buildable([]))
+    for packs in (['core'], ['extra'], ['wall'], ['core', 'extra'], ['extra', 'wall']):
+      self.assertEqual(optimiser.baseline + optimiser.gain(packs), self.buildable(packs))
+
+  def test_rankings(self):
+    optimiser = PurchaseOptimiser(self.matrix, self.selected, self.supply)
+    singles = optimiser.rank_packs()
+    self.assertEqual([entry['gain'] for entry in singles], sorted([entry['gain'] for entry in singles], reverse=True))
+    pairs = optimiser.rank_sets(2, costs={'core': 4.0})
+    self.assertEqual(len(pairs), 3)
+    self.assertEqual(pairs[-1]['cost'], 5.0)
+
+class ParallelCase(MatrixTestCase):
+  def setUp(self):
+    super(ParallelCase, self).setUp()
+    self.included = {'jinteki': True, 'nbn': True, 'haas-bioroid': True}
+
+  def test_shards_merge_to_serial_result(self):
+    with ParallelAnalyser(self.matrix, 2) as analyser:
+      shards = analyser.shards(self.selected)
+      result = analyser.find_combinations(self.selected)
+    self.assertEqual(result, self.matrix.find_combinations(self.selected))
+    self.assertEqual(len(shards), 1)
+
+  def test_seeded_iterations_are_deterministic(self):
+    with ParallelAnalyser(self.matrix, 2, prune=True) as analyser:
+      first = analyser.run_iterations('corp', self.decks, self.included, [], 1, 4, seed=3)
+      second = analyser.run_iterations('corp', self.decks, self.included, [], 1, 4, seed=3)
+    self.assertEqual(first, second)
+    self.assertTrue(len(first['valid']) > 0)
+
+  def test_spawned_workers_get_the_matrix(self):
+    # what every platform but Linux uses
+    with mock.patch('analyser.parallel.sys.platform', 'darwin'):
+      self.assertEqual(_pool_context().get_start_method(), 'spawn')
+      with ParallelAnalyser(self.matrix, 2) as analyser:
+        result = analyser.find_combinations(self.selected)
+    self.assertEqual(result, self.matrix.find_combinations(self.selected))
+
+class ResultStreamCase(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.stream_file = os.path.join(self.tmp, 'combinations.stream.jsonl')
+    self.sorted_file = os.path.join(self.tmp, 'combinations.jsonl')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def test_sort_and_write_findings(self):
+    records = [('3,1', {}), ('1,2', {'01001': 2, '01002': 1}), ('2,2', {}), ('1,2', {'01001': 2, '01002': 1}), ('1,1', {'01004': 3})]
+    with ResultWriter(self.stream_file) as writer:
+      for combo, missing_cards in records:
+        writer.write(combo, missing_cards)
+    self.assertEqual((writer.valid, writer.invalid), (2, 3))
+
+    sort_results(self.stream_file, self.sorted_file, chunk_size=2)
+    self.assertEqual([combo for combo, missing_cards in iter_results(self.sorted_file)], ['1,1', '1,2', '2,2', '3,1'])
+
+    findings_file = write_findings(self.sorted_file, os.path.join(self.tmp, 'findings.txt'))
+    expected = {
+      'valid': dict((combo, m) for combo, m in sorted(records) if not m),
+      'invalid': dict((combo, m) for combo, m in sorted(records) if m),
+    }
+    with open(findings_file) as f:
+      self.assertEqual(f.read(), json.dumps(expected, indent=2))
+
+  def test_empty_groups(self):
+    with ResultWriter(self.stream_file) as writer:
+      writer.write('1,2', {})
+    sort_results(self.stream_file, self.sorted_file)
+    findings_file = write_findings(self.sorted_file, os.path.join(self.tmp, 'findings.txt'))
+    with open(findings_file) as f:
+      self.assertEqual(f.read(), json.dumps({'valid': {'1,2': {}}, 'invalid': {}}, indent=2))
+
+class CombinationStoreCase(unittest.TestCase):
+  def setUp(self):
+    self.decks = make_decks()
+    matrix = DemandMatrix(build_card_index(make_cards()), self.decks, make_collection())
+    self.result = matrix.find_combinations([['1', '2'], ['3', '4'], ['5', '6']])
+    self.store = CombinationStore(':memory:')
+    self.store.add_decks(self.decks)
+    results = list(self.result['valid'].items()) + list(self.result['invalid'].items())
+    self.store.add_results('corp', results + results)
+
+  def tearDown(self):
+    self.store.close()
+
+  def test_queries(self):
+    self.assertEqual(self.store.combos('corp'), sorted(self.result['valid']))
+    self.assertEqual(self.store.combos('corp', valid=False), sorted(self.result['invalid']))
+    self.assertEqual(self.store.combos_with_deck('3'), sorted(c for c in self.result['valid'] if '3' in c.split(',')))
+    self.assertEqual(set(self.store.combos_missing_at_most('corp', 1)),
+                     set(c for g in self.result.values() for c in g if sum(g[c].values()) <= 1))
+    factions = self.store.faction_decks('corp')
+    self.assertEqual(list(factions), ['jinteki', 'nbn', 'haas-bioroid'])
+
+  def test_missing_cards_and_clear(self):
+    combo_id = self.store.db.execute("SELECT id FROM combos WHERE combo = '2,3,5'").fetchone()[0]
+    self.assertEqual(list(self.store.missing_cards(combo_id).items()), list(self.result['invalid']['2,3,5'].items()))
+    self.store.clear('corp')
+    self.assertEqual(self.store.combos('corp'), [])
+    self.assertEqual(self.store.db.execute('SELECT COUNT(*) FROM missing_cards').fetchone()[0], 0)
+
+class BlockingIndexCase(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.results = [
+      ('1,3', {}),
+      ('1,3', {}),
+      ('1,4', {'01001': 1}),
+      ('2,3', {'01001': 2}),
+      ('2,4', {'01002': 1, '01003': 1}),
+      ('1,5', {'01002': 3}),
+      ('2,5', {'01001': 1, '01002': 1}),
+      ('1,4', {'01001': 1}),
+    ]
+    # combinations met again in later iterations are counted once, as the
+    # findings list them
+    self.index = BlockingIndex()
+    deck_analyser.write_combinations(os.path.join(self.tmp, 'findings.txt'), iter(self.results), self.index)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def test_cards_and_pairs(self):
+    self.assertEqual(self.index.blocked_by('01002'), [('1,5', 3), ('2,4', 1), ('2,5', 1)])
+    self.assertEqual(self.index.top_cards(), [
+      {'card': '01001', 'unlocks': 2, 'copies': 2},
+      {'card': '01002', 'unlocks': 1, 'copies': 3},
+    ])
+    self.assertEqual(self.index.top_pairs(2), [
+      {'cards': ['01001', '01002'], 'unlocks': 4, 'copies': [2, 3]},
+      {'cards': ['01002', '01003'], 'unlocks': 2, 'copies': [3, 1]},
+    ])
+    self.assertEqual(self.index.missing_at_most(2), [('1,4', 1), ('2,3', 2), ('2,4', 2), ('2,5', 2)])
+    self.assertEqual(self.index.summary(1)['missing_at_most'], {'1': 1, '2': 4, '3': 5})
+    self.assertEqual((self.index.summary()['valid'], self.index.summary()['invalid']), (1, 5))
+
+  def test_stream_mode_builds_the_same_index(self):
+    index = BlockingIndex()
+    deck_analyser.stream_combinations(os.path.join(self.tmp, 'streamed.txt'), iter(self.results), index)
+    self.assertEqual(sorted(os.listdir(self.tmp)), ['findings.txt', 'streamed.jsonl', 'streamed.txt'])
+    self.assertEqual(index.summary(), self.index.summary())
+    self.assertEqual(index.blocked_by('01001'), self.index.blocked_by('01001'))
+
+  def test_saved_index_answers_the_same(self):
+    filename = os.path.join(self.tmp, 'blocking.npz')
+    self.index.save(filename)
+    loaded = load_blocking_index(filename)
+    self.assertEqual(loaded.summary(), self.index.summary())
+    self.assertEqual(loaded.blocked_by('01001'), self.index.blocked_by('01001'))
+
+  def test_pairs_match_brute_force(self):
+    rng = random.Random(5)
+    cards = ['%05d' % i for i in range(8)]
+    results = [(str(i), {card: rng.randint(1, 3) for card in rng.sample(cards, rng.randint(1, 3))}) for i in range(300)]
+    index = BlockingIndex()
+    for combo, missing_cards in results:
+      index.add(combo, missing_cards)
+    unlocks = []
+    for pair in itertools.combinations(cards, 2):
+      unlocked = [set(missing_cards) for combo, missing_cards in results if set(missing_cards) <= set(pair)]
+      if set(pair) <= set().union(*unlocked):
+        unlocks.append(len(unlocked))
+    unlocks.sort(reverse=True)
+    self.assertEqual([pair['unlocks'] for pair in index.top_pairs(5)], unlocks[:5])
+
+class ImageCacheCase(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.cache_dir = os.path.join(self.tmp, 'images')
+    self.images = {code: placeholder_png(shade) for shade, code in enumerate(sorted(make_cards()))}
+    self.server = StandInServer(dict(('/card_image/%s.png' % code, data) for code, data in self.images.items()))
+    self.size = len(self.images['01001'])
+
+  def tearDown(self):
+    self.server.close()
+    shutil.rmtree(self.tmp)
+
+  def image_cache(self, **kwargs):
+    return ImageCache(self.cache_dir, session=make_session(retries=0), per_second=0, **kwargs)
+
+  def urls(self, codes):
+    return [(code, self.server.url + 'card_image/%s.png' % code) for code in codes]
+
+  def test_prefetch_deck_then_hits_without_requests(self):
+    with self.image_cache(decode=len) as cache:
+      images = deck_images(make_decks()['1'], make_cards())
+      self.assertEqual(images[0][0], '01005')
+      futures = cache.prefetch(self.urls([code for code, url in images]))
+      self.assertEqual(sorted(futures), ['01001', '01004', '01005'])
+      self.assertEqual([futures[code].result() for code in sorted(futures)], [self.size] * 3)
+      self.assertEqual(cache.fetched, 3)
+      self.assertEqual(cache.prefetch(self.urls(['01001'])), {})
+      self.assertEqual(cache.thumbnail('01004'), self.size)
+    self.assertEqual(len(self.server.requests), 3)
+
+    # a new cache finds the files on disk and decodes them again
+    with self.image_cache() as cache:
+      self.assertEqual(cache.thumbnail('01001'), self.images['01001'])
+      self.assertEqual(cache.get('01005', None), self.images['01005'])
+      self.assertIsNone(cache.thumbnail('01002'))
+    self.assertEqual(len(self.server.requests), 3)
+
+  def test_least_recently_used_leave_first(self):
+    with self.image_cache(max_bytes=self.size * 2, thumbnails=1) as cache:
+      for code, url in self.urls(['01001', '01002']):
+        cache.get(code, url)
+      cache.thumbnail('01001')
+      code, url = self.urls(['01003'])[0]
+      cache.get(code, url)
+      self.assertEqual(list(cache.files), ['01001', '01003'])
+      self.assertEqual(sorted(os.listdir(self.cache_dir)), ['01001.img', '01003.img'])
+      self.assertEqual(cache.total, self.size * 2)
+      self.assertEqual(list(cache.thumbnails), ['01003'])
+
+  def test_failed_fetch_is_not_cached(self):
+    with self.image_cache() as cache:
+      future = cache.prefetch(self.urls(['99999']))['99999']
+      self.assertRaises(requests.HTTPError, future.result)
+      self.assertEqual(list(cache.files), [])
+
+  def test_close_drops_queued_fetches(self):
+    started, release = threading.Event(), threading.Event()
+    def decode(data):
+      started.set()
+      release.wait(5)
+      return len(data)
+    cache = self.image_cache(workers=1, decode=decode)
+    futures = cache.prefetch(self.urls(['01001', '01002', '01003']))
+    started.wait(5)
+    cache.close(wait=False)
+    self.assertTrue(futures['01002'].cancelled() and futures['01003'].cancelled())
+    release.set()
+    self.assertEqual(futures['01001'].result(), self.size)
+
+class ComboIndexCase(unittest.TestCase):
+  def setUp(self):
+    decks = make_decks()
+    decks['7'] = make_deck('haas-bioroid', {})
+    combos = ['1,3,5', '1,4,6', '2,3,6', '2,4,7']
+    self.index = ComboIndex(decks, combos)
+
+  def test_selection_narrows_other_factions(self):
+    self.assertEqual(self.index.factions, ['jinteki', 'nbn', 'haas-bioroid'])
+    self.assertEqual(self.index.faction_decks(),
+                     {'jinteki': {'1', '2'}, 'nbn': {'3', '4'}, 'haas-bioroid': {'5', '6', '7'}})
+    self.assertEqual(self.index.faction_decks(['1']),
+                     {'jinteki': {'1', '2'}, 'nbn': {'3', '4'}, 'haas-bioroid': {'5', '6'}})
+    self.assertEqual(self.index.faction_decks(['1', '6']),
+                     {'jinteki': {'1', '2'}, 'nbn': {'4'}, 'haas-bioroid': {'5', '6'}})
+    self.assertEqual(self.index.matching(['6']), ['1,4,6', '2,3,6'])
+    self.assertEqual(self.index.count(['2', '4']), 1)
+    self.assertEqual(self.index.matching(['1', '7']), [])
+
+  def test_matches_a_scan_of_the_combinations(self):
+    rng = random.Random(3)
+    decks = {str(i): make_deck(('jinteki', 'nbn', 'haas-bioroid')[i % 3], {}) for i in range(30)}
+    by_faction = [[deck_id for deck_id in decks if int(deck_id) % 3 == f] for f in range(3)]
+    combos = sorted(set(','.join(rng.choice(ids) for ids in by_faction) for i in range(200)))
+    index = ComboIndex(decks, combos)
+    for trial in range(20):
+      selected = [rng.choice(ids) for ids in by_faction if rng.random() < 0.5]
+      expected = [combo for combo in combos if set(selected) <= set(combo.split(','))]
+      self.assertEqual(index.matching(selected), expected)
+
+class ComboTableCase(unittest.TestCase):
+  def setUp(self):
+    decks = make_decks()
+    for deck_id, name in zip(sorted(decks), ('Beta', 'Alpha', 'Delta', 'Charlie', 'Echo', 'Foxtrot')):
+      decks[deck_id]['name'] = name
+    self.table = ComboTable(decks, ['1,3,5', '1,4,6', '2,3,6', '2,4'], [0, 3, 1, 0])
+
+  def rows(self):
+    return [self.table.combo(row) for row in range(len(self.table))]
+
+  def test_cells(self):
+    self.assertEqual(self.table.cell(0, 0), 'Beta / Delta / Echo')
+    self.assertEqual(self.table.cell(1, 1), 'jinteki / nbn / haas-bioroid')
+    self.assertEqual(self.table.cell(1, 2), '3')
+    self.assertEqual(self.table.cell(3, 0), 'Alpha / Charlie')
+
+  def test_sort_and_filter(self):
+    self.table.sort(0)
+    self.assertEqual(self.rows(), ['2,4', '2,3,6', '1,4,6', '1,3,5'])
+    self.table.sort(2, descending=True)
+    self.assertEqual(self.rows(), ['1,4,6', '2,3,6', '2,4', '1,3,5'])
+    self.table.filter(['6'])
+    self.assertEqual(self.rows(), ['1,4,6', '2,3,6'])
+    self.table.sort(2)
+    self.assertEqual(self.rows(), ['2,3,6', '1,4,6'])
+    self.table.filter(['2', '4'])
+    self.assertEqual(self.rows(), ['2,4'])
+    self.table.filter()
+    self.assertEqual(len(self.table), 4)
+
+class ViewerDataCase(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.files = {}
+    for name, data in (('cards', make_cards()), ('decks', make_decks())):
+      self.files[name] = os.path.join(self.tmp, name + '.json')
+      with open(self.files[name], 'w') as f:
+        f.write(json.dumps(data))
+    self.sides = OrderedDict([
+      ('Corporations', ('corp', os.path.join(self.tmp, 'corp.json'))),
+      ('Runners', ('runner', os.path.join(self.tmp, 'runner.json'))),
+    ])
+    with ResultWriter(os.path.join(self.tmp, 'corp.jsonl')) as writer:
+      for combo in ('1,3', '1,4', '2,3', '2,4'):
+        writer.write(combo, {} if combo != '2,3' else {'01001': 1})
+    with open(self.sides['Runners'][1], 'w') as f:
+      f.write(json.dumps({'valid': {'5': {}}, 'invalid': {}}))
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def viewer_data(self, store_file=None):
+    return ViewerData(self.files['cards'], self.files['decks'], store_file, self.sides, chunk_size=1,
+                      snapshot_dir=os.path.join(self.tmp, 'snapshot'))
+
+  def test_sides_become_ready_in_turn(self):
+    data = self.viewer_data()
+    progress = []
+    ready = []
+    data.load(lambda side, fraction: progress.append((side, fraction)),
+              lambda side: ready.append((side, data.ready('Corporations'), data.ready('Runners'))))
+    self.assertEqual(ready, [('Corporations', True, False), ('Runners', True, True)])
+    self.assertEqual(progress[0], (None, 1.0))
+    corp_progress = [fraction for side, fraction in progress if side == 'Corporations']
+    self.assertEqual(len(corp_progress), 5)
+    self.assertEqual(corp_progress, sorted(corp_progress))
+    self.assertEqual(data.matching('Corporations'), ['1,3', '1,4', '2,4'])
+    self.assertEqual(data.count('Corporations', ['2']), 1)
+    table = data.tables['Corporations']
+    self.assertEqual([table.cell(row, 2) for row in range(len(table))], ['0', '0', '1', '0'])
+    self.assertEqual(data.faction_decks('Corporations'), {'jinteki': {'1', '2'}, 'nbn': {'3', '4'}})
+    self.assertEqual(data.faction_decks('Corporations', ['2']), {'jinteki': {'1', '2'}, 'nbn': {'4'}})
+    self.assertEqual(data.faction_decks('Runners'), {'haas-bioroid': {'5'}})
+
+  def test_default_analyser_outputs(self):
+    # what the analyser writes with its default settings, under the names the
+    # viewer looks for
+    findings = [side[4] for side in deck_analyser.side_settings()]
+    self.assertEqual([filename for code, filename in SIDES.values()], findings)
+    sides = OrderedDict((side, (code, os.path.join(self.tmp, filename))) for side, (code, filename) in SIDES.items())
+    deck_analyser.write_combinations(sides['Corporations'][1], [('1,3', {}), ('2,3', {'01001': 1})])
+    deck_analyser.write_combinations(sides['Runners'][1], [('5', {})])
+    data = ViewerData(self.files['cards'], self.files['decks'], None, sides, snapshot_dir=os.path.join(self.tmp, 'snapshot'))
+    data.load()
+    self.assertEqual(data.matching('Corporations'), ['1,3'])
+    self.assertEqual(data.matching('Runners'), ['5'])
+    self.assertEqual(len(data.tables['Corporations']), 2)
+
+  def test_store_combinations(self):
+    store_file = os.path.join(self.tmp, 'combinations.db')
+    with CombinationStore(store_file) as store:
+      store.add_decks(make_decks())
+      store.add_results('corp', [('1,3', {}), ('2,3', {'01001': 1})])
+    data = self.viewer_data(store_file)
+    self.assertFalse(data.ready('Corporations'))
+    data.load()
+    self.assertEqual(data.matching('Corporations'), ['1,3'])
+    self.assertEqual(data.faction_decks('Corporations'), {'jinteki': {'1'}, 'nbn': {'3'}})
+
+  def test_store_loads_on_worker_thread(self):
+    # the viewer builds ViewerData on the main thread and loads it on another
+    store_file = os.path.join(self.tmp, 'combinations.db')
+    with CombinationStore(store_file) as store:
+      store.add_decks(make_decks())
+      store.add_results('corp', [('1,3', {}), ('2,3', {'01001': 1})])
+    data = self.viewer_data(store_file)
+    errors = []
+    def load():
+      try:
+        data.load()
+      except Exception as e:
+        errors.append(e)
+    loader = threading.Thread(target=load)
+    loader.start()
+    loader.join()
+    self.assertEqual(errors, [])
+    self.assertTrue(data.ready('Runners'))
+    self.assertEqual(data.matching('Corporations'), ['1,3'])
+    table = data.tables['Corporations']
+    self.assertEqual([table.cell(row, 2) for row in range(len(table))], ['0', '1'])
+
+class MatrixCacheCase(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.files = []
+    for name, data in (('cards', make_cards()), ('decks', make_decks()), ('collection', make_collection())):
+      filename = os.path.join(self.tmp, name + '.json')
+      with open(filename, 'w') as f:
+        f.write(json.dumps(data))
+      self.files.append(filename)
+    self.cache_dir = os.path.join(self.tmp, 'matrix_cache')
+    self.snapshot_dir = os.path.join(self.tmp, 'snapshot')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def test_cache_is_reused_until_inputs_change(self):
+    built = load_matrix(*self.files, cache_dir=self.cache_dir, snapshot_dir=self.snapshot_dir)
+    cached = load_matrix(*self.files, cache_dir=self.cache_dir, snapshot_dir=self.snapshot_dir)
+    self.assertEqual(cached.deck_ids, built.deck_ids)
+    self.assertEqual(cached.decks['3']['faction_code'], 'nbn')
+    self.assertEqual(cached.find_combinations([['1', '2'], ['3', '4']]), built.find_combinations([['1', '2'], ['3', '4']]))
+
+    collection = make_collection()
+    collection['01001'] = 9
+    with open(self.files[2], 'w') as f:
+      f.write(json.dumps(collection))
+    rebuilt = load_matrix(*self.files, cache_dir=self.cache_dir, snapshot_dir=self.snapshot_dir)
+    self.assertEqual(rebuilt.check_combination(['2', '3']), {})
+    # the matrix mapped before the rebuild still reads the old arrays
+    self.assertEqual(cached.check_combination(['2', '3']), built.check_combination(['2', '3']))
+
+  def test_interrupted_save_is_not_read(self):
+    matrix = load_matrix(*self.files, cache_dir=self.cache_dir, snapshot_dir=self.snapshot_dir)
+    hashes = input_hashes(*self.files)
+    class Unwritable(object):
+      def __array__(self, *args, **kwargs):
+        raise OSError('disk full')
+    failing = DemandMatrix.from_arrays(matrix.deck_ids, matrix.card_codes, matrix.deck_offsets, Unwritable(),
+                                       matrix.deck_quantities, matrix.available, decks=matrix.decks)
+    self.assertRaises(OSError, save_matrix, failing, hashes, self.cache_dir)
+    self.assertIsNone(read_matrix(hashes, self.cache_dir))
+
+class SnapshotCase(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.cards = make_cards()
+    self.cards['01001']['flavor'] = 'Long flavor text'
+    self.decks = make_decks()
+    self.decks['3']['name'] = 'Fast Advance'
+    self.decks['3']['description'] = '<p>Long description</p>'
+    self.decks['3']['cards'] = {'01006': 1, '01001': 1, '01002': 2, '20001': 1}
+    self.files = []
+    for name, data in (('cards', self.cards), ('decks', self.decks)):
+      filename = os.path.join(self.tmp, name + '.json')
+      with open(filename, 'w') as f:
+        f.write(json.dumps(data))
+      self.files.append(filename)
+    self.snapshot = load_snapshot(*self.files, snapshot_dir=os.path.join(self.tmp, 'snapshot'))
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def test_same_matrix_as_json(self):
+    matrix = DemandMatrix(build_card_index(self.cards), self.decks, make_collection())
+    snapshot_matrix = self.snapshot.demand_matrix(make_collection())
+    self.assertEqual(snapshot_matrix.card_codes, matrix.card_codes)
+    for name in ('deck_offsets', 'deck_columns', 'deck_quantities'):
+      self.assertTrue((getattr(snapshot_matrix, name) == getattr(matrix, name)).all())
+    self.assertEqual(snapshot_matrix.check_combination(['3', '5']), matrix.check_combination(['3', '5']))
+    self.assertEqual(self.snapshot.card_index(), build_card_index(self.cards))
+
+  def test_text_is_loaded_on_demand(self):
+    self.assertIsNone(self.snapshot.deck_text)
+    self.assertEqual(self.snapshot.decks()['3'], {'name': 'Fast Advance', 'side_code': 'corp', 'faction_code': 'nbn'})
+    deck = self.snapshot.deck_details('3')
+    self.assertEqual(deck['description'], '<p>Long description</p>')
+    self.assertEqual(list(deck['cards'].items()), list(self.decks['3']['cards'].items()))
+    card = self.snapshot.card_details('01001')
+    self.assertEqual((card['flavor'], card['title'], card['quantity']), ('Long flavor text', 'Wall', 3))
+
+class SyntheticCorpusCase(unittest.TestCase):
+  def test_corpus_is_consistent_and_repeatable(self):
+    cards, decks, packs = generate_corpus(0.1, seed=3)
+    self.assertEqual((len(cards), len(decks)), (155, 60))
+    self.assertEqual(generate_corpus(0.1, seed=3)[1], decks)
+    for deck in decks.values():
+      classified = classify_deck(dict(deck), cards)
+      self.assertEqual((classified['side_code'], classified['faction_code']), (deck['side_code'], deck['faction_code']))
+    self.assertEqual(set(packs), set(card['pack_code'] for card in cards.values()))
+    matrix = DemandMatrix(build_card_index(cards), decks, {})
+    self.assertEqual(len(matrix.deck_offsets), 61)
+
+class StageRunnerCase(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.source = os.path.join(self.tmp, 'source.txt')
+    self.middle = os.path.join(self.tmp, 'middle.txt')
+    self.final = os.path.join(self.tmp, 'final.txt')
+    self.runs = []
+    self.settings = {'scale': 2}
+    with open(self.source, 'w') as f:
+      f.write('3')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def copy(self, name, source, target, transform):
+    def action():
+      self.runs.append(name)
+      with open(source) as f:
+        value = f.read()
+      with open(target, 'w') as f:
+        f.write(transform(value))
+    return action
+
+  def runner(self):
+    return StageRunner([
+      Stage('final', self.copy('final', self.middle, self.final, lambda value: value + '!'),
+            inputs=[self.middle], outputs=[self.final]),
+      Stage('middle', self.copy('middle', self.source, self.middle, lambda value: str(int(value) % 2 * self.settings['scale'])),
+            inputs=[self.source], outputs=[self.middle], settings=self.settings),
+    ], os.path.join(self.tmp, 'state.json'))
+
+  def test_only_stale_stages_rerun(self):
+    self.assertEqual(list(self.runner().run(['final'])), ['middle', 'final'])
+    self.runs = []
+    self.runner().run(['final'])
+    self.assertEqual(self.runs, [])
+
+    # Same middle output from a changed input: the final stage stays up to date
+    with open(self.source, 'w') as f:
+      f.write('5')
+    self.runner().run(['final'])
+    self.assertEqual(self.runs, ['middle'])
+
+    self.settings['scale'] = 3
+    self.runner().run(['final'])
+    self.assertEqual(self.runs, ['middle', 'middle', 'final'])
+
+  def test_force_and_missing_outputs(self):
+    self.runner().run(['final'])
+    self.runs = []
+    self.runner().run(['final'], force=True)
+    self.assertEqual(self.runs, ['final'])
+    os.remove(self.middle)
+    self.runner().run(['final'])
+    self.assertEqual(self.runs, ['final', 'middle'])
+    with self.assertRaises(KeyError):
+      self.runner().run(['unknown'])
+
+  def test_source_stage_ignores_changed_inputs(self):
+    # like the decks crawl, which depends on cards.json but should only
+    # reach the network when its outputs are missing or it is asked for
+    config = os.path.join(self.tmp, 'config.txt')
+    with open(config, 'w') as f:
+      f.write('3')
+    def runner():
+      return StageRunner([
+        Stage('middle', self.copy('middle', self.source, self.middle, lambda value: value),
+              inputs=[config], outputs=[self.middle], settings=self.settings, source=True),
+        Stage('final', self.copy('final', self.middle, self.final, lambda value: value + '!'),
+              inputs=[self.middle], outputs=[self.final]),
+      ], os.path.join(self.tmp, 'state.json'))
+    runner().run(['final'])
+    self.assertEqual(self.runs, ['middle', 'final'])
+    self.runs = []
+    with open(config, 'w') as f:
+      f.write('4')
+    self.settings['scale'] = 3
+    runner().run(['final'])
+    self.assertEqual(self.runs, [])
+    runner().run(['middle'])
+    self.assertEqual(self.runs, ['middle'])
+
+class CardIndexCase(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.cards_file = os.path.join(self.tmp, 'cards.json')
+    self.write_cards(make_cards())
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def write_cards(self, cards):
+    with open(self.cards_file, 'w') as f:
+      f.write(json.dumps(cards))
+
+  def test_index_is_cached_by_hash(self):
+    index = load_card_index(self.cards_file)
+    self.assertEqual(index['20001'], '01001')
+    self.assertTrue(os.path.exists(os.path.join(self.tmp, 'cards_index.json')))
+
+    cards = make_cards()
+    cards['01009'] = make_card('01009', 'Wall', pack='wla')
+    self.write_cards(cards)
+    self.assertEqual(load_card_index(self.cards_file)['01009'], '01009')
+
+  def test_build_does_not_mutate_cards(self):
+    cards = make_cards()
+    build_card_index(cards)
+    build_card_index(cards)
+    self.assertEqual(cards['01001']['maps_to'], ['20001'])
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)